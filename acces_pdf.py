@@ -1,5 +1,6 @@
 import os
 import fitz  # PyMuPDF
+import numpy as np
 import time
 import logging
 from tqdm import tqdm
@@ -8,8 +9,35 @@ import subprocess
 import sys
 import shutil
 import argparse
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import threading
+import hashlib
+import json
+import re
+import sqlite3
+import inspect
+import functools
+import csv
+import html
+import contextlib
+from collections import deque
+from concurrent.futures import Executor, Future, wait, FIRST_COMPLETED
 import multiprocessing
+from multiprocessing.connection import wait as wait_connections
+
+# Versión de la herramienta (registrada en el manifiesto de cada lote)
+TOOL_VERSION = "2.1.0"
+
+# Motor OCR en proceso (opcional): evita lanzar un proceso de Tesseract por página
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+# Medición de memoria de los workers (opcional; en Linux se usa /proc si no está)
+try:
+    import psutil
+except ImportError:
+    psutil = None
 
 # Configuración de logging
 logging.basicConfig(
@@ -18,6 +46,114 @@ logging.basicConfig(
     filename='pdf_scanned_accessibility.log'
 )
 
+class DocumentMetrics:
+    """Tiempos por etapa (spans) y contadores del procesamiento de un documento.
+    
+    Etapas: open, classify, layout, render, preprocess, ocr, image_layer, text_insert,
+    tagging, optimize, save y verify; los spans de página llevan su número. Se rellena
+    en el worker que procesa el documento y viaja de vuelta como diccionario (to_dict)
+    para agregarse en el informe del lote (RunReport).
+    """
+    
+    def __init__(self, document):
+        self.document = document
+        self.spans = []
+        self.counters = {}
+        self.validation = None
+    
+    @contextlib.contextmanager
+    def span(self, stage, page=None):
+        """Mide la duración del bloque como un span de la etapa indicada."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(stage, time.perf_counter() - start, page)
+    
+    def add_span(self, stage, seconds, page=None):
+        """Registra un span ya medido (p. ej. en otro worker)."""
+        self.spans.append({'stage': stage, 'page': page, 'seconds': round(seconds, 6)})
+    
+    def count(self, name, value=1):
+        """Incrementa un contador del documento."""
+        self.counters[name] = self.counters.get(name, 0) + value
+    
+    def to_dict(self):
+        """Representación serializable para devolverla desde el worker."""
+        return {'document': self.document, 'spans': self.spans, 'counters': self.counters,
+                'validation': self.validation}
+
+class RunReport:
+    """Informe de un lote: métricas de cada documento y sus totales por etapa y contador."""
+    
+    def __init__(self):
+        self.documents = []
+    
+    def add(self, metrics):
+        """Añade las métricas (to_dict) de un documento."""
+        if metrics:
+            self.documents.append(metrics)
+    
+    def totals(self):
+        """Devuelve ({etapa: [segundos, spans]}, {contador: total}) del lote."""
+        stages = {}
+        counters = {}
+        for metrics in self.documents:
+            for span in metrics['spans']:
+                total = stages.setdefault(span['stage'], [0.0, 0])
+                total[0] += span['seconds']
+                total[1] += 1
+            for name, value in metrics['counters'].items():
+                counters[name] = counters.get(name, 0) + value
+        return stages, counters
+    
+    def write_json(self, path):
+        """Escribe el informe completo en JSON."""
+        stages, counters = self.totals()
+        report = {
+            'tool_version': TOOL_VERSION,
+            'generated': time.time(),
+            'stages': {stage: {'seconds': round(seconds, 6), 'spans': count}
+                       for stage, (seconds, count) in stages.items()},
+            'counters': counters,
+            'validation': {
+                'checked': sum(1 for metrics in self.documents if metrics.get('validation')),
+                'invalid': sum(1 for metrics in self.documents
+                               if metrics.get('validation') and not metrics['validation']['valid'])
+            },
+            'documents': self.documents
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+    
+    def write_csv(self, path):
+        """Escribe un span por fila (documento, página, etapa, segundos)."""
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['document', 'page', 'stage', 'seconds'])
+            for metrics in self.documents:
+                for span in metrics['spans']:
+                    page = '' if span['page'] is None else span['page'] + 1
+                    writer.writerow([metrics['document'], page, span['stage'], span['seconds']])
+    
+    def write_prometheus(self, path):
+        """Escribe los totales en el formato de texto de Prometheus."""
+        stages, counters = self.totals()
+        lines = [
+            "# HELP pdf_accesible_stage_seconds Tiempo total por etapa del procesamiento.",
+            "# TYPE pdf_accesible_stage_seconds summary"
+        ]
+        for stage, (seconds, count) in sorted(stages.items()):
+            lines.append(f'pdf_accesible_stage_seconds_sum{{stage="{stage}"}} {seconds:.6f}')
+            lines.append(f'pdf_accesible_stage_seconds_count{{stage="{stage}"}} {count}')
+        for name, value in sorted(counters.items()):
+            lines.append(f"# TYPE pdf_accesible_{name}_total counter")
+            lines.append(f"pdf_accesible_{name}_total {value}")
+        lines.append("# TYPE pdf_accesible_documents_total counter")
+        lines.append(f"pdf_accesible_documents_total {len(self.documents)}")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+
 def setup_directories(input_dir, output_dir, temp_dir):
     """Verifica y crea los directorios necesarios."""
     for directory in [input_dir, output_dir, temp_dir]:
@@ -36,394 +172,2575 @@ def check_tesseract_installed():
     except (subprocess.CalledProcessError, FileNotFoundError):
         return False
 
-def apply_ocr_to_page(page, language="spa", dpi=300):
-    """Aplica OCR a una página y devuelve el texto reconocido."""
+# Parámetros de Tesseract comunes a todos los motores OCR
+TESSERACT_FLAGS = [
+    "--psm", "1",  # Modo de segmentación de página automático
+    "--oem", "3",  # Motor de OCR: LSTM neural net
+    "-c", "preserve_interword_spaces=1",
+    "-c", "textord_min_linesize=2.5"
+]
+
+# Motores OCR disponibles: 'subprocess' es el camino clásico con PNG y TXT temporales
+# 'fake' no reconoce nada: genera palabras deterministas para medir y probar sin Tesseract
+OCR_BACKENDS = ("auto", "subprocess", "stdin", "tesserocr", "fake")
+
+# APIs de tesserocr por idioma, cargadas una vez por proceso
+_tesserocr_apis = {}
+
+def resolve_ocr_backend(backend="auto"):
+    """Resuelve el motor OCR a usar ('auto' elige el más rápido disponible)."""
+    if backend == "auto":
+        return "tesserocr" if tesserocr is not None else "stdin"
+    if backend == "tesserocr" and tesserocr is None:
+        logging.warning("tesserocr no está instalado. Usando Tesseract por stdin.")
+        return "stdin"
+    return backend
+
+def render_page_for_ocr(page, dpi=300, backend="stdin"):
+    """Renderiza la página para OCR (en escala de grises salvo en el camino clásico)."""
+    matrix = fitz.Matrix(dpi/72, dpi/72)
+    if backend == "subprocess":
+        return page.get_pixmap(matrix=matrix)
+    return page.get_pixmap(matrix=matrix, colorspace=fitz.csGRAY, alpha=False)
+
+def ocr_pixmap_subprocess(pix, language="spa", output_format="txt", dpi=None):
+    """OCR clásico: guarda un PNG temporal y lee el resultado desde disco."""
+    img_path = tempfile.mktemp(suffix='.png')
+    output_base = tempfile.mktemp()
     try:
-        # Renderizar la página como imagen con mayor resolución para mejor OCR
-        pix = page.get_pixmap(matrix=fitz.Matrix(dpi/72, dpi/72))
-        img_path = tempfile.mktemp(suffix='.png')
         pix.save(img_path)
         
         # Aplicar OCR con Tesseract con configuración mejorada
-        output_base = tempfile.mktemp()
-        subprocess.run([
-            "tesseract",
-            img_path,
-            output_base,
-            "-l", language,
-            "--psm", "1",  # Modo de segmentación de página automático
-            "--oem", "3",  # Motor de OCR: LSTM neural net
-            "-c", "preserve_interword_spaces=1",
-            "-c", "textord_min_linesize=2.5"
-        ], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        command = ["tesseract", img_path, output_base, "-l", language] + TESSERACT_FLAGS
+        if dpi:
+            command += ["--dpi", str(dpi)]
+        if output_format != "txt":
+            command.append(output_format)
+        subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         
         # Leer el texto resultante
-        text_file = f"{output_base}.txt"
-        with open(text_file, 'r', encoding='utf-8') as f:
-            text = f.read()
-        
+        with open(f"{output_base}.{output_format}", 'r', encoding='utf-8') as f:
+            return f.read()
+    finally:
         # Limpiar archivos temporales
-        os.unlink(img_path)
-        os.unlink(text_file)
+        for path in (img_path, f"{output_base}.{output_format}"):
+            if os.path.exists(path):
+                os.unlink(path)
+
+def ocr_pixmap_stdin(pix, language="spa", output_format="txt", dpi=None):
+    """OCR en memoria: envía las muestras en gris como PGM por stdin y lee stdout."""
+    # PGM binario: cabecera mínima seguida de las muestras tal cual, sin codificar
+    image = b"P5\n%d %d\n255\n" % (pix.width, pix.height) + pix.samples
+    command = ["tesseract", "stdin", "stdout", "-l", language] + TESSERACT_FLAGS
+    if dpi:
+        # El PGM no lleva resolución: sin ella Tesseract la estima por el tamaño del texto
+        command += ["--dpi", str(dpi)]
+    if output_format != "txt":
+        command.append(output_format)
+    result = subprocess.run(command, input=image, check=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return result.stdout.decode('utf-8')
+
+# Vocabulario del motor OCR simulado
+FAKE_OCR_WORDS = ("documento", "accesible", "página", "texto", "escaneado", "párrafo",
+                  "línea", "imagen", "lectura", "estructura", "etiqueta", "contenido")
+
+def ocr_pixmap_fake(pix, output_format="txt"):
+    """Motor OCR simulado para benchmarks y pruebas sin Tesseract.
+    
+    Recorre las muestras del ráster (un coste proporcional a su tamaño, como el OCR
+    real) y genera a partir de su hash líneas de palabras deterministas que llenan la
+    página como un texto de cuerpo 10, en el mismo formato TSV, hOCR o de texto que
+    Tesseract.
+    """
+    digest = hashlib.sha256(pix.samples).digest()
+    line_height = max(8, pix.width // 60)
+    rows = []
+    top = pix.height // 10
+    line = 0
+    while top + line_height < pix.height * 9 // 10:
+        left = pix.width // 10
+        word_num = 0
+        while True:
+            word = FAKE_OCR_WORDS[digest[(line * 7 + word_num) % len(digest)] % len(FAKE_OCR_WORDS)]
+            width = len(word) * line_height // 2
+            if left + width > pix.width * 9 // 10:
+                break
+            # Párrafos de cuatro líneas en un único bloque
+            rows.append((line // 4 + 1, line % 4 + 1, word_num + 1, left, top, width, line_height, word))
+            left += width + line_height // 2
+            word_num += 1
+        top += line_height * 3 // 2 if line % 4 != 3 else line_height * 3
+        line += 1
+    
+    if output_format == "tsv":
+        lines = ["level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext"]
+        lines.extend(f"5\t1\t1\t{par}\t{line}\t{word_num}\t{left}\t{top}\t{width}\t{height}\t95.0\t{word}"
+                     for par, line, word_num, left, top, width, height, word in rows)
+        return "\n".join(lines) + "\n"
+    if output_format == "hocr":
+        parts = [f"<div class='ocr_page' title='bbox 0 0 {pix.width} {pix.height}'>",
+                 f"<div class='ocr_carea' id='block_1_1' title='bbox 0 0 {pix.width} {pix.height}'>"]
+        previous = None
+        for par, line, word_num, left, top, width, height, word in rows:
+            if previous is None or previous[:2] != (par, line):
+                if previous is not None:
+                    parts.append("</span>")
+                    if previous[0] != par:
+                        parts.append("</p>")
+                if previous is None or previous[0] != par:
+                    parts.append(f"<p class='ocr_par' id='par_1_{par}' title='bbox {left} {top} "
+                                 f"{pix.width * 9 // 10} {top + height}'>")
+                parts.append(f"<span class='ocr_line' id='line_1_{par}_{line}' title='bbox {left} {top} "
+                             f"{pix.width * 9 // 10} {top + height}; baseline 0 0'>")
+            parts.append(f"<span class='ocrx_word' id='word_1_{par}_{line}_{word_num}' "
+                         f"title='bbox {left} {top} {left + width} {top + height}; x_wconf 95'>{word}</span>")
+            previous = (par, line)
+        if previous is not None:
+            parts.append("</span></p>")
+        parts.append("</div></div>")
+        return "\n".join(parts) + "\n"
+    text = []
+    previous = None
+    for par, line, word_num, left, top, width, height, word in rows:
+        if previous is not None:
+            text.append(" " if previous == (par, line) else "\n" if previous[0] == par else "\n\n")
+        text.append(word)
+        previous = (par, line)
+    return "".join(text) + "\n"
+
+def get_tesserocr_api(language="spa"):
+    """Devuelve la API de tesserocr del proceso para el idioma, cargando el modelo una sola vez."""
+    api = _tesserocr_apis.get(language)
+    if api is None:
+        api = tesserocr.PyTessBaseAPI(lang=language, psm=tesserocr.PSM.AUTO_OSD,
+                                      oem=tesserocr.OEM.DEFAULT)
+        api.SetVariable("preserve_interword_spaces", "1")
+        api.SetVariable("textord_min_linesize", "2.5")
+        _tesserocr_apis[language] = api
+    return api
+
+def ocr_pixmap_tesserocr(pix, language="spa", output_format="txt", dpi=300):
+    """OCR en proceso con tesserocr, pasando directamente el buffer de muestras."""
+    api = get_tesserocr_api(language)
+    api.SetImageBytes(pix.samples, pix.width, pix.height, pix.n, pix.stride)
+    api.SetSourceResolution(dpi)
+    if output_format == "hocr":
+        return api.GetHOCRText(0)
+    if output_format == "tsv":
+        return api.GetTSVText(0)
+    return api.GetUTF8Text()
+
+def run_ocr(pix, language="spa", backend="stdin", output_format="txt", dpi=300):
+    """Aplica OCR a un pixmap ya renderizado con el motor indicado."""
+    if backend == "tesserocr":
+        return ocr_pixmap_tesserocr(pix, language, output_format, dpi)
+    if backend == "stdin":
+        return ocr_pixmap_stdin(pix, language, output_format, dpi)
+    if backend == "fake":
+        return ocr_pixmap_fake(pix, output_format)
+    return ocr_pixmap_subprocess(pix, language, output_format, dpi)
+
+# Elementos de hOCR que abren un bloque, un párrafo, una línea o una palabra
+HOCR_ELEMENT = re.compile(
+    r"<\w+\s+class=['\"](ocr_carea|ocr_par|ocr_line|ocr_header|ocr_caption|ocr_textfloat|ocrx_word)['\"]"
+    r"[^>]*?title=['\"]bbox (\d+) (\d+) (\d+) (\d+)(?:[^'\"]*?x_wconf (\d+))?[^'\"]*['\"][^>]*>")
+HOCR_WORD_TEXT = re.compile(r"(.*?)</span>", re.S)
+HOCR_TAG = re.compile(r"<[^>]+>")
+
+class PageLayout:
+    """Palabras OCR de una página en arrays compactos.
+    
+    boxes (n×4, puntos de página), conf (n) e ids (n×3: bloque, párrafo, línea) son
+    arrays de NumPy, y el texto de todas las palabras va en un único buffer con sus
+    desplazamientos (offsets, n+1), en lugar de una lista por palabra. Las palabras
+    están en el orden de lectura de Tesseract, así que las de una misma línea o párrafo
+    son contiguas. Para texto nativo (from_text_dict) cada unidad es un span y se
+    añaden sizes (tamaño de letra) y bold (negrita).
+    """
+    
+    def __init__(self, boxes=None, conf=None, ids=None, chars="", offsets=None, sizes=None, bold=None):
+        self.boxes = np.zeros((0, 4), dtype=np.float32) if boxes is None else boxes
+        self.conf = np.zeros(0, dtype=np.float32) if conf is None else conf
+        self.ids = np.zeros((0, 3), dtype=np.int32) if ids is None else ids
+        self.chars = chars
+        self.offsets = np.zeros(1, dtype=np.int64) if offsets is None else offsets
+        self.sizes = sizes
+        self.bold = bold
+    
+    @classmethod
+    def from_columns(cls, numbers, texts, scale=1.0):
+        """Construye la página a partir de filas numéricas [x0, y0, x1, y1, conf, bloque, párrafo, línea]."""
+        if not texts:
+            return cls()
+        values = np.array(numbers, dtype=np.float32).reshape(len(texts), 8)
+        offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        np.cumsum([len(text) for text in texts], out=offsets[1:])
+        return cls(np.round(values[:, :4] / scale, 2), values[:, 4].copy(),
+                   values[:, 5:].astype(np.int32), "".join(texts), offsets)
+    
+    @classmethod
+    def from_tsv(cls, tsv, scale=1.0):
+        """Lee la salida TSV de Tesseract, quedándose solo con las filas de palabra (nivel 5)."""
+        numbers = []
+        texts = []
+        for row in tsv.split('\n'):
+            if not row.startswith('5\t'):
+                continue
+            cols = row.split('\t', 11)
+            if len(cols) < 12:
+                continue
+            text = cols[11].strip()
+            if not text:
+                continue
+            left = int(cols[6])
+            top = int(cols[7])
+            numbers += (left, top, left + int(cols[8]), top + int(cols[9]), float(cols[10]),
+                        int(cols[2]), int(cols[3]), int(cols[4]))
+            texts.append(text)
+        return cls.from_columns(numbers, texts, scale)
+    
+    @classmethod
+    def from_hocr(cls, hocr, scale=1.0):
+        """Lee la salida hOCR de Tesseract en una sola pasada con expresiones regulares.
         
-        logging.debug(f"OCR completado. Cantidad de texto detectado: {len(text)} caracteres")
-        return text
-    except Exception as e:
-        logging.error(f"Error en OCR: {str(e)}")
-        return ""
+        Los bloques, párrafos y líneas se numeran en orden de aparición; el texto de
+        cada palabra se toma hasta su </span>, sin etiquetas de formato.
+        """
+        numbers = []
+        texts = []
+        block = par = line = 0
+        for match in HOCR_ELEMENT.finditer(hocr):
+            kind = match.group(1)
+            if kind == 'ocr_carea':
+                block += 1
+            elif kind == 'ocr_par':
+                par += 1
+            elif kind != 'ocrx_word':
+                line += 1
+            else:
+                text = HOCR_WORD_TEXT.match(hocr, match.end())
+                text = html.unescape(HOCR_TAG.sub("", text.group(1))).strip() if text else ""
+                if not text:
+                    continue
+                x0, y0, x1, y1 = (int(value) for value in match.group(2, 3, 4, 5))
+                numbers += (x0, y0, x1, y1, float(match.group(6) or 0), block, par, line)
+                texts.append(text)
+        return cls.from_columns(numbers, texts, scale)
+    
+    @classmethod
+    def from_text_dict(cls, data):
+        """Lee los spans de texto de page.get_text("dict") en una sola pasada.
+        
+        ids guarda (bloque, 0, línea), de modo que el nivel 2 agrupa los bloques de
+        MuPDF y el nivel 3 sus líneas; conf no se usa en texto nativo.
+        """
+        numbers = []
+        texts = []
+        flags = []
+        for block in data['blocks']:
+            if block['type'] != 0:
+                continue
+            for line_number, line in enumerate(block['lines']):
+                for span in line['spans']:
+                    if not span['text'].strip():
+                        continue
+                    numbers += span['bbox']
+                    numbers += (span['size'], block['number'], 0, line_number)
+                    texts.append(span['text'])
+                    flags.append(span['flags'])
+        layout = cls.from_columns(numbers, texts)
+        layout.sizes = layout.conf
+        layout.conf = np.full(len(texts), 100, dtype=np.float32)
+        layout.bold = (np.array(flags, dtype=np.int32) & fitz.TEXT_FONT_BOLD) != 0
+        return layout
+    
+    @classmethod
+    def from_dict(cls, data):
+        """Reconstruye la página desde to_dict (caché OCR)."""
+        if not data.get('chars'):
+            return cls()
+        return cls(np.array(data['boxes'], dtype=np.float32).reshape(-1, 4),
+                   np.array(data['conf'], dtype=np.float32),
+                   np.array(data['ids'], dtype=np.int32).reshape(-1, 3),
+                   data['chars'], np.array(data['offsets'], dtype=np.int64))
+    
+    def to_dict(self):
+        """Representación serializable en JSON."""
+        return {'boxes': self.boxes.ravel().tolist(), 'conf': self.conf.tolist(),
+                'ids': self.ids.ravel().tolist(), 'chars': self.chars, 'offsets': self.offsets.tolist()}
+    
+    def transform(self, matrix):
+        """Lleva las cajas a otro sistema de coordenadas (matriz afín sin giro).
+        
+        Se transforma el centro de cada caja y su tamaño se escala sin más, de modo que
+        una inclinación (el enderezado del preprocesado) mueve las cajas sin agrandarlas.
+        """
+        if not len(self):
+            return
+        centers_x = (self.boxes[:, 0] + self.boxes[:, 2]) / 2
+        centers_y = (self.boxes[:, 1] + self.boxes[:, 3]) / 2
+        half_widths = (self.boxes[:, 2] - self.boxes[:, 0]) * abs(matrix.a) / 2
+        half_heights = (self.boxes[:, 3] - self.boxes[:, 1]) * abs(matrix.d) / 2
+        new_x = matrix.a * centers_x + matrix.c * centers_y + matrix.e
+        new_y = matrix.b * centers_x + matrix.d * centers_y + matrix.f
+        self.boxes = np.round(np.stack((new_x - half_widths, new_y - half_heights,
+                                        new_x + half_widths, new_y + half_heights), axis=1), 2).astype(np.float32)
+    
+    def __len__(self):
+        return len(self.conf)
+    
+    def word(self, index):
+        """Texto de una palabra."""
+        return self.chars[self.offsets[index]:self.offsets[index + 1]]
+    
+    def words(self):
+        """Lista con el texto de todas las palabras."""
+        offsets = self.offsets.tolist()
+        return [self.chars[start:end] for start, end in zip(offsets, offsets[1:])]
+    
+    def starts(self, level):
+        """Índices de la primera palabra de cada grupo: nivel 2 = párrafos, 3 = líneas."""
+        if not len(self):
+            return np.zeros(0, dtype=np.int64)
+        changed = np.any(self.ids[1:, :level] != self.ids[:-1, :level], axis=1)
+        return np.concatenate(([0], np.flatnonzero(changed) + 1))
+    
+    def group_boxes(self, starts):
+        """Caja que envuelve las palabras de cada grupo."""
+        return np.hstack((np.minimum.reduceat(self.boxes[:, :2], starts),
+                          np.maximum.reduceat(self.boxes[:, 2:], starts)))
+    
+    def text(self):
+        """Texto de la página: espacios entre palabras, saltos entre líneas y líneas en blanco entre párrafos."""
+        if not len(self):
+            return ""
+        separators = np.full(len(self), " ", dtype=object)
+        separators[self.starts(3)] = "\n"
+        separators[self.starts(2)] = "\n\n"
+        separators[0] = ""
+        return "".join(separator + word for separator, word in zip(separators.tolist(), self.words())) + "\n"
+
+def parse_tesseract_tsv(tsv, scale=1.0):
+    """Convierte la salida TSV de Tesseract en texto y PageLayout en puntos de página.
+    
+    El texto separa las líneas con salto de línea y los párrafos con una línea en blanco.
+    """
+    layout = PageLayout.from_tsv(tsv, scale)
+    return layout.text(), layout
+
+# Versión del formato de resultados guardados en la caché OCR
+OCR_CACHE_VERSION = 2
+
+class OCRCache:
+    """Caché en disco de resultados OCR direccionada por contenido, con expulsión LRU.
+    
+    Usa SQLite para que varios workers puedan compartirla; cada proceso abre su propia
+    conexión la primera vez que la usa.
+    """
+    
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024):
+        self.path = os.path.join(directory, 'ocr_cache.sqlite')
+        self.max_bytes = max_bytes
+        self._conn = None
+        self._pid = None
+        os.makedirs(directory, exist_ok=True)
+    
+    def _connect(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS ocr (
+                key TEXT PRIMARY KEY, value BLOB, size INTEGER, last_used REAL)""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ocr_last_used ON ocr(last_used)")
+            self._pid = os.getpid()
+        return self._conn
+    
+    @staticmethod
+    def make_key(content_hash, language, dpi, preprocess=False, native=False):
+        """Construye la clave a partir del contenido y de la configuración de OCR."""
+        params = [OCR_CACHE_VERSION, language, dpi, TESSERACT_FLAGS]
+        if preprocess:
+            params.append("preprocess")
+        if native:
+            params.append("native")
+        params = json.dumps(params)
+        return hashlib.sha256(f"{content_hash}|{params}".encode('utf-8')).hexdigest()
+    
+    def get(self, key):
+        """Devuelve el resultado guardado para la clave, o None."""
+        conn = self._connect()
+        row = conn.execute("SELECT value FROM ocr WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE ocr SET last_used = ? WHERE key = ?", (time.time(), key))
+        result = json.loads(row[0])
+        result['words'] = PageLayout.from_dict(result['words'])
+        return result
+    
+    def put(self, key, result):
+        """Guarda un resultado y expulsa los menos usados si se supera el tamaño máximo."""
+        conn = self._connect()
+        value = json.dumps(dict(result, words=result['words'].to_dict()), ensure_ascii=False).encode('utf-8')
+        conn.execute("INSERT OR REPLACE INTO ocr (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+                     (key, value, len(value), time.time()))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr").fetchone()[0]
+        if total > self.max_bytes:
+            # Expulsar hasta dejar margen para no repetir la limpieza en cada inserción
+            target = self.max_bytes * 0.9
+            evicted = 0
+            for old_key, size in conn.execute("SELECT key, size FROM ocr ORDER BY last_used").fetchall():
+                if total <= target:
+                    break
+                conn.execute("DELETE FROM ocr WHERE key = ?", (old_key,))
+                total -= size
+                evicted += 1
+            logging.debug(f"Caché OCR: {evicted} entradas expulsadas")
+
+# Cachés OCR abiertas en este proceso
+_ocr_caches = {}
+
+def get_ocr_cache(config):
+    """Devuelve la caché OCR configurada para este proceso, o None si está desactivada."""
+    directory = config.get('ocr_cache')
+    # Los resultados del motor simulado no deben mezclarse con los reales
+    if not directory or config.get('ocr_backend') == "fake":
+        return None
+    cache = _ocr_caches.get(directory)
+    if cache is None:
+        cache = OCRCache(directory, config.get('ocr_cache_size', 1024) * 1024 * 1024)
+        _ocr_caches[directory] = cache
+    return cache
+
+def page_source_hash(page):
+    """Hash del contenido de una página escaneada sin renderizarla.
+    
+    Solo aplica a páginas cuya única imagen es el escaneo: combina el stream comprimido
+    de la imagen con el stream de contenido, la geometría y la rotación de la página.
+    Devuelve None si la página no tiene esa forma.
+    """
+    images = page.get_images(full=True)
+    if len(images) != 1 or page.get_fonts():
+        return None
+    doc = page.parent
+    digest = hashlib.sha256()
+    digest.update(doc.xref_stream_raw(images[0][0]))
+    for xref in page.get_contents():
+        digest.update(doc.xref_stream_raw(xref))
+    digest.update(f"{tuple(page.mediabox)}|{page.rotation}".encode('utf-8'))
+    return "img:" + digest.hexdigest()
+
+def scan_image_placement(page, min_coverage=0.5, max_content_bytes=256):
+    """Imagen dominante de una página escaneada y su resolución nativa, sin decodificarla.
+    
+    Toma la imagen colocada con mayor área visible y, si cubre al menos min_coverage de
+    la página, devuelve {'xref', 'dpi': píxeles por pulgada de la imagen en la página
+    (el mayor de los dos ejes), 'transform': matriz de píxeles de la imagen a puntos de
+    la página, 'direct': la página es solo esa imagen, sin girar ni máscara y a página
+    completa, así que el ráster para el OCR puede ser la propia imagen}. Devuelve None
+    si no hay una imagen así.
+    """
+    page_rect = page.rect
+    images = page.get_image_info(xrefs=True)
+    best = None
+    best_area = 0.0
+    for info in images:
+        bbox = fitz.Rect(info['bbox']) & page_rect
+        if not bbox.is_empty and bbox.width * bbox.height > best_area:
+            best = info
+            best_area = bbox.width * bbox.height
+    if best is None or best_area < page_rect.width * page_rect.height * min_coverage:
+        return None
+    
+    a, b, c, d, e, f = best['transform']
+    width_points = (a * a + b * b) ** 0.5
+    height_points = (c * c + d * d) ** 0.5
+    if not width_points or not height_points:
+        return None
+    x_dpi = best['width'] * 72 / width_points
+    y_dpi = best['height'] * 72 / height_points
+    transform = fitz.Matrix(1 / best['width'], 0, 0, 1 / best['height'], 0, 0) * fitz.Matrix(a, b, c, d, e, f)
+    
+    # Extracción directa: sin giro ni volteo, cubriendo la página (1% de tolerancia),
+    # con píxeles cuadrados y sin más contenido que la propia imagen
+    bbox = fitz.Rect(best['bbox'])
+    tolerance = max(page_rect.width, page_rect.height) * 0.01
+    direct = (len(images) == 1 and best['xref'] > 0 and not best['has-mask']
+              and page.rotation == 0 and page.cropbox == page.mediabox
+              and b == 0 and c == 0 and a > 0 and d > 0
+              and max(abs(bbox.x0 - page_rect.x0), abs(bbox.y0 - page_rect.y0),
+                      abs(bbox.x1 - page_rect.x1), abs(bbox.y1 - page_rect.y1)) <= tolerance
+              and abs(x_dpi - y_dpi) <= max(x_dpi, y_dpi) * 0.02
+              and not page.get_fonts()
+              and len(page.read_contents()) <= max_content_bytes)
+    return {'xref': best['xref'], 'dpi': max(x_dpi, y_dpi), 'transform': transform, 'direct': direct}
+
+def scan_image_pixmap(doc, xref):
+    """Decodifica una imagen a su resolución nativa como pixmap en gris o RGB, sin alfa."""
+    pix = fitz.Pixmap(doc, xref)
+    if pix.alpha or pix.colorspace is None or pix.colorspace.n not in (1, 3):
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    return pix
+
+def choose_ocr_dpi(placement, dpi, dpi_bounds):
+    """Resolución del OCR de una página: la nativa de su imagen dominante dentro de dpi_bounds.
+    
+    Sin imagen dominante se usa la resolución fija dpi. Devuelve (DPI, si el ráster
+    puede extraerse de la imagen sin renderizar la página).
+    """
+    if placement is None:
+        return dpi, False
+    min_dpi, max_dpi = dpi_bounds
+    chosen = int(round(min(max(placement['dpi'], min_dpi), max_dpi)))
+    return chosen, placement['direct'] and abs(chosen - placement['dpi']) <= 1
+
+# Modos de la capa de imagen visible de las páginas escaneadas:
+# 'original' reutiliza la página de origen tal cual (sin decodificar ni recodificar la imagen),
+# 'raster' reutiliza el ráster del OCR reducido y codificado una vez en JPEG,
+# 'legacy' vuelve a renderizar la página a 72 DPI como hacían las versiones anteriores.
+IMAGE_LAYER_MODES = ("original", "raster", "legacy")
 
-def create_structure_tree(doc, page, text):
-    """Crea un árbol de estructura completo para el PDF."""
+def ocr_layer_dpi(config):
+    """Resolución de la capa visible si debe salir del mismo ráster que el OCR, o None."""
+    if config.get('image_layer', 'original') == 'raster':
+        return config.get('layer_dpi', 150)
+    return None
+
+def ocr_dpi_bounds(config):
+    """Límites (mínimo, máximo) de la resolución adaptativa del OCR, o None si es fija."""
+    if config.get('adaptive_dpi'):
+        return config.get('min_dpi', 150), config.get('max_dpi', 400)
+    return None
+
+def encode_image_layer(pix, dpi, layer_dpi=150, quality=75):
+    """Reduce el ráster a la resolución de la capa visible y lo codifica una sola vez en JPEG."""
+    if layer_dpi < dpi:
+        scale = layer_dpi / dpi
+        pix = fitz.Pixmap(pix, max(1, round(pix.width * scale)), max(1, round(pix.height * scale)), None)
+    return pix.tobytes("jpeg", jpg_quality=quality)
+
+def pixmap_gray(pix):
+    """Muestras del ráster como array NumPy alto×ancho en gris.
+    
+    Un ráster en gris se devuelve como vista del buffer de muestras, sin copiarlo; uno
+    en color se convierte a luminancia con aritmética entera.
+    """
+    samples = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.stride)
+    pixels = samples[:, :pix.width * pix.n].reshape(pix.height, pix.width, pix.n)
+    if pix.n - pix.alpha < 3:
+        return pixels[:, :, 0]
+    luminance = pixels[:, :, 0] * np.uint16(77)
+    luminance += pixels[:, :, 1] * np.uint16(150)
+    luminance += pixels[:, :, 2] * np.uint16(29)
+    return (luminance >> 8).astype(np.uint8)
+
+def adaptive_threshold(gray, window, sensitivity=0.15):
+    """Binariza con umbral local: oscuro lo que queda un sensitivity por debajo de la media de su zona.
+    
+    Las medias se calculan por celdas de window píxeles (vistas del array, sin copiarlo)
+    y se suavizan con sus vecinas, así que el umbral se adapta a fondos y sombras
+    desiguales. Devuelve un array uint8 con el texto a 0 y el fondo a 255.
+    """
+    height, width = gray.shape
+    rows = max(1, height // window)
+    columns = max(1, width // window)
+    cell_height = height // rows
+    cell_width = width // columns
+    cells = gray[:rows * cell_height, :columns * cell_width].reshape(rows, cell_height, columns, cell_width)
+    means = cells.mean(axis=(1, 3))
+    # Media de cada celda con sus ocho vecinas
+    padded = np.pad(means, 1, mode='edge')
+    means = sum(padded[dy:dy + rows, dx:dx + columns] for dy in range(3) for dx in range(3)) / 9
+    thresholds = (means * (1 - sensitivity)).astype(np.uint8)
+    row_cells = np.minimum(np.arange(height) // cell_height, rows - 1)
+    column_cells = np.minimum(np.arange(width) // cell_width, columns - 1)
+    return (gray >= thresholds[row_cells][:, column_cells]).view(np.uint8) * np.uint8(255)
+
+def estimate_skew(binary, max_angle=5.0, step=0.2, sample=3, max_points=30000):
+    """Estima la inclinación de las líneas de texto por perfiles de proyección.
+    
+    Con una muestra de uno de cada sample píxeles (y como mucho max_points píxeles
+    oscuros), proyecta los píxeles oscuros sobre el eje vertical para cada ángulo
+    candidato (todos a la vez, con un único bincount) y elige el perfil más
+    concentrado; después afina alrededor del mejor ángulo. Devuelve la pendiente de
+    las líneas (tangente; positiva si bajan hacia la derecha).
+    """
+    ys, xs = np.nonzero(binary[::sample, ::sample] == 0)
+    if len(ys) < 500:
+        return 0.0
+    if len(ys) > max_points:
+        stride = -(-len(ys) // max_points)
+        ys = ys[::stride]
+        xs = xs[::stride]
+    ys = ys.astype(np.float32)
+    xs = xs.astype(np.float32)
+    rows = binary.shape[0] // sample + 1
+    margin = int(np.ceil(binary.shape[1] / sample * np.tan(np.radians(max_angle + step)))) + 1
+    best = 0.0
+    for span, delta in ((max_angle, step), (step, step / 8)):
+        angles = np.arange(best - span, best + span + delta / 2, delta)
+        slopes = np.tan(np.radians(angles)).astype(np.float32)
+        projected = (ys[None, :] - xs[None, :] * slopes[:, None] + margin).astype(np.int64)
+        offsets = np.arange(len(angles))[:, None] * (rows + 2 * margin)
+        profiles = np.bincount((projected + offsets).ravel(),
+                               minlength=len(angles) * (rows + 2 * margin)).reshape(len(angles), -1)
+        scores = (profiles.astype(np.float64) ** 2).sum(axis=1)
+        best = float(angles[scores.argmax()])
+    return float(np.tan(np.radians(best)))
+
+def shear_columns(binary, slope):
+    """Endereza las líneas desplazando cada columna en vertical según la pendiente.
+    
+    Para ángulos pequeños equivale a girar la página sin interpolar. Devuelve la
+    imagen y el desplazamiento aplicado en el centro (las filas de la columna x vienen
+    de y + x*slope + offset).
+    """
+    height, width = binary.shape
+    offset = -round(width * slope / 2)
+    shifts = np.round(np.arange(width) * slope + offset).astype(np.int64)
+    output = np.full(binary.shape, 255, dtype=np.uint8)
+    # Copiar por tramos de columnas con el mismo desplazamiento
+    bounds = np.flatnonzero(np.diff(shifts)) + 1
+    for start, end in zip(np.concatenate(([0], bounds)).tolist(), np.append(bounds, width).tolist()):
+        shift = int(shifts[start])
+        if abs(shift) >= height:
+            continue
+        if shift >= 0:
+            output[:height - shift, start:end] = binary[shift:, start:end]
+        else:
+            output[-shift:, start:end] = binary[:height + shift, start:end]
+    return output, offset
+
+def content_bounds(binary, margin, min_pixels=3):
+    """Caja (x0, y0, x1, y1) de los píxeles oscuros con un margen, ignorando filas y columnas casi vacías."""
+    dark = binary == 0
+    rows = np.flatnonzero(np.count_nonzero(dark, axis=1) >= min_pixels)
+    columns = np.flatnonzero(np.count_nonzero(dark, axis=0) >= min_pixels)
+    if not len(rows) or not len(columns):
+        return None
+    height, width = binary.shape
+    return (max(0, int(columns[0]) - margin), max(0, int(rows[0]) - margin),
+            min(width, int(columns[-1]) + 1 + margin), min(height, int(rows[-1]) + 1 + margin))
+
+def preprocess_for_ocr(pix, dpi=300):
+    """Prepara un ráster para el OCR: gris, binarización adaptativa, enderezado y recorte.
+    
+    Trabaja sobre las muestras del pixmap como array NumPy. Devuelve (pixmap en gris
+    para el OCR, matriz que lleva sus coordenadas a las del ráster original, datos del
+    preprocesado: 'skew' en grados y 'kept' = fracción de píxeles que llegan al OCR).
+    """
+    gray = pixmap_gray(pix)
+    binary = adaptive_threshold(gray, max(16, dpi // 8))
+    gray = None
+    slope = estimate_skew(binary, sample=max(1, dpi // 100))
+    offset = 0
+    if abs(slope) >= np.tan(np.radians(0.1)):
+        binary, offset = shear_columns(binary, slope)
+    else:
+        slope = 0.0
+    
+    bounds = content_bounds(binary, margin=max(4, dpi // 20))
+    x0, y0 = 0, 0
+    if bounds is not None:
+        x0, y0, x1, y1 = bounds
+        binary = binary[y0:y1, x0:x1]
+    height, width = binary.shape
+    result = fitz.Pixmap(fitz.csGRAY, width, height, np.ascontiguousarray(binary).tobytes(), 0)
+    # Columna x, fila y del resultado -> (x + x0, y + y0 + (x + x0)*slope + offset) en el original
+    matrix = fitz.Matrix(1, slope, 0, 1, x0, y0 + x0 * slope + offset)
+    info = {'skew': float(np.degrees(np.arctan(slope))),
+            'kept': (width * height) / max(1, pix.width * pix.height)}
+    return result, matrix, info
+
+def apply_ocr_to_page(page, language="spa", dpi=300, backend="auto", cache=None, layer_dpi=None,
+                      preprocess=False, dpi_bounds=None):
+    """Aplica OCR a una página y devuelve {'text': texto, 'words': PageLayout}.
+    
+    Con caché, si el stream de la imagen escaneada ya se reconoció con la misma
+    configuración, se devuelve el resultado guardado sin renderizar la página.
+    Con layer_dpi, el resultado incluye además en 'layer' la capa visible en JPEG
+    obtenida del mismo ráster usado para el OCR. Con preprocess, el OCR recibe el
+    ráster binarizado, enderezado y recortado (preprocess_for_ocr) y las cajas se
+    devuelven igualmente en puntos de la página. Con dpi_bounds=(mínimo, máximo), la
+    resolución se elige por página a partir de la imagen dominante (choose_ocr_dpi) y,
+    si la página es solo esa imagen a su resolución, el ráster se extrae de ella sin
+    renderizar. 'timings' recoge los segundos de render, preprocesado y OCR, el OCR
+    ahorrado estimado, la resolución usada y si el resultado salió de la caché.
+    """
     try:
-        # Verificar si el documento soporta etiquetado estructural
-        if not hasattr(doc, "is_tagged") or not doc.is_tagged:
-            # Inicializar estructura si es posible
-            if hasattr(doc, "init_doc_structure"):
-                try:
-                    doc.init_doc_structure()
-                except Exception as e:
-                    logging.warning(f"Error inicializando estructura: {str(e)}")
-                    return False
+        backend = resolve_ocr_backend(backend)
+        
+        placement = None
+        direct = False
+        if dpi_bounds:
+            placement = scan_image_placement(page)
+            dpi, direct = choose_ocr_dpi(placement, dpi, dpi_bounds)
+            if placement is None:
+                logging.info(f"Página {page.number+1}: OCR a {dpi} DPI (sin imagen dominante)")
             else:
-                logging.warning("Versión de PyMuPDF no soporta etiquetado estructural completo")
-                return False
+                logging.info(f"Página {page.number+1}: OCR a {dpi} DPI (imagen a {placement['dpi']:.0f} DPI"
+                             f"{', extraída sin renderizar' if direct else ''})")
+        
+        key = None
+        if cache is not None:
+            source_hash = page_source_hash(page)
+            if source_hash:
+                key = OCRCache.make_key(source_hash, language, dpi, preprocess, direct)
+                result = cache.get(key)
+                if result is not None:
+                    logging.debug("OCR recuperado de la caché sin renderizar")
+                    result['timings'] = {'render': 0.0, 'ocr': 0.0, 'cache_hit': True,
+                                         'dpi': dpi, 'direct': direct}
+                    if layer_dpi:
+                        layer_pix = page.get_pixmap(matrix=fitz.Matrix(layer_dpi/72, layer_dpi/72), alpha=False)
+                        result['layer'] = encode_image_layer(layer_pix, layer_dpi, layer_dpi)
+                    return result
         
-        # Si no hay métodos para crear estructura, abandonar
-        if not hasattr(doc, "add_struct_element") or not hasattr(doc, "append_struct_element"):
-            logging.warning("La versión de PyMuPDF no tiene los métodos necesarios para etiquetado estructural")
-            return False
+        # Renderizar la página como imagen con mayor resolución para mejor OCR
+        render_start = time.perf_counter()
+        layer = None
+        if direct:
+            # La página es la imagen: decodificarla a su resolución en lugar de renderizarla
+            pix = scan_image_pixmap(page.parent, placement['xref'])
+            if layer_dpi:
+                layer = encode_image_layer(pix, dpi, layer_dpi)
+            if backend != "subprocess" and pix.n != 1:
+                pix = fitz.Pixmap(fitz.csGRAY, pix)
+        elif layer_dpi:
+            # Un único render en color: la capa visible se deriva de él y el OCR usa su versión en gris
+            pix = page.get_pixmap(matrix=fitz.Matrix(dpi/72, dpi/72), alpha=False)
+            layer = encode_image_layer(pix, dpi, layer_dpi)
+            if backend != "subprocess" and pix.n != 1:
+                pix = fitz.Pixmap(fitz.csGRAY, pix)
+        else:
+            pix = render_page_for_ocr(page, dpi, backend)
+        timings = {'render': time.perf_counter() - render_start, 'ocr': 0.0, 'cache_hit': False,
+                   'dpi': dpi, 'direct': direct}
+        
+        result = None
+        if cache is not None and key is None:
+            # Sin imagen única reconocible: usar el ráster como contenido de la clave
+            key = OCRCache.make_key("pix:" + hashlib.sha256(pix.samples).hexdigest(), language, dpi, preprocess,
+                                    direct)
+            result = cache.get(key)
+            if result is not None:
+                logging.debug("OCR recuperado de la caché")
+                timings['cache_hit'] = True
+        
+        if result is None:
+            matrix = None
+            if preprocess:
+                preprocess_start = time.perf_counter()
+                pix, matrix, info = preprocess_for_ocr(pix, dpi)
+                timings['preprocess'] = time.perf_counter() - preprocess_start
+            ocr_start = time.perf_counter()
+            tsv = run_ocr(pix, language, backend, output_format="tsv", dpi=dpi)
+            text, words = parse_tesseract_tsv(tsv, scale=dpi/72)
+            if matrix is not None or direct:
+                # Del ráster preprocesado o de la imagen extraída (en puntos) a los puntos de la página
+                scale = 72 / dpi
+                to_page = fitz.Matrix(1, 1)
+                if matrix is not None:
+                    to_page = fitz.Matrix(matrix.a, matrix.b, matrix.c, matrix.d,
+                                          matrix.e * scale, matrix.f * scale)
+                if direct:
+                    to_page = to_page * fitz.Matrix(1 / scale, 1 / scale) * placement['transform']
+                words.transform(to_page)
+            result = {'text': text, 'words': words}
+            if cache is not None:
+                cache.put(key, result)
+            timings['ocr'] = time.perf_counter() - ocr_start
+            if matrix is not None:
+                # El coste del OCR crece con los píxeles: estimación de lo ahorrado por el recorte
+                timings['ocr_saved'] = timings['ocr'] * (1 / max(info['kept'], 0.01) - 1)
+                logging.debug(f"Preprocesado: inclinación {info['skew']:.2f}°, "
+                              f"{(1 - info['kept']) * 100:.0f}% del ráster recortado, "
+                              f"{timings['preprocess']*1000:.1f} ms, OCR ahorrado estimado "
+                              f"{timings['ocr_saved']*1000:.1f} ms")
+            logging.debug(f"OCR completado ({backend}). Cantidad de texto detectado: {len(text)} caracteres")
+        pix = None
+        
+        if layer is not None:
+            result['layer'] = layer
+        # Tiempos de la página para las métricas del documento (no se guardan en la caché)
+        result['timings'] = timings
+        return result
+    except Exception as e:
+        logging.error(f"Error en OCR: {str(e)}")
+        return {'text': "", 'words': PageLayout()}
 
-        # Intentar crear estructura jerárquica completa
+class StreamingPDFWriter:
+    """Construye un PDF página a página volcándolo a disco cada cierto número de páginas.
+    
+    Cada tramo se añade a un archivo parcial con un guardado incremental y el documento
+    se reabre desde disco, de modo que las páginas ya escritas dejan de ocupar memoria y
+    el pico de memoria no crece con el número de páginas. Con flush_pages=0 el documento
+    entero se mantiene en memoria hasta el guardado final.
+    """
+    
+    def __init__(self, output_path, flush_pages=0):
+        self.output_path = output_path
+        self.partial_path = output_path + '.parcial'
+        self.flush_pages = flush_pages
+        self.doc = fitz.open()
+        self._pending = 0
+        self._on_disk = False
+    
+    def page_done(self):
+        """Indica que la última página está completa; vuelca el tramo si toca."""
+        self._pending += 1
+        if self.flush_pages and self._pending >= self.flush_pages:
+            self.flush()
+    
+    def flush(self):
+        """Escribe las páginas pendientes en el archivo parcial y libera su memoria."""
+        if self._on_disk:
+            self.doc.saveIncr()
+        else:
+            self.doc.save(self.partial_path)
+            self._on_disk = True
+        self.doc.close()
+        self.doc = fitz.open(self.partial_path)
+        self._pending = 0
+    
+    def finish(self, save_params):
+        """Escribe el documento final con los parámetros de guardado indicados."""
+        if self._on_disk:
+            # 'clean' reinterpreta el contenido de todas las páginas a la vez y anularía
+            # el ahorro de memoria; las páginas generadas aquí ya tienen contenido limpio
+            save_params = {key: value for key, value in save_params.items() if key != 'clean'}
         try:
-            # Verificar si ya existe un nodo raíz Document
-            root_node = None
-            
-            # Comprobar si hay un nodo raíz
-            try:
-                if hasattr(doc, "get_struct_tree_root"):
-                    root_info = doc.get_struct_tree_root()
-                    if root_info:
-                        # Ya existe un nodo raíz
-                        root_node = 0  # Convención para nodo raíz
-            except Exception as e:
-                logging.debug(f"Error al verificar nodo raíz: {str(e)}")
-            
-            # Crear nodo raíz si no existe
-            if root_node is None and hasattr(doc, "add_struct_element"):
-                try:
-                    root_node = doc.add_struct_element("Document", parent=-1)
-                except Exception as e:
-                    logging.warning(f"Error al crear nodo Document: {str(e)}")
-                    root_node = -1  # Usar nodo predeterminado
-            
-            # Crear un nodo Div para contener el contenido de la página
-            div_node = None
-            try:
-                if hasattr(doc, "add_struct_element") and root_node is not None:
-                    div_node = doc.add_struct_element("Div", parent=root_node, page=page)
-            except Exception as e:
-                logging.warning(f"Error al crear nodo Div: {str(e)}")
-                div_node = root_node if root_node is not None else -1
-                
-            # Procesar el texto para identificar estructura
-            paragraphs = []
-            
-            # Intentar identificar párrafos con diferentes patrones
-            if '\n\n' in text:
-                paragraphs = [p for p in text.split('\n\n') if p.strip()]
-            elif '\n' in text:
-                # Si no hay párrafos claros, usar líneas como párrafos
-                paragraphs = [p for p in text.split('\n') if p.strip()]
+            self.doc.save(self.output_path, **save_params)
+        finally:
+            self.doc.close()
+            if self._on_disk and os.path.exists(self.partial_path):
+                os.unlink(self.partial_path)
+
+def add_image_layer(new_doc, doc, page_num, mode="original", layer=None, layer_dpi=150):
+    """Crea en new_doc la página visible de una página escaneada.
+    
+    Devuelve la página nueva y los bytes de imagen que quedan embebidos en ella.
+    """
+    page = doc[page_num]
+    if mode == "original":
+        # Copiar la página de origen: la imagen escaneada se reutiliza sin tocar su stream
+        new_doc.insert_pdf(doc, from_page=page_num, to_page=page_num)
+        new_page = new_doc[-1]
+        image_bytes = sum(len(new_doc.xref_stream_raw(img[0])) for img in new_page.get_images(full=True))
+        return new_page, image_bytes
+    
+    new_page = new_doc.new_page(width=page.rect.width, height=page.rect.height)
+    if mode == "raster":
+        if layer is None:
+            # El OCR no aportó la capa (p. ej. falló): renderizar solo a la resolución de la capa
+            pix = page.get_pixmap(matrix=fitz.Matrix(layer_dpi/72, layer_dpi/72), alpha=False)
+            layer = encode_image_layer(pix, layer_dpi, layer_dpi)
+        xref = new_page.insert_image(page.rect, stream=layer)
+    else:
+        pix = page.get_pixmap()
+        xref = new_page.insert_image(page.rect, pixmap=pix)
+    return new_page, len(new_doc.xref_stream_raw(xref))
+
+def legacy_layer_cost(page):
+    """Mide lo que costaría la capa de imagen del modo legacy para la página.
+    
+    Repite el camino antiguo (get_pixmap a 72 DPI e insert_image) en un documento
+    desechable y devuelve (bytes embebidos, segundos).
+    """
+    start = time.perf_counter()
+    scratch = fitz.open()
+    try:
+        pix = page.get_pixmap()
+        xref = scratch.new_page(width=page.rect.width, height=page.rect.height).insert_image(page.rect, pixmap=pix)
+        size = len(scratch.xref_stream_raw(xref))
+    finally:
+        scratch.close()
+    return size, time.perf_counter() - start
+
+# Fuente de la capa de texto invisible (se carga una vez por proceso)
+_text_layer_font = None
+
+def get_text_layer_font():
+    """Devuelve la fuente usada para la capa de texto OCR."""
+    global _text_layer_font
+    if _text_layer_font is None:
+        _text_layer_font = fitz.Font("helv")
+    return _text_layer_font
+
+def build_ocr_blocks(layout, heading_ratio=1.5):
+    """Agrupa las palabras OCR (PageLayout) en párrafos con su caja real y su rol de estructura.
+    
+    Devuelve una lista de {'role', 'rect', 'text', 'lines', 'words'} en orden de lectura de
+    Tesseract, donde 'words' es el rango de índices de sus palabras en layout. Un párrafo
+    de una sola línea claramente más alta que la línea típica de la página se marca como
+    encabezado (H).
+    """
+    if not len(layout):
+        return []
+    paragraph_starts = layout.starts(2)
+    line_starts = layout.starts(3)
+    paragraph_boxes = layout.group_boxes(paragraph_starts).tolist()
+    line_boxes = layout.group_boxes(line_starts)
+    line_heights = line_boxes[:, 3] - line_boxes[:, 1]
+    typical_height = float(np.median(line_heights))
+    # Primera línea de cada párrafo y número de líneas que contiene
+    first_lines = np.searchsorted(line_starts, paragraph_starts)
+    line_counts = np.diff(np.append(first_lines, len(line_starts)))
+    words = layout.words()
+    line_starts = line_starts.tolist() + [len(layout)]
+    line_boxes = line_boxes.tolist()
+    
+    blocks = []
+    paragraph_ends = paragraph_starts.tolist()[1:] + [len(layout)]
+    for index, (start, end) in enumerate(zip(paragraph_starts.tolist(), paragraph_ends)):
+        first = int(first_lines[index])
+        count = int(line_counts[index])
+        role = 'P'
+        if count == 1 and typical_height and line_heights[first] >= typical_height * heading_ratio:
+            role = 'H'
+        blocks.append({
+            'role': role,
+            'rect': fitz.Rect(paragraph_boxes[index]),
+            'text': '\n'.join(' '.join(words[line_starts[line]:line_starts[line + 1]])
+                              for line in range(first, first + count)),
+            'lines': [fitz.Rect(box) for box in line_boxes[first:first + count]],
+            'words': range(start, end)
+        })
+    return blocks
+
+# Extracción de texto para el análisis de maquetación: sin las imágenes (se localizan
+# aparte con get_image_info) para no copiar sus datos en cada página
+LAYOUT_TEXT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+
+def page_spans(page):
+    """Extrae una sola vez los spans de texto y las imágenes visibles de una página nativa.
+    
+    Devuelve (PageLayout con un span por unidad, array n×4 de cajas de imagen, array n
+    con sus xref), todo en coordenadas de la página sin rotar.
+    """
+    layout = PageLayout.from_text_dict(page.get_text("dict", flags=LAYOUT_TEXT_FLAGS))
+    boxes = []
+    xrefs = []
+    if page.get_images():
+        area = fitz.Rect(0, 0, page.cropbox.width, page.cropbox.height)
+        for info in page.get_image_info(xrefs=True):
+            rect = fitz.Rect(info['bbox']) & area
+            if info['xref'] and not rect.is_empty:
+                boxes.append(tuple(rect))
+                xrefs.append(info['xref'])
+    return layout, np.array(boxes, dtype=np.float32).reshape(-1, 4), np.array(xrefs, dtype=np.int64)
+
+def heading_sizes(layouts, heading_ratio=1.15):
+    """Agrupa los tamaños de letra del documento en texto normal y niveles de encabezado.
+    
+    Los tamaños se redondean a medio punto; el del texto normal es el que más caracteres
+    escribe en todo el documento y los que lo superan en heading_ratio se ordenan de
+    mayor a menor como H1, H2... (H6 para el resto). Devuelve (clave del texto normal,
+    array clave -> nivel, 0 si no es encabezado), con clave = round(tamaño * 2).
+    """
+    sizes = np.concatenate([layout.sizes for layout in layouts] + [np.zeros(0, dtype=np.float32)])
+    chars = np.concatenate([np.diff(layout.offsets) for layout in layouts] + [np.zeros(0, dtype=np.int64)])
+    if not len(sizes):
+        return 0, np.zeros(1, dtype=np.int8)
+    keys = np.round(sizes * 2).astype(np.int64)
+    weights = np.bincount(keys, weights=chars)
+    body = int(weights.argmax())
+    used = np.flatnonzero(weights)
+    headings = used[used >= body * heading_ratio][::-1]
+    levels = np.zeros(len(weights), dtype=np.int8)
+    levels[headings] = np.minimum(np.arange(1, len(headings) + 1), 6)
+    return body, levels
+
+def reading_order(boxes, width, gutter=8, spanning_ratio=0.55):
+    """Orden de lectura de los bloques de una página: por columnas, de arriba abajo.
+    
+    Las columnas se separan por los huecos verticales del perfil de ocupación horizontal
+    de los bloques (x -> altura de los bloques que lo cubren). Los bloques anchos o que
+    cruzan un hueco ocupan toda la página y la dividen en franjas que se leen en orden;
+    dentro de cada franja se lee columna a columna. Devuelve los índices ordenados.
+    """
+    if len(boxes) < 2:
+        return np.arange(len(boxes))
+    x0, y0, x1, y1 = boxes.T
+    spanning = (x1 - x0) > width * spanning_ratio
+    boundaries = np.zeros(0)
+    narrow = ~spanning
+    if narrow.sum() > 1:
+        size = int(np.ceil(max(width, float(x1.max())))) + 2
+        profile = np.zeros(size + 1)
+        np.add.at(profile, np.clip(np.floor(x0[narrow]), 0, size).astype(np.int64), y1[narrow] - y0[narrow])
+        np.add.at(profile, np.clip(np.ceil(x1[narrow]), 0, size).astype(np.int64), y0[narrow] - y1[narrow])
+        coverage = np.cumsum(profile)[:size]
+        low = int(np.floor(x0[narrow].min()))
+        high = int(np.ceil(x1[narrow].max()))
+        # Huecos: casi sin ocupación (un título estrecho puede cruzar el hueco entre columnas)
+        empty = (coverage[low:high] <= coverage.max() * 0.05).astype(np.int8)
+        edges = np.diff(np.concatenate(([0], empty, [0])))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        wide = (ends - starts) >= gutter
+        boundaries = low + (starts[wide] + ends[wide]) / 2
+    if len(boundaries):
+        spanning |= np.any((x0[:, None] < boundaries) & (x1[:, None] > boundaries), axis=1)
+    column = np.searchsorted(boundaries, (x0 + x1) / 2)
+    column[spanning] = 0
+    tops = np.sort(y0[spanning])
+    band = 2 * np.searchsorted(tops, y0)
+    band[spanning] += 1
+    return np.lexsort((x0, y0, column, band))
+
+def plan_page_layout(layout, image_boxes, image_xrefs, width, body, levels, max_heading_lines=3):
+    """Plan de estructura de una página nativa a partir de sus spans.
+    
+    Cada bloque de MuPDF es un párrafo (P) o, si todas sus líneas (como mucho
+    max_heading_lines) tienen un tamaño de encabezado, un H1-H6; un bloque de una línea
+    en negrita y del tamaño del texto normal pasa a ser el encabezado del nivel siguiente
+    a los detectados por tamaño. Las imágenes son bloques Figure con su 'xref'.
+    Devuelve los bloques en orden de lectura, con el formato de build_ocr_blocks.
+    """
+    roles = []
+    boxes = []
+    texts = []
+    lines = []
+    if len(layout):
+        line_starts = layout.starts(3)
+        block_starts = layout.starts(2)
+        # Nivel de cada línea según el mayor tamaño de letra que contiene
+        keys = np.round(np.maximum.reduceat(layout.sizes, line_starts) * 2).astype(np.int64)
+        line_levels = levels[np.clip(keys, 0, len(levels) - 1)]
+        line_bold = np.logical_and.reduceat(layout.bold, line_starts)
+        line_chars = np.add.reduceat(np.diff(layout.offsets), line_starts)
+        first_lines = np.searchsorted(line_starts, block_starts)
+        line_counts = np.diff(np.append(first_lines, len(line_starts)))
+        block_levels = np.minimum.reduceat(line_levels, first_lines)
+        uniform = block_levels == np.maximum.reduceat(line_levels, first_lines)
+        block_levels[~uniform | (line_counts > max_heading_lines)] = 0
+        bold_heading = ((line_counts == 1) & line_bold[first_lines] & (keys[first_lines] == body)
+                        & (line_chars[first_lines] <= 100) & (block_levels == 0))
+        block_levels[bold_heading] = min(int(levels.max(initial=0)) + 1, 6)
+        
+        # Texto de cada línea: sus spans seguidos
+        words = layout.words()
+        bounds = line_starts.tolist() + [len(layout)]
+        line_texts = ["".join(words[start:end]).strip() for start, end in zip(bounds, bounds[1:])]
+        line_boxes = layout.group_boxes(line_starts).tolist()
+        for index, (first, count) in enumerate(zip(first_lines.tolist(), line_counts.tolist())):
+            level = int(block_levels[index])
+            roles.append(f"H{level}" if level else "P")
+            texts.append("\n".join(line_texts[first:first + count]))
+            lines.append([fitz.Rect(box) for box in line_boxes[first:first + count]])
+        boxes.append(layout.group_boxes(block_starts))
+    boxes.append(image_boxes)
+    boxes = np.vstack(boxes)
+    
+    blocks = []
+    image_xrefs = image_xrefs.tolist()
+    for index in reading_order(boxes, width).tolist():
+        rect = fitz.Rect(boxes[index].tolist())
+        if index < len(roles):
+            blocks.append({'role': roles[index], 'rect': rect, 'text': texts[index], 'lines': lines[index]})
+        else:
+            blocks.append({'role': 'Figure', 'rect': rect, 'text': "", 'lines': [rect],
+                           'xref': image_xrefs[index - len(roles)]})
+    return blocks
+
+def plan_native_layout(doc, page_numbers):
+    """Análisis de maquetación de las páginas con texto nativo de un documento.
+    
+    Extrae los spans de cada página una sola vez, agrupa los tamaños de letra de todo
+    el documento (los niveles de encabezado son comunes a todas sus páginas) y planifica
+    cada página. Devuelve {número de página: bloques en orden de lectura}.
+    """
+    pages = {}
+    for page_num in page_numbers:
+        page = doc[page_num]
+        pages[page_num] = page_spans(page) + (page.cropbox.width,)
+    body, levels = heading_sizes([spans[0] for spans in pages.values()])
+    return {page_num: plan_page_layout(*spans, body, levels) for page_num, spans in pages.items()}
+
+# Elementos de un array TJ: cadenas hexadecimales (una por palabra escrita) y ajustes de posición
+TJ_TOKEN = re.compile(rb"<[0-9A-Fa-f]*>|-?[0-9.]+")
+
+def mark_text_layer(content, marks):
+    """Envuelve el texto de cada bloque de la capa de texto en su secuencia marcada.
+    
+    marks tiene un elemento por palabra escrita, en orden: (rol, mcid) o None para
+    contenido sin estructura, que se marca como /Artifact. TextWriter une en un mismo
+    TJ las palabras de una línea, así que cada TJ se parte allí donde cambia el bloque.
+    Devuelve None si el contenido no corresponde a las palabras indicadas.
+    """
+    output = []
+    current = False
+    position = 0
+    for line in content.split(b"\n"):
+        if not line.endswith(b"TJ"):
+            if line == b"ET" and current is not False:
+                output.append(b"EMC")
+                current = False
+            output.append(line)
+            continue
+        
+        # Agrupar las cadenas del TJ por su marca; cada ajuste va con la cadena siguiente
+        groups = []
+        pending = []
+        for token in TJ_TOKEN.findall(line[:line.rindex(b"]")]):
+            pending.append(token)
+            if token.startswith(b"<"):
+                if position >= len(marks):
+                    return None
+                mark = marks[position]
+                position += 1
+                if groups and groups[-1][0] == mark:
+                    groups[-1][1].extend(pending)
+                else:
+                    groups.append((mark, pending))
+                pending = []
+        if pending and groups:
+            groups[-1][1].extend(pending)
+        
+        for mark, tokens in groups:
+            if mark != current:
+                if current is not False:
+                    output.append(b"EMC")
+                output.append(b"/Artifact BMC" if mark is None else f"/{mark[0]} <</MCID {mark[1]}>> BDC".encode())
+                current = mark
+            output.append(b"[" + b" ".join(tokens) + b"]TJ")
+    if position != len(marks):
+        return None
+    return b"\n".join(output)
+
+def insert_ocr_text_layer(page, layout, blocks=None):
+    """Inserta la capa de texto invisible con cada palabra sobre su caja, en una sola escritura.
+    
+    El tamaño de letra se ajusta a la altura de la caja y se reduce si la palabra
+    resultante sería más ancha que la caja. Si los bloques traen 'mcid' (ver
+    XrefStructureTagger), el texto de cada bloque se marca con su MCID y el contenido
+    previo de la página (la imagen escaneada) como /Artifact, reescribiendo el
+    contenido de la página una sola vez. Devuelve False si había MCID que marcar y no
+    se pudo (la capa de texto queda escrita sin marcar).
+    """
+    font = get_text_layer_font()
+    font_height = font.ascender - font.descender
+    word_marks = {}
+    if blocks and any('mcid' in block for block in blocks):
+        for block in blocks:
+            mark = (block['role'], block['mcid']) if 'mcid' in block else None
+            for word_index in block['words']:
+                word_marks[word_index] = mark
+    
+    writer = fitz.TextWriter(page.rect)
+    marks = []
+    # Tamaño de letra por altura de caja calculado para todas las palabras a la vez
+    fontsizes = ((layout.boxes[:, 3] - layout.boxes[:, 1]) / font_height).tolist()
+    for word_index, (box, word, fontsize) in enumerate(zip(layout.boxes.tolist(), layout.words(), fontsizes)):
+        x0, y0, x1, y1 = box
+        if y1 <= y0 or x1 <= x0:
+            continue
+        natural_width = font.text_length(word, fontsize=fontsize)
+        if natural_width > x1 - x0:
+            fontsize *= (x1 - x0) / natural_width
+        baseline = y1 + font.descender * fontsize
+        writer.append((x0, baseline), word, font=font, fontsize=fontsize)
+        marks.append(word_marks.get(word_index))
+    
+    if not word_marks:
+        # Modo de renderizado 3: texto invisible pero seleccionable y legible por lectores de pantalla
+        writer.write_text(page, render_mode=3)
+        return True
+    
+    doc = page.parent
+    previous = page.read_contents()
+    writer.write_text(page, render_mode=3)
+    text_xref = page.get_contents()[-1]
+    text_layer = mark_text_layer(doc.xref_stream(text_xref), marks)
+    if text_layer is None:
+        logging.warning(f"No se pudo marcar la capa de texto de la página {page.number+1}")
+        return False
+    
+    # La imagen visible no forma parte del contenido lógico: se marca como artefacto
+    artifact = b"/Artifact BMC\nq\n" + previous + b"\nQ\nEMC\n" if previous.strip() else b""
+    doc.update_stream(text_xref, artifact + text_layer)
+    page.set_contents(text_xref)
+    return True
+
+# Tokens de un stream de contenido: cadenas, hexadecimales, diccionarios, arrays,
+# nombres, comentarios y el resto (números y operadores)
+CONTENT_TOKEN = re.compile(
+    rb"\((?:\\.|[^\\()])*\)|<<|>>|<[0-9A-Fa-f\s]*>|[\[\]]|/[^\s/\[\]()<>{}%]*|%[^\r\n]*|[^\s/\[\]()<>{}%]+")
+INLINE_IMAGE_END = re.compile(rb"\sEI(?=\s|$)")
+NUMBER = re.compile(rb"[+-]?(\d+\.?\d*|\.\d+)$")
+
+# Operadores que pintan en la página
+PAINT_OPERATORS = frozenset((b"Tj", b"TJ", b"'", b'"', b"Do", b"BI", b"sh",
+                             b"S", b"s", b"f", b"F", b"f*", b"B", b"B*", b"b", b"b*"))
+TEXT_SHOW_OPERATORS = frozenset((b"Tj", b"TJ", b"'", b'"'))
+PATH_OPERATORS = frozenset((b"m", b"l", b"c", b"v", b"y", b"h", b"re"))
+PATH_PAINT_OPERATORS = frozenset((b"S", b"s", b"f", b"F", b"f*", b"B", b"B*", b"b", b"b*"))
+# Operadores que cierran el tramo de texto en curso
+RUN_BREAK_OPERATORS = (frozenset((b"BT", b"ET", b"BDC", b"BMC", b"EMC", b"BI", b"Do", b"sh", b"n", b"q", b"Q"))
+                       | PATH_OPERATORS | PATH_PAINT_OPERATORS)
+
+def is_operand(token):
+    """Indica si un token de contenido es un operando (y no un operador)."""
+    return (token[:1] in b"(<[]/" or NUMBER.match(token) is not None
+            or token in (b"true", b"false", b"null", b">>"))
+
+def concat_matrix(first, second):
+    """Producto de dos matrices PDF (a, b, c, d, e, f): aplica first y después second.
+    
+    Con tuplas en lugar de fitz.Matrix, ya que el marcado la llama por cada operador.
+    """
+    a1, b1, c1, d1, e1, f1 = first
+    a2, b2, c2, d2, e2, f2 = second
+    return (a1 * a2 + b1 * c2, a1 * b2 + b1 * d2, c1 * a2 + d1 * c2, c1 * b2 + d1 * d2,
+            e1 * a2 + f1 * c2 + e2, e1 * b2 + f1 * d2 + f2)
+
+def mark_native_content(content, page_matrix, blocks, images, max_distance=20):
+    """Marca el contenido de una página nativa según su plan de estructura.
+    
+    Recorre el stream una sola vez siguiendo la matriz de transformación y la de línea
+    de texto (el avance dentro de la línea no se calcula). Cada tramo de texto se
+    asigna al bloque que contiene su origen (o al más cercano a menos de max_distance
+    puntos), cada imagen a la figura del plan de su misma xref más próxima, y el resto
+    de lo que se pinta (trazados, sombreados, imágenes en línea o decorativas y texto
+    fuera de los bloques) se marca como /Artifact. images es {nombre del recurso:
+    (xref, texto alternativo o None si es decorativa)}.
+    Devuelve (contenido, {índice de bloque: [mcid]}) o None si la página dibuja
+    formularios XObject o ya tiene contenido con MCID.
+    """
+    if MCID_TOKEN.search(content):
+        return None
+    boxes = np.array([tuple(block['rect']) for block in blocks], dtype=np.float64).reshape(-1, 4)
+    is_text = np.array([block['role'] != 'Figure' for block in blocks], dtype=bool)
+    figure_xrefs = np.array([block.get('xref', 0) for block in blocks], dtype=np.int64)
+    has_text = bool(is_text.any())
+    
+    def text_block(x, y):
+        """Bloque de texto que contiene el punto, el más cercano o None."""
+        if not has_text:
+            return None
+        dx = np.maximum(np.maximum(boxes[:, 0] - x, x - boxes[:, 2]), 0)
+        dy = np.maximum(np.maximum(boxes[:, 1] - y, y - boxes[:, 3]), 0)
+        distance = np.where(is_text, np.hypot(dx, dy), np.inf)
+        index = int(distance.argmin())
+        return index if distance[index] <= max_distance else None
+    
+    def figure_block(xref, x, y):
+        """Figura del plan con la misma imagen cuyo centro está más cerca del punto."""
+        candidates = np.flatnonzero(figure_xrefs == xref)
+        if not len(candidates):
+            return None
+        centers = (boxes[candidates, :2] + boxes[candidates, 2:]) / 2
+        return int(candidates[np.hypot(centers[:, 0] - x, centers[:, 1] - y).argmin()])
+    
+    # Marcas: (bloque o None para /Artifact, inicio, fin, prefijo, sufijo, matriz de línea)
+    marks = []
+    run = None  # Tramo de texto abierto, como lista con los campos de una marca
+    # Matrices como tuplas; device = matriz de transformación por la de la página
+    identity = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+    page_matrix = tuple(page_matrix)
+    ctm = identity
+    device = page_matrix
+    stack = []
+    tlm = identity
+    leading = 0.0
+    fontsize = 0.0
+    operands = []
+    operand_start = 0
+    path_start = None
+    inline_start = None
+    text_start = None
+    text_marks = 0
+    splittable = True
+    positioned = True
+    pos = 0
+    length = len(content)
+    while pos < length:
+        match = CONTENT_TOKEN.search(content, pos)
+        if match is None:
+            break
+        token = match.group()
+        pos = match.end()
+        if token[:1] == b"%":
+            continue
+        if is_operand(token):
+            if not operands:
+                operand_start = match.start()
+            operands.append(token)
+            continue
+        
+        # Operador: su objeto empieza en el primer operando
+        start = operand_start if operands else match.start()
+        if run is not None and token in RUN_BREAK_OPERATORS:
+            marks.append(tuple(run))
+            run = None
+        if token in (b"BDC", b"BMC", b"EMC"):
+            splittable = False
+        
+        if token == b"q":
+            stack.append(ctm)
+        elif token == b"Q":
+            if stack:
+                ctm = stack.pop()
+                device = concat_matrix(ctm, page_matrix)
+        elif token == b"cm" and len(operands) == 6:
+            ctm = concat_matrix(tuple(float(value) for value in operands), ctm)
+            device = concat_matrix(ctm, page_matrix)
+        elif token == b"BT":
+            tlm = identity
+            text_start = start
+            text_marks = len(marks)
+            splittable = positioned = True
+        elif token == b"ET" and text_start is not None:
+            # Cada bloque de un objeto de texto se envuelve en un objeto de texto propio,
+            # BT y ET incluidos: se cierra antes de cada cambio de bloque y se reabre con
+            # su matriz de texto (la de la línea, si no se ha escrito nada desde el
+            # último posicionamiento). Si no es posible, las marcas quedan dentro del objeto.
+            runs = marks[text_marks:]
+            if runs and splittable and all(run[5] is not None for run in runs[1:]):
+                bounds = [text_start] + [run[1] for run in runs[1:]] + [pos]
+                marks[text_marks:] = [
+                    (run[0], bounds[index], bounds[index + 1],
+                     b"BT\n%s Tm\n" % " ".join(f"{value:g}" for value in run[5]).encode() if index else b"",
+                     b"\nET" if index < len(runs) - 1 else b"", None)
+                    for index, run in enumerate(runs)]
+            text_start = None
+        elif token == b"Tf" and operands:
+            fontsize = float(operands[-1])
+        elif token == b"TL" and operands:
+            leading = float(operands[0])
+        elif token in (b"Td", b"TD") and len(operands) == 2:
+            tx, ty = float(operands[0]), float(operands[1])
+            if token == b"TD":
+                leading = -ty
+            tlm = concat_matrix((1.0, 0.0, 0.0, 1.0, tx, ty), tlm)
+            positioned = True
+        elif token == b"Tm" and len(operands) == 6:
+            tlm = tuple(float(value) for value in operands)
+            positioned = True
+        elif token == b"T*":
+            tlm = concat_matrix((1.0, 0.0, 0.0, 1.0, 0.0, -leading), tlm)
+            positioned = True
+        elif token in TEXT_SHOW_OPERATORS:
+            if token != b"Tj" and token != b"TJ":
+                tlm = concat_matrix((1.0, 0.0, 0.0, 1.0, 0.0, -leading), tlm)
+                positioned = True
+            # Origen del tramo, un poco por encima de la línea base para caer dentro de su caja
+            a, b, c, d, e, f = concat_matrix(tlm, device)
+            rise = fontsize * 0.3
+            block = text_block(c * rise + e, d * rise + f)
+            if run is not None and run[0] == block:
+                run[2] = pos
             else:
-                # Si no hay separadores, tratar todo como un párrafo
-                paragraphs = [text] if text.strip() else []
-            
-            # Para cada párrafo, crear un nodo P
-            for i, para in enumerate(paragraphs):
-                if not para.strip():
-                    continue
-                    
-                try:
-                    # Crear elemento de párrafo
-                    parent = div_node if div_node is not None else -1
-                    p_node = doc.add_struct_element("P", parent=parent, page=page)
-                    
-                    # Calcular posición aproximada para este párrafo
-                    total_paragraphs = max(len(paragraphs), 1)
-                    top = (i * page.rect.height) / total_paragraphs
-                    height = page.rect.height / total_paragraphs
-                    p_rect = fitz.Rect(0, top, page.rect.width, top + height)
-                    
-                    # Añadir contenido al nodo
-                    doc.append_struct_element(p_node, 0, p_rect, para)
-                    
-                    logging.debug(f"Párrafo {i+1} etiquetado correctamente")
-                except Exception as e:
-                    logging.warning(f"Error al etiquetar párrafo {i+1}: {str(e)}")
-            
+                if run is not None:
+                    marks.append(tuple(run))
+                run = [block, start, pos, b"", b"", tlm if positioned else None]
+            positioned = False
+        elif token == b"Do" and operands:
+            name = operands[0][1:].decode('latin-1')
+            if name not in images:
+                # Formulario XObject: su contenido no se puede marcar desde la página
+                return None
+            xref, alt_text = images[name]
+            block = None
+            if alt_text:
+                # Centro del cuadrado unidad en el que se dibuja la imagen
+                a, b, c, d, e, f = device
+                block = figure_block(xref, (a + c) / 2 + e, (b + d) / 2 + f)
+            marks.append((block, start, pos, b"", b"", None))
+        elif token in PATH_OPERATORS:
+            if path_start is None:
+                path_start = start
+        elif token in PATH_PAINT_OPERATORS:
+            marks.append((None, start if path_start is None else path_start, pos, b"", b"", None))
+            path_start = None
+        elif token == b"n":
+            path_start = None
+        elif token == b"sh":
+            marks.append((None, start, pos, b"", b"", None))
+        elif token == b"BI":
+            inline_start = match.start()
+        elif token == b"ID":
+            # Datos binarios de una imagen en línea: saltar hasta EI
+            end = INLINE_IMAGE_END.search(content, pos)
+            pos = end.end() if end else length
+            marks.append((None, match.start() if inline_start is None else inline_start, pos, b"", b"", None))
+            inline_start = None
+        operands = []
+    if run is not None:
+        marks.append(tuple(run))
+    
+    # Reescribir el contenido una sola vez con las secuencias marcadas en su orden
+    output = []
+    block_mcids = {}
+    mcid = 0
+    last = 0
+    for block, start, end, prefix, suffix, _ in sorted(marks, key=lambda mark: mark[1]):
+        output.append(content[last:start])
+        if block is None:
+            output.append(b"\n/Artifact BMC\n")
+        else:
+            output.append(f"\n/{blocks[block]['role']} <</MCID {mcid}>> BDC\n".encode())
+            block_mcids.setdefault(block, []).append(mcid)
+            mcid += 1
+        output.append(prefix)
+        output.append(content[start:end])
+        output.append(suffix)
+        output.append(b"\nEMC\n")
+        last = end
+    output.append(content[last:])
+    return b"".join(output), block_mcids
+
+# Métodos de la API de estructura de PyMuPDF (solo existen en algunas versiones)
+STRUCTURE_METHODS = ("init_doc_structure", "add_struct_element", "append_struct_element",
+                     "set_struct_alt", "get_struct_tree_root", "is_tagged", "set_xml_metadata")
+
+@functools.lru_cache(maxsize=None)
+def probe_capabilities():
+    """Resuelve una sola vez por proceso las capacidades de la versión de PyMuPDF instalada."""
+    methods = frozenset(name for name in STRUCTURE_METHODS if hasattr(fitz.Document, name))
+    save_params = frozenset(inspect.signature(fitz.Document.save).parameters)
+    
+    # Las versiones recientes de MuPDF ya no saben linealizar al guardar
+    linear = False
+    if "linear" in save_params:
+        try:
+            probe = fitz.open()
+            probe.new_page()
+            probe.tobytes(linear=True)
+            linear = True
+        except Exception:
+            linear = False
+    
+    capabilities = {
+        'version': fitz.VersionBind,
+        'methods': methods,
+        'save_params': save_params,
+        'linear': linear,
+        'rewrite_images': hasattr(fitz.Document, "rewrite_images")
+    }
+    logging.debug(f"Capacidades de PyMuPDF {capabilities['version']}: {sorted(methods)}, linealizar={linear}")
+    return capabilities
+
+# Códigos de idioma de Tesseract (ISO 639-2) a etiquetas de idioma para /Lang
+LANGUAGE_TAGS = {
+    'spa': 'es', 'eng': 'en', 'cat': 'ca', 'glg': 'gl', 'eus': 'eu',
+    'por': 'pt', 'fra': 'fr', 'deu': 'de', 'ita': 'it'
+}
+
+def pdf_language(language):
+    """Convierte el idioma de OCR ('spa' o 'spa+eng') en la etiqueta de idioma del PDF."""
+    primary = language.split('+')[0]
+    return LANGUAGE_TAGS.get(primary, primary)
+
+class NativeStructureTagger:
+    """Etiquetado mediante la API de estructura de PyMuPDF, en las versiones que la incluyen."""
+    
+    name = "native"
+    enabled = True
+    
+    def __init__(self):
+        self.root_node = None
+    
+    def begin(self, doc, language):
+        """Prepara el árbol de estructura del documento."""
+        if not doc.is_tagged:
+            doc.init_doc_structure()
+        self.root_node = doc.add_struct_element("Document", parent=-1)
+    
+    def tag_page(self, doc, page, blocks):
+        """Etiqueta los bloques de texto de una página."""
+        div_node = doc.add_struct_element("Div", parent=self.root_node, page=page)
+        for block in blocks:
+            node = doc.add_struct_element(block['role'], parent=div_node, page=page)
+            doc.append_struct_element(node, 0, block['rect'], block['text'])
+    
+    def commit_page(self, doc, page, marked):
+        """Los elementos ya quedan completos en tag_page."""
+    
+    def tag_content(self, doc, page, text):
+        """Etiqueta el texto nativo de una página repartido en párrafos."""
+        self.tag_page(doc, page, [block for block in text_to_blocks(page, text) if block['text'].strip()])
+    
+    def tag_layout(self, doc, page, blocks, images):
+        """Etiqueta los bloques del plan de maquetación y sus figuras con texto alternativo."""
+        self.tag_page(doc, page, [block for block in blocks if block['role'] != 'Figure'])
+        alts = dict(images.values())
+        for block in blocks:
+            if block['role'] == 'Figure' and alts.get(block['xref']):
+                self.tag_figure(doc, page, block['rect'], alts[block['xref']])
+        return True
+    
+    def tag_figure(self, doc, page, rect, alt_text):
+        """Etiqueta una imagen como figura con texto alternativo."""
+        node = doc.add_struct_element("Figure", parent=self.root_node, page=page)
+        doc.set_struct_alt(node, alt_text)
+        doc.append_struct_element(node, 0, rect, "")
+    
+    def finish(self, doc):
+        """Completa el árbol de estructura antes de guardar."""
+
+# Tipos de estructura estándar de PDF 1.7; cualquier otro rol se declara en /RoleMap
+STANDARD_ROLES = frozenset((
+    "Document", "Part", "Art", "Sect", "Div", "BlockQuote", "Caption", "TOC", "TOCI",
+    "Index", "NonStruct", "Private", "P", "H", "H1", "H2", "H3", "H4", "H5", "H6",
+    "L", "LI", "Lbl", "LBody", "Table", "TR", "TH", "TD", "THead", "TBody", "TFoot",
+    "Span", "Quote", "Note", "Reference", "BibEntry", "Code", "Link", "Annot",
+    "Ruby", "Warichu", "Figure", "Formula", "Form"
+))
+
+class XrefStructureTagger:
+    """Escritor de estructura a nivel de objetos PDF, sin depender de la API de PyMuPDF.
+    
+    En una sola pasada por página envuelve el contenido en secuencias marcadas (BDC/EMC
+    con MCID), escribe los elementos de estructura de la página y registra su entrada
+    en el ParentTree. Al terminar el documento escribe StructTreeRoot, el elemento
+    Document, ParentTree, RoleMap, /MarkInfo y /Lang. Cada objeto se escribe completo
+    una sola vez, sin ediciones clave a clave.
+    """
+    
+    name = "xref"
+    
+    def __init__(self):
+        self.root_xref = None
+        self.document_xref = None
+        self.children = []
+        self.parent_tree = []
+        self.roles = set()
+        self.wrapped = set()
+        self.marked = {}
+        self.pending = {}
+        self.enabled = True
+    
+    def _element(self, doc, role, parent_xref, page=None, kids="", extra=""):
+        """Escribe un elemento de estructura completo y devuelve su xref."""
+        xref = doc.get_new_xref()
+        page_ref = f" /Pg {page.xref} 0 R" if page is not None else ""
+        kids_ref = f" /K {kids}" if kids else ""
+        doc.update_object(xref, f"<< /Type /StructElem /S /{role} /P {parent_xref} 0 R"
+                                f"{page_ref}{kids_ref}{extra} >>")
+        self.roles.add(role)
+        return xref
+    
+    def _register_page(self, doc, page, elements):
+        """Asigna a la página su clave del ParentTree (un elemento por MCID)."""
+        doc.xref_set_key(page.xref, "StructParents", str(len(self.parent_tree)))
+        doc.xref_set_key(page.xref, "Tabs", "/S")
+        self.parent_tree.append(elements)
+    
+    def begin(self, doc, language):
+        """Reserva la raíz del árbol de estructura y marca el documento como etiquetado."""
+        catalog = doc.pdf_catalog()
+        if doc.xref_get_key(catalog, "StructTreeRoot")[0] != "null":
+            # El documento ya está etiquetado: conservar su árbol en lugar de sustituirlo
+            self.enabled = False
+            return
+        self.root_xref = doc.get_new_xref()
+        self.document_xref = doc.get_new_xref()
+        doc.xref_set_key(catalog, "StructTreeRoot", f"{self.root_xref} 0 R")
+        doc.xref_set_key(catalog, "MarkInfo", "<< /Marked true >>")
+        doc.xref_set_key(catalog, "Lang", fitz.get_pdf_str(pdf_language(language)))
+    
+    def tag_page(self, doc, page, blocks):
+        """Reserva un MCID por bloque de texto de la página.
+        
+        Cada bloque recibe su 'mcid'; insert_ocr_text_layer marca con él el texto del
+        bloque al escribir la capa de texto, y commit_page escribe después los elementos.
+        """
+        if not self.enabled:
+            return
+        for mcid, block in enumerate(blocks):
+            block['mcid'] = mcid
+        self.pending[page.xref] = blocks
+    
+    def commit_page(self, doc, page, marked):
+        """Crea el Div de la página con un elemento por bloque reservado en tag_page.
+        
+        Si la capa de texto no se pudo marcar (marked falso), los MCID no existen en el
+        contenido: no se escriben sus elementos y la página se etiqueta entera con
+        tag_content.
+        """
+        blocks = self.pending.pop(page.xref, None)
+        if not blocks:
+            return
+        if not marked:
+            self.tag_content(doc, page, "")
+            return
+        div_xref = doc.get_new_xref()
+        elements = [self._element(doc, block['role'], div_xref, page, str(block['mcid'])) for block in blocks]
+        kids = "[" + " ".join(f"{xref} 0 R" for xref in elements) + "]"
+        doc.update_object(div_xref, f"<< /Type /StructElem /S /Div /P {self.document_xref} 0 R "
+                                    f"/Pg {page.xref} 0 R /K {kids} >>")
+        self._register_page(doc, page, elements)
+        self.children.append(div_xref)
+    
+    def tag_content(self, doc, page, text):
+        """Etiqueta una página con texto nativo como una única secuencia marcada.
+        
+        El contenido original no se divide por párrafos: se envuelve entero en un Div
+        con MCID 0, de modo que su texto real queda dentro del árbol de estructura.
+        """
+        if not self.enabled:
+            return
+        xrefs = page.get_contents()
+        if not xrefs:
+            return
+        if xrefs[0] in self.marked:
+            self._tag_marked(doc, page, self.marked[xrefs[0]])
+            return
+        # Un stream compartido por varias páginas se envuelve una sola vez: el MCID 0
+        # se resuelve con el /StructParents de cada página
+        if xrefs[0] not in self.wrapped:
+            content = page.read_contents()
+            doc.update_stream(xrefs[0], b"/Div <</MCID 0>> BDC\nq\n" + content + b"\nQ\nEMC\n")
+            if len(xrefs) > 1:
+                page.set_contents(xrefs[0])
+            self.wrapped.add(xrefs[0])
+        div_xref = self._element(doc, "Div", self.document_xref, page, "0")
+        self._register_page(doc, page, [div_xref])
+        self.children.append(div_xref)
+    
+    def _tag_marked(self, doc, page, elements):
+        """Crea el Div de la página con un elemento por (rol, MCID, entradas extra)."""
+        if not elements:
+            return
+        div_xref = doc.get_new_xref()
+        kids = []
+        by_mcid = {}
+        for role, mcids, extra in elements:
+            marked = str(mcids[0]) if len(mcids) == 1 else "[" + " ".join(str(mcid) for mcid in mcids) + "]"
+            xref = self._element(doc, role, div_xref, page, marked, extra)
+            kids.append(f"{xref} 0 R")
+            for mcid in mcids:
+                by_mcid[mcid] = xref
+        doc.update_object(div_xref, f"<< /Type /StructElem /S /Div /P {self.document_xref} 0 R "
+                                    f"/Pg {page.xref} 0 R /K [{' '.join(kids)}] >>")
+        self._register_page(doc, page, [by_mcid[mcid] for mcid in range(len(by_mcid))])
+        self.children.append(div_xref)
+    
+    def tag_layout(self, doc, page, blocks, images):
+        """Etiqueta una página nativa según su plan de maquetación (ver plan_native_layout).
+        
+        El contenido se marca con mark_native_content y cada bloque con contenido pasa a
+        ser un elemento con sus MCID, en el orden de lectura del plan; las figuras llevan
+        su texto alternativo. Devuelve False si el contenido no se puede marcar así y la
+        página debe etiquetarse con tag_content.
+        """
+        if not self.enabled:
             return True
-            
-        except Exception as e:
-            logging.error(f"Error al crear estructura jerárquica: {str(e)}")
-            
-            # Plan B: Intentar un enfoque más simple si el jerárquico falla
-            try:
-                # Añadir todas las líneas de texto como elementos etiquetados directamente
-                lines = [line for line in text.split('\n') if line.strip()]
-                
-                # Si hay texto, pero no se identifica como líneas, tratar como un solo párrafo
-                if text.strip() and not lines:
-                    lines = [text.strip()]
-                
-                # Altura aproximada para cada línea de texto
-                line_height = page.rect.height / max(len(lines), 1)
-                
-                for i, line in enumerate(lines):
-                    if not line.strip():
-                        continue
-                        
-                    try:
-                        # Crear elemento de párrafo
-                        p_node = doc.add_struct_element("P", parent=-1, page=page)
-                        
-                        # Calcular una posición aproximada para esta línea de texto
-                        y_pos = i * line_height
-                        text_rect = fitz.Rect(0, y_pos, page.rect.width, y_pos + line_height)
-                        
-                        # Añadir contenido al párrafo
-                        doc.append_struct_element(p_node, 0, text_rect, line)
-                    except Exception as e:
-                        logging.warning(f"Error al etiquetar línea de texto: {str(e)}")
-                
-                return True
-            except Exception as e:
-                logging.error(f"Error en plan B de etiquetado: {str(e)}")
+        xrefs = page.get_contents()
+        if not xrefs:
+            return True
+        elements = self.marked.get(xrefs[0])
+        if elements is None:
+            if xrefs[0] in self.wrapped:
                 return False
+            result = mark_native_content(page.read_contents(), page.transformation_matrix, blocks, images)
+            if result is None:
+                return False
+            content, block_mcids = result
+            alts = dict(images.values())
+            elements = []
+            for index, block in enumerate(blocks):
+                if index not in block_mcids:
+                    continue
+                extra = ""
+                if block['role'] == 'Figure':
+                    bbox = block['rect'] * ~page.transformation_matrix
+                    extra = (f" /Alt {fitz.get_pdf_str(alts[block['xref']])} /A << /O /Layout /BBox "
+                             f"[{bbox.x0:g} {bbox.y0:g} {bbox.x1:g} {bbox.y1:g}] >>")
+                elements.append((block['role'], block_mcids[index], extra))
+            doc.update_stream(xrefs[0], content)
+            if len(xrefs) > 1:
+                page.set_contents(xrefs[0])
+            # Otra página con el mismo stream reutiliza sus marcas
+            self.marked[xrefs[0]] = elements
+        self._tag_marked(doc, page, elements)
+        return True
+    
+    def tag_figure(self, doc, page, rect, alt_text):
+        """No crea nada: un Figure sin su contenido marcado no describiría ninguna imagen.
+        
+        Las figuras se etiquetan en tag_layout, que marca el Do de cada imagen con su MCID
+        (tag_native_page le pasa un plan mínimo si no hay análisis de maquetación).
+        """
+    
+    def finish(self, doc):
+        """Escribe el elemento Document, el ParentTree y la raíz del árbol de estructura."""
+        if not self.enabled:
+            return
+        kids = "[" + " ".join(f"{xref} 0 R" for xref in self.children) + "]"
+        doc.update_object(self.document_xref, f"<< /Type /StructElem /S /Document "
+                                              f"/P {self.root_xref} 0 R /K {kids} >>")
+        
+        # ParentTree como árbol de números plano: clave /StructParents -> elementos por MCID
+        nums = " ".join(f"{key} [" + " ".join(f"{xref} 0 R" for xref in elements) + "]"
+                        for key, elements in enumerate(self.parent_tree))
+        parent_tree_xref = doc.get_new_xref()
+        doc.update_object(parent_tree_xref, f"<< /Nums [{nums}] >>")
+        
+        role_map = " ".join(f"/{role} /P" for role in sorted(self.roles - STANDARD_ROLES))
+        doc.update_object(self.root_xref, f"<< /Type /StructTreeRoot /K {self.document_xref} 0 R "
+                                          f"/ParentTree {parent_tree_xref} 0 R "
+                                          f"/ParentTreeNextKey {len(self.parent_tree)} "
+                                          f"/RoleMap << {role_map} >> >>")
+
+class MetadataOnlyTagger:
+    """Sin árbol de estructura: el documento solo recibe metadatos de accesibilidad."""
+    
+    name = "metadata"
+    enabled = True
+    
+    def begin(self, doc, language):
+        """No hace nada."""
+    
+    def tag_page(self, doc, page, blocks):
+        """No hace nada."""
+    
+    def commit_page(self, doc, page, marked):
+        """No hace nada."""
+    
+    def tag_content(self, doc, page, text):
+        """No hace nada."""
+    
+    def tag_layout(self, doc, page, blocks, images):
+        """No hace nada."""
+        return True
+    
+    def tag_figure(self, doc, page, rect, alt_text):
+        """No hace nada."""
+    
+    def finish(self, doc):
+        """No hace nada."""
+
+TAGGING_BACKENDS = {
+    "native": NativeStructureTagger,
+    "xref": XrefStructureTagger,
+    "metadata": MetadataOnlyTagger
+}
+
+@functools.lru_cache(maxsize=None)
+def resolve_tagging_backend(name="auto"):
+    """Elige una vez por proceso la clase de etiquetado a usar."""
+    methods = probe_capabilities()['methods']
+    native_available = {"init_doc_structure", "add_struct_element", "append_struct_element",
+                        "set_struct_alt", "is_tagged"} <= methods
+    if name == "auto":
+        name = "native" if native_available else "xref"
+    elif name == "native" and not native_available:
+        logging.warning("La versión de PyMuPDF no tiene la API de estructura. Usando el escritor de objetos.")
+        name = "xref"
+    logging.debug(f"Etiquetado estructural: {name}")
+    return TAGGING_BACKENDS[name]
+
+def begin_tagging(tagger_class, doc, language):
+    """Crea el etiquetador de un documento; si no puede inicializarse, solo quedan los metadatos."""
+    tagger = tagger_class()
+    try:
+        tagger.begin(doc, language)
+    except Exception as e:
+        logging.warning(f"No se pudo inicializar la estructura del documento: {str(e)}")
+        tagger = MetadataOnlyTagger()
+    return tagger
+
+def finish_tagging(tagger, doc):
+    """Completa el árbol de estructura sin interrumpir el guardado si falla."""
+    try:
+        tagger.finish(doc)
+    except Exception as e:
+        logging.warning(f"No se pudo completar la estructura del documento: {str(e)}")
+
+def text_to_blocks(page, text):
+    """Divide texto sin posiciones en párrafos repartidos en franjas iguales de la página."""
+    # Intentar identificar párrafos con diferentes patrones
+    if '\n\n' in text:
+        paragraphs = [p for p in text.split('\n\n') if p.strip()]
+    elif '\n' in text:
+        # Si no hay párrafos claros, usar líneas como párrafos
+        paragraphs = [p for p in text.split('\n') if p.strip()]
+    else:
+        # Si no hay separadores, tratar todo como un párrafo
+        paragraphs = [text] if text.strip() else []
+    
+    blocks = []
+    total_paragraphs = max(len(paragraphs), 1)
+    height = page.rect.height / total_paragraphs
+    for i, para in enumerate(paragraphs):
+        top = i * height
+        rect = fitz.Rect(0, top, page.rect.width, top + height)
+        blocks.append({'role': 'P', 'rect': rect, 'text': para, 'lines': [rect]})
+    return blocks
+
+def create_structure_tree(tagger, doc, page, text, blocks=None):
+    """Crea el árbol de estructura de una página con el etiquetador del documento.
+    
+    Con blocks (ver build_ocr_blocks), cada elemento se etiqueta con su rol y su caja
+    real; sin ellos, se etiqueta el contenido nativo de la página.
+    """
+    try:
+        if blocks is None:
+            tagger.tag_content(doc, page, text)
+        else:
+            tagger.tag_page(doc, page, [block for block in blocks if block['text'].strip()])
+        return True
+    except Exception as e:
+        logging.error(f"Error general creando estructura: {str(e)}")
+        return False
+
+def commit_structure(tagger, doc, page, marked):
+    """Completa la estructura de una página una vez escrita su capa de texto."""
+    try:
+        tagger.commit_page(doc, page, marked)
     except Exception as e:
-        logging.error(f"Error general creando estructura: {str(e)}")
-        return False
+        logging.error(f"Error completando la estructura de la página {page.number+1}: {str(e)}")
+
+# Perfiles de compresión: garbage/clean para el guardado, linealización, recompresión
+# de imágenes (solo archival) y finalización con flujos de objetos
+COMPRESSION_PROFILES = {
+    "fast": {'garbage': 1, 'clean': False, 'linear': False, 'rewrite_images': False, 'finalize': False},
+    "balanced": {'garbage': 4, 'clean': True, 'linear': True, 'rewrite_images': False, 'finalize': False},
+    "archival": {'garbage': 4, 'clean': True, 'linear': True, 'rewrite_images': True, 'finalize': True}
+}
+
+def image_stream_bytes(doc):
+    """Suma el tamaño comprimido de las imágenes usadas por las páginas (cada una una vez)."""
+    xrefs = {img[0] for page in doc for img in page.get_images(full=True)}
+    return sum(len(doc.xref_stream_raw(xref) or b"") for xref in xrefs)
 
-def optimize_pdf(doc, compress_level=1):
-    """Optimiza el PDF para reducir tamaño."""
+def recompress_images(doc, image_dpi=150, quality=75):
+    """Recomprime las imágenes del documento para el perfil archival.
+    
+    Las imágenes bitonales pasan a CCITT G4 y las de grises y color a JPEG, reduciendo
+    a image_dpi las que superan 1.5 veces esa resolución. Devuelve (segundos, bytes de
+    imagen antes, bytes de imagen después).
+    """
+    start = time.perf_counter()
+    before = image_stream_bytes(doc)
+    doc.rewrite_images(dpi_threshold=int(image_dpi * 1.5), dpi_target=image_dpi, quality=quality)
+    return time.perf_counter() - start, before, image_stream_bytes(doc)
+
+@functools.lru_cache(maxsize=None)
+def warn_no_linearization():
+    """Avisa una sola vez por proceso de que esta versión de MuPDF no linealiza al guardar."""
+    logging.info(f"PyMuPDF {probe_capabilities()['version']} no linealiza al guardar: se omite la "
+                 f"linealización (--qpdf-linearize la hace con QPDF, a costa de reescribir cada PDF)")
+
+def optimize_pdf(doc, compress_level=1, finalize=False, profile="balanced", image_dpi=150, stats=None):
+    """Optimiza el PDF para reducir tamaño según el perfil de compresión.
+    
+    fast solo comprime streams y elimina objetos sin referencias; balanced además
+    deduplica objetos (garbage=4, que también une imágenes idénticas), limpia el
+    contenido y linealiza si la versión de MuPDF lo soporta; archival añade la
+    recompresión de imágenes y la finalización. Con finalize, el propio guardado hace
+    la finalización que antes se delegaba en QPDF: flujos de objetos y compresión de
+    imágenes y fuentes. Si se pasa stats, se anotan en él los bytes de imagen antes y
+    después de recomprimirlas ('image_bytes').
+    """
     try:
-        # Eliminar objetos no utilizados si existe el método
-        if hasattr(doc, "garbage_collect"):
-            doc.garbage_collect()
+        capabilities = probe_capabilities()
+        settings = COMPRESSION_PROFILES[profile]
         
-        # Optimizar streams si existe el método
-        if hasattr(doc, "clean_contents"):
-            for page in doc:
-                try:
-                    page.clean_contents()
-                except:
-                    pass
+        # Recomprimir imágenes (CCITT para bitonales, JPEG a la resolución objetivo)
+        if settings['rewrite_images'] and capabilities['rewrite_images']:
+            try:
+                seconds, before, after = recompress_images(doc, image_dpi)
+                if stats is not None:
+                    stats['image_bytes'] = (before, after)
+                logging.info(f"Perfil {profile}: imágenes recomprimidas en {seconds*1000:.1f} ms, "
+                             f"{before - after} bytes ahorrados")
+            except Exception as e:
+                logging.warning(f"No se pudieron recomprimir las imágenes: {str(e)}")
         
         # Configuración de compresión
         params = {
-            "deflate": True,         # Comprimir streams
-            "garbage": 4,            # Máxima recolección de basura
-            "clean": True,           # Limpiar el documento
-            "linear": True,          # Optimización para web
-            "ascii": False           # Permitir binario para mejor compresión
+            "deflate": True,                   # Comprimir streams
+            "garbage": settings['garbage'],    # Recolección de basura (4 = deduplicar objetos)
+            "ascii": False                     # Permitir binario para mejor compresión
         }
+        if settings['clean']:
+            params["clean"] = True             # Limpiar el documento
         
-        # Ajustar nivel de compresión si la versión lo soporta
-        if compress_level > 0:
-            try:
-                # Verificamos si la versión soporta el parámetro 'compress'
-                import inspect
-                sig = inspect.signature(doc.save)
-                if 'compress' in sig.parameters:
-                    params["compress"] = compress_level
-            except:
-                pass
+        # Optimización para web si la versión todavía sabe linealizar
+        if settings['linear'] and capabilities['linear']:
+            params["linear"] = True
+        elif settings['linear']:
+            warn_no_linearization()
+        
+        # Ajustar nivel de compresión si la versión soporta el parámetro 'compress'
+        if compress_level > 0 and 'compress' in capabilities['save_params']:
+            params["compress"] = compress_level
+        
+        if finalize or settings['finalize']:
+            for key in ("use_objstms", "deflate_images", "deflate_fonts"):
+                if key in capabilities['save_params']:
+                    params[key] = True
+            # Esfuerzo de compresión por encima del valor por defecto solo en los niveles altos
+            if compress_level > 1 and 'compression_effort' in capabilities['save_params']:
+                params["compression_effort"] = 50 * (compress_level - 1)
         
         return params
     except Exception as e:
         logging.error(f"Error optimizando PDF: {str(e)}")
         return {}
 
-def process_scanned_pdf(input_path, output_path, config):
-    """Procesa un PDF escaneado para hacerlo accesible."""
+# Tipos de página según el clasificador
+PAGE_SCANNED = "scanned"  # Imagen sin texto: necesita OCR
+PAGE_DIGITAL = "digital"  # Texto nativo: se conserva
+PAGE_BLANK = "blank"      # Sin texto ni imágenes: no hay nada que reconocer
+
+def classify_page(page, min_coverage=0.5, min_sample_chars=20, min_content_bytes=2048):
+    """Clasifica una página con señales baratas, sin extraer todo su texto si no hace falta.
+    
+    Usa, en este orden, las fuentes de sus recursos, las imágenes, el tamaño de su
+    stream de contenido y, solo para páginas con fuentes e imágenes, una muestra de
+    texto de la franja central y la fracción de la página cubierta por imágenes.
+    """
+    fonts = page.get_fonts()
+    images = page.get_images()
+    if not fonts:
+        if images:
+            return PAGE_SCANNED
+        # Sin fuentes ni imágenes XObject: un contenido grande suele ser una imagen en línea
+        # o texto vectorizado, que también necesita OCR
+        doc = page.parent
+        content_bytes = sum(len(doc.xref_stream_raw(xref)) for xref in page.get_contents())
+        return PAGE_SCANNED if content_bytes >= min_content_bytes else PAGE_BLANK
+    if not images:
+        return PAGE_DIGITAL
+    
+    # Página con fuentes e imágenes: comprobar si hay texto real en la franja central
+    page_rect = page.rect
+    band = fitz.Rect(page_rect.x0, page_rect.y0 + page_rect.height * 0.25,
+                     page_rect.x1, page_rect.y0 + page_rect.height * 0.75)
+    if len(page.get_text("text", clip=band).strip()) >= min_sample_chars:
+        return PAGE_DIGITAL
+    
+    # Poco texto: es un escaneo si las imágenes cubren la mayor parte de la página
+    page_area = max(page_rect.width * page_rect.height, 1)
+    covered = 0.0
+    for info in page.get_image_info():
+        bbox = fitz.Rect(info['bbox']) & page_rect
+        if not bbox.is_empty:
+            covered += bbox.width * bbox.height
+    return PAGE_SCANNED if covered / page_area >= min_coverage else PAGE_DIGITAL
+
+def classify_document(doc):
+    """Clasifica todas las páginas de un documento."""
+    return [classify_page(page) for page in doc]
+
+def ocr_pages(input_path, page_numbers, config):
+    """Aplica OCR a una lista de páginas de un documento."""
+    results = {}
     try:
-        # Abrir el documento
         doc = fitz.open(input_path)
-        
-        # Establecer metadatos de accesibilidad
-        doc.set_metadata({
-            "title": os.path.basename(input_path).replace(".pdf", ""),
-            "subject": "Documento accesible",
-            "keywords": "accesibilidad, PDF, escaneado",
-            "creator": "Script de Accesibilidad para PDFs Escaneados",
-            "producer": "PyMuPDF con etiquetado estructural"
-        })
-        
-        # Establecer el idioma del documento y etiquetado
         try:
-            doc.set_xml_metadata(f"""<?xpacket begin="" id="W5M0MpCehiHzreSzNTczkc9d"?>
-            <x:xmpmeta xmlns:x="adobe:ns:meta/">
-            <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
-            <rdf:Description xmlns:dc="http://purl.org/dc/elements/1.1/" dc:language="{config['language']}"/>
-            <rdf:Description rdf:about="" xmlns:pdf="http://ns.adobe.com/pdf/1.3/">
-                <pdf:Tagged>true</pdf:Tagged>
-            </rdf:Description>
-            </rdf:RDF>
-            </x:xmpmeta>
-            <?xpacket end="w"?>""")
-        except Exception as e:
-            logging.warning(f"No se pudo establecer metadatos XML: {str(e)}")
-        
-        # Intento seguro de habilitar etiquetado del PDF
+            for page_num in page_numbers:
+                page = doc[page_num]
+                results[page_num] = apply_ocr_to_page(page, language=config['language'], dpi=config['dpi'],
+                                                     backend=config.get('ocr_backend', 'auto'),
+                                                     cache=get_ocr_cache(config),
+                                                     layer_dpi=ocr_layer_dpi(config),
+                                                     preprocess=config.get('preprocess', False),
+                                                     dpi_bounds=ocr_dpi_bounds(config))
+                page = None  # Liberar la página antes de pasar a la siguiente
+        finally:
+            doc.close()
+    except Exception as e:
+        # Las páginas sin resultado se ensamblarán sin capa de texto
+        logging.error(f"Error en OCR de {input_path} (páginas {page_numbers[0]+1}-{page_numbers[-1]+1}): {str(e)}")
+    return results
+
+# Índice de imágenes compartido por los workers de un lote
+IMAGE_INDEX_NAME = 'indice_imagenes.sqlite'
+
+# Texto alternativo genérico de las figuras (se completa con su número en la página)
+FIGURE_ALT_TEXT = "Imagen"
+
+class ImageIndex:
+    """Índice de imágenes de un lote direccionado por el hash de su stream.
+    
+    La clasificación (figura o decorativa) y el texto alternativo de cada imagen
+    distinta se calculan una sola vez y se reutilizan en el mismo documento y en el
+    resto de documentos del lote (p. ej. el logotipo de un membrete). Como OCRCache,
+    usa SQLite para compartirse entre workers y guarda además en memoria lo ya leído.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        self._conn = None
+        self._pid = None
+    
+    def _connect(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS images (key TEXT PRIMARY KEY, value TEXT)")
+            self._pid = os.getpid()
+        return self._conn
+    
+    def get(self, key):
+        """Devuelve la descripción guardada para la imagen, o None."""
+        info = self._entries.get(key)
+        if info is None:
+            row = self._connect().execute("SELECT value FROM images WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                info = self._entries[key] = json.loads(row[0])
+        return info
+    
+    def put(self, key, info):
+        """Guarda la descripción de una imagen."""
+        self._entries[key] = info
+        self._connect().execute("INSERT OR REPLACE INTO images (key, value) VALUES (?, ?)",
+                                (key, json.dumps(info, ensure_ascii=False)))
+
+# Índices de imágenes abiertos en este proceso
+_image_indexes = {}
+
+def get_image_index(config):
+    """Devuelve el índice de imágenes del lote para este proceso, o None si no hay."""
+    path = config.get('image_index')
+    if not path:
+        return None
+    index = _image_indexes.get(path)
+    if index is None:
+        index = _image_indexes[path] = ImageIndex(path)
+    return index
+
+def analyse_image(width, height):
+    """Clasifica una imagen por su tamaño y le asigna un texto alternativo genérico.
+    
+    Las imágenes muy pequeñas o muy alargadas (filetes, iconos, separadores) se
+    consideran decorativas y no se etiquetan como figura.
+    """
+    if min(width, height) < 24 or max(width, height) > 10 * max(min(width, height), 1):
+        return {'kind': 'artifact', 'alt': ""}
+    return {'kind': 'figure', 'alt': FIGURE_ALT_TEXT}
+
+def describe_image(doc, img, config, seen):
+    """Devuelve {'kind', 'alt'} de una imagen, calculándolo una vez por imagen distinta.
+    
+    seen guarda lo resuelto por xref dentro del documento; el índice del lote, lo
+    resuelto por hash del stream entre documentos.
+    """
+    xref, width, height = img[0], img[2], img[3]
+    info = seen.get(xref)
+    if info is not None:
+        return info
+    
+    index = get_image_index(config)
+    key = None
+    if index is not None:
+        key = hashlib.sha256(doc.xref_stream_raw(xref) + f"|{width}x{height}".encode('utf-8')).hexdigest()
+        info = index.get(key)
+    if info is None:
+        info = analyse_image(width, height)
+        if index is not None:
+            index.put(key, info)
+    seen[xref] = info
+    return info
+
+def image_placements(page):
+    """Devuelve {xref: [rectángulos]} con cada aparición visible de las imágenes de la página.
+    
+    Un único recorrido del contenido de la página (get_image_info) sustituye la búsqueda
+    por imagen; las imágenes en línea (sin xref) no se incluyen.
+    """
+    placements = {}
+    for info in page.get_image_info(xrefs=True):
+        rect = fitz.Rect(info['bbox']) & page.rect
+        if info['xref'] and not rect.is_empty:
+            placements.setdefault(info['xref'], []).append(rect)
+    return placements
+
+def image_alt_text(doc, img, img_index, config, seen):
+    """Texto alternativo de una imagen de la página, o None si es decorativa."""
+    # Clasificación y texto alternativo resueltos una vez por imagen distinta
+    info = describe_image(doc, img, config or {}, {} if seen is None else seen)
+    if info['kind'] == 'artifact':
+        return None
+    return f"{info['alt']} {img_index+1}"
+
+def simple_page_plan(doc, page, config=None, seen=None):
+    """Plan mínimo de una página nativa cuando no hay análisis de maquetación.
+    
+    Un único párrafo con todo el texto de la página y una figura por cada aparición
+    de sus imágenes no decorativas, con el formato de plan_page_layout.
+    """
+    text = page.get_text()
+    plan = [{'role': 'P', 'rect': page.rect, 'text': text, 'lines': [page.rect]}] if text.strip() else []
+    placements = None
+    for img_index, img in enumerate(page.get_images(full=True)):
+        if image_alt_text(doc, img, img_index, config, seen) is None:
+            continue
+        if placements is None:
+            placements = image_placements(page)
+        plan.extend({'role': 'Figure', 'rect': rect, 'text': "", 'lines': [rect], 'xref': img[0]}
+                    for rect in placements.get(img[0], []))
+    return plan
+
+def tag_native_page(tagger, doc, page, page_num, config=None, seen=None, plan=None):
+    """Etiqueta una página con texto nativo: párrafos de su texto y figuras de sus imágenes.
+    
+    Con plan (bloques de plan_native_layout), el etiquetador marca el contenido según
+    los bloques, sus roles y su orden de lectura; si no puede, se etiqueta el texto
+    plano de la página como antes.
+    """
+    if plan is None and tagger.name == "xref":
+        # El etiquetador xref solo etiqueta una figura marcando el Do de su imagen:
+        # sin análisis de maquetación, se marca con un plan mínimo
+        plan = simple_page_plan(doc, page, config, seen)
+    if plan is not None and tagger.name != "metadata":
         try:
-            if hasattr(doc, "init_doc_structure"):
-                doc.init_doc_structure()
+            images = {img[7]: (img[0], image_alt_text(doc, img, img_index, config, seen))
+                      for img_index, img in enumerate(page.get_images(full=True))}
+            if tagger.tag_layout(doc, page, plan, images):
+                logging.info(f"Estructura etiquetada creada para la página {page_num+1} "
+                             f"según su maquetación ({len(plan)} bloques)")
+                return
+            logging.debug(f"Página {page_num+1}: contenido no marcable por bloques, se etiqueta entera")
         except Exception as e:
-            logging.warning(f"No se pudo inicializar la estructura del documento: {str(e)}")
-        
-        # Determinar si el PDF parece ser escaneado
-        is_scanned = True
-        text_length = 0
+            logging.warning(f"No se pudo etiquetar la maquetación de la página {page_num+1}: {str(e)}")
+    
+    # Extraer el texto existente
+    text = page.get_text()
+    
+    # Intentar crear estructura etiquetada para la página original
+    if text.strip():
+        success = create_structure_tree(tagger, doc, page, text)
+        if success:
+            logging.info(f"Estructura etiquetada creada para la página {page_num+1}")
+    
+    # Sin árbol de estructura no hay figuras que etiquetar
+    if tagger.name == "metadata":
+        return
+    
+    # Etiquetar imágenes con texto alternativo
+    try:
+        image_list = page.get_images(full=True)
+        placements = None
         
+        for img_index, img in enumerate(image_list):
+            alt_text = image_alt_text(doc, img, img_index, config, seen)
+            if alt_text is None:
+                continue
+            # Añadir imagen como figura etiquetada
+            try:
+                # Posiciones de todas las imágenes, calculadas en una sola pasada y solo
+                # si la página tiene alguna figura
+                if placements is None:
+                    placements = image_placements(page)
+                
+                # Añadir como figura etiquetada cada aparición de la imagen
+                for img_rect in placements.get(img[0], []):
+                    tagger.tag_figure(doc, page, img_rect, alt_text)
+                    logging.debug(f"Imagen {img_index+1} etiquetada en página {page_num+1}")
+            except Exception as e:
+                logging.warning(f"No se pudo etiquetar imagen: {str(e)}")
+    except Exception as e:
+        logging.warning(f"Error al procesar imágenes: {str(e)}")
+
+# Entradas de un árbol de números (/Nums): clave seguida de una referencia, un array o null
+NUMS_ENTRY = re.compile(rb"(\d+)\s*(\d+\s+\d+\s+R|\[[^\]]*\]|null)")
+MCID_TOKEN = re.compile(rb"/MCID\s+(\d+)")
+
+def verify_document(doc):
+    """Comprobación rápida del documento en memoria antes de guardarlo.
+    
+    Solo lee el catálogo: devuelve (etiquetado, tiene árbol de estructura).
+    """
+    catalog = doc.pdf_catalog()
+    if "is_tagged" in probe_capabilities()['methods']:
+        is_tagged = bool(doc.is_tagged)
+    else:
+        is_tagged = "true" in doc.xref_get_key(catalog, "MarkInfo/Marked")[1]
+    has_structure = doc.xref_get_key(catalog, "StructTreeRoot")[0] != "null"
+    return is_tagged, has_structure
+
+def parent_tree_entries(doc, node_xref, depth=0):
+    """Devuelve {clave: [xref o None por MCID]} de un ParentTree, recorriendo sus /Kids."""
+    entries = {}
+    kind, kids = doc.xref_get_key(node_xref, "Kids")
+    if kind == "array" and depth < 32:
+        for kid in re.findall(r"(\d+)\s+\d+\s+R", kids):
+            entries.update(parent_tree_entries(doc, int(kid), depth + 1))
+    kind, nums = doc.xref_get_key(node_xref, "Nums")
+    if kind != "array":
+        return entries
+    for key, value in NUMS_ENTRY.findall(nums.encode('latin-1', 'replace')):
+        if value.endswith(b"R"):
+            # La entrada de una página suele ser un array indirecto
+            target = doc.xref_object(int(value.split()[0]), compressed=True)
+            if target.startswith("["):
+                value = target.encode('latin-1', 'replace')
+        if value.startswith(b"["):
+            refs = re.findall(rb"(\d+\s+\d+\s+R|null)", value)
+            entries[int(key)] = [int(ref.split()[0]) if ref != b"null" else None for ref in refs]
+        elif value != b"null":
+            entries[int(key)] = [int(value.split()[0])]
+    return entries
+
+def structure_checks(doc, page_mcids=None):
+    """Comprobaciones estructurales de un documento etiquetado, agrupadas por comprobación.
+    
+    Devuelve {'tagged': /MarkInfo y StructTreeRoot, 'language': /Lang, 'parent_tree':
+    coherencia del ParentTree con los MCID del contenido de cada página, 'figure_alt':
+    figuras sin texto alternativo} con la lista de problemas de cada una. page_mcids es
+    la lista de MCID usados por cada página, si quien llama ya recorrió su contenido.
+    La usan validate_structure y verificador_pdfua.
+    """
+    problems = {'tagged': [], 'language': [], 'parent_tree': [], 'figure_alt': []}
+    catalog = doc.pdf_catalog()
+    if "true" not in doc.xref_get_key(catalog, "MarkInfo/Marked")[1]:
+        problems['tagged'].append("Falta /MarkInfo << /Marked true >>")
+    kind, lang = doc.xref_get_key(catalog, "Lang")
+    if kind == "null" or not lang.strip("()<> "):
+        problems['language'].append("Falta el idioma del documento (/Lang)")
+    
+    kind, root = doc.xref_get_key(catalog, "StructTreeRoot")
+    if kind != "xref":
+        problems['tagged'].append("Falta StructTreeRoot")
+    else:
+        # ParentTree: cada página con /StructParents debe tener su entrada, con un
+        # elemento para cada MCID usado en su contenido
+        root_xref = int(root.split()[0])
+        kind, parent_tree = doc.xref_get_key(root_xref, "ParentTree")
+        entries = parent_tree_entries(doc, int(parent_tree.split()[0])) if kind == "xref" else {}
+        if kind != "xref":
+            problems['parent_tree'].append("StructTreeRoot sin ParentTree")
+        next_key = doc.xref_get_key(root_xref, "ParentTreeNextKey")[1]
+        if entries and next_key.isdigit() and int(next_key) <= max(entries):
+            problems['parent_tree'].append(f"ParentTreeNextKey {next_key} no supera la clave máxima {max(entries)}")
         for page in doc:
-            page_text = page.get_text().strip()
-            text_length += len(page_text)
-            if len(page_text) > 50:  # Si hay texto sustancial, no es solo escaneado
-                is_scanned = False
-                break
+            if page_mcids is None:
+                mcids = {int(mcid) for mcid in MCID_TOKEN.findall(page.read_contents())}
+            else:
+                mcids = page_mcids[page.number]
+            key = doc.xref_get_key(page.xref, "StructParents")[1]
+            if not key.isdigit():
+                if mcids:
+                    problems['parent_tree'].append(f"Página {page.number+1}: contenido marcado sin /StructParents")
+                continue
+            elements = entries.get(int(key))
+            if elements is None:
+                problems['parent_tree'].append(f"Página {page.number+1}: /StructParents {key} "
+                                               f"sin entrada en el ParentTree")
+                continue
+            missing = sorted(mcid for mcid in mcids if mcid >= len(elements) or elements[mcid] is None)
+            if missing:
+                problems['parent_tree'].append(f"Página {page.number+1}: MCID sin elemento en el ParentTree: "
+                                               f"{missing[:10]}")
+    
+    # Figuras sin texto alternativo (ni texto de sustitución)
+    for xref in range(1, doc.xref_length()):
+        if doc.xref_get_key(xref, "S")[1] != "/Figure":
+            continue
+        if doc.xref_get_key(xref, "Type")[1] not in ("/StructElem", "null"):
+            continue
+        kind, alt = doc.xref_get_key(xref, "Alt")
+        if kind == "null" or not alt.strip("()<> "):
+            kind, actual = doc.xref_get_key(xref, "ActualText")
+            if kind == "null" or not actual.strip("()<> "):
+                problems['figure_alt'].append(f"Figura {xref} sin texto alternativo")
+    return problems
+
+def validate_structure(doc):
+    """Validación estructural completa de un documento etiquetado.
+    
+    Comprueba /MarkInfo, /Lang, StructTreeRoot, la coherencia del ParentTree con los
+    MCID del contenido de cada página y el texto alternativo de las figuras
+    (structure_checks). Devuelve la lista de problemas encontrados (vacía si el
+    documento es correcto).
+    """
+    return [problem for problems in structure_checks(doc).values() for problem in problems]
+
+def check_before_save(doc, input_path, config, metrics):
+    """Verifica el documento en memoria justo antes de guardarlo.
+    
+    La comprobación rápida lee el catálogo; con config['validate'] se añade la
+    validación estructural completa, cuyo resultado queda en metrics.validation.
+    """
+    try:
+        with metrics.span("verify"):
+            is_tagged, has_structure = verify_document(doc)
+            logging.info(f"Verificación del documento generado: Etiquetado={is_tagged}, "
+                         f"Estructura={'Disponible' if has_structure else 'No disponible'}")
+            if config.get('validate'):
+                problems = validate_structure(doc)
+                metrics.validation = {'valid': not problems, 'problems': problems}
+                metrics.count("validation_problems", len(problems))
+                for problem in problems:
+                    logging.warning(f"Validación de {input_path}: {problem}")
+    except Exception as e:
+        logging.warning(f"Error en verificación post-procesamiento: {str(e)}")
+
+def set_accessibility_metadata(doc, input_path, language):
+    """Escribe en el documento de salida el título, los metadatos XMP y /DisplayDocTitle."""
+    # Establecer metadatos de accesibilidad
+    doc.set_metadata({
+        "title": os.path.basename(input_path).replace(".pdf", ""),
+        "subject": "Documento accesible",
+        "keywords": "accesibilidad, PDF, escaneado",
+        "creator": "Script de Accesibilidad para PDFs Escaneados",
+        "producer": "PyMuPDF con etiquetado estructural"
+    })
+    
+    # Establecer el idioma del documento y etiquetado
+    try:
+        doc.set_xml_metadata(f"""<?xpacket begin="" id="W5M0MpCehiHzreSzNTczkc9d"?>
+        <x:xmpmeta xmlns:x="adobe:ns:meta/">
+        <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+        <rdf:Description xmlns:dc="http://purl.org/dc/elements/1.1/" dc:language="{language}"/>
+        <rdf:Description rdf:about="" xmlns:pdf="http://ns.adobe.com/pdf/1.3/">
+            <pdf:Tagged>true</pdf:Tagged>
+        </rdf:Description>
+        </rdf:RDF>
+        </x:xmpmeta>
+        <?xpacket end="w"?>""")
+    except Exception as e:
+        logging.warning(f"No se pudo establecer metadatos XML: {str(e)}")
+    
+    # Que el visor muestre el título del documento y no el nombre del archivo
+    try:
+        catalog = doc.pdf_catalog()
+        kind, preferences = doc.xref_get_key(catalog, "ViewerPreferences")
+        if kind == "xref":
+            # Con un diccionario indirecto la clave se escribe en su propio objeto
+            doc.xref_set_key(int(preferences.split()[0]), "DisplayDocTitle", "true")
+        else:
+            doc.xref_set_key(catalog, "ViewerPreferences/DisplayDocTitle", "true")
+    except Exception as e:
+        logging.warning(f"No se pudo establecer DisplayDocTitle: {str(e)}")
+
+def plan_document_layout(doc, page_kinds, tagger, config, metrics):
+    """Plan de maquetación de las páginas con texto nativo, si el etiquetador va a usarlo."""
+    if not config.get('layout_analysis', True) or tagger.name == "metadata" or not tagger.enabled:
+        return {}
+    try:
+        with metrics.span("layout"):
+            plans = plan_native_layout(doc, [n for n, kind in enumerate(page_kinds) if kind == PAGE_DIGITAL])
+        metrics.count("layout_blocks", sum(len(blocks) for blocks in plans.values()))
+        return plans
+    except Exception as e:
+        logging.warning(f"No se pudo analizar la maquetación de las páginas nativas: {str(e)}")
+        return {}
+
+def process_scanned_pdf(input_path, output_path, config, ocr_results=None, page_kinds=None, metrics=None):
+    """Procesa un PDF escaneado para hacerlo accesible.
+
+    Las páginas escaneadas reciben OCR y las que ya tienen texto conservan el nativo.
+    Si se proporcionan page_kinds (clasificación por página) y ocr_results ({número de
+    página: resultado OCR}), se reutilizan en lugar de volver a clasificar y aplicar OCR.
+    Los tiempos por etapa y los contadores se registran en metrics (DocumentMetrics).
+    """
+    if metrics is None:
+        metrics = DocumentMetrics(os.path.basename(input_path))
+    try:
+        # Abrir el documento
+        with metrics.span("open"):
+            doc = fitz.open(input_path)
+        
+        set_accessibility_metadata(doc, input_path, config['language'])
+        
+        profile = config.get('profile', 'balanced')
+        compress_stats = {}
+        
+        # Etiquetador estructural elegido una vez por proceso; una instancia por documento
+        tagger_class = resolve_tagging_backend(config.get('tagging_backend', 'auto'))
+        seen_images = {}
         
-        logging.debug(f"Documento '{input_path}': es_escaneado={is_scanned}, longitud_texto={text_length}")
+        # Clasificar cada página: solo las escaneadas pasan por OCR
+        if page_kinds is None:
+            with metrics.span("classify"):
+                page_kinds = classify_document(doc)
+        scanned_pages = [n for n, kind in enumerate(page_kinds) if kind == PAGE_SCANNED]
+        metrics.count("pages", len(doc))
+        metrics.count("pages_ocr", len(scanned_pages))
         
-        if is_scanned:
-            logging.info(f"El documento '{input_path}' parece ser un PDF escaneado. Aplicando OCR.")
+        logging.debug(f"Documento '{input_path}': páginas escaneadas={len(scanned_pages)} de {len(doc)}")
+        
+        if scanned_pages:
+            if len(scanned_pages) == len(doc):
+                logging.info(f"El documento '{input_path}' parece ser un PDF escaneado. Aplicando OCR.")
+            else:
+                logging.info(f"El documento '{input_path}' es mixto. Aplicando OCR a {len(scanned_pages)} "
+                             f"de {len(doc)} páginas y conservando el texto nativo en el resto.")
             
-            # Crear un nuevo documento para el resultado
-            new_doc = fitz.open()
+            # Crear un nuevo documento para el resultado, volcándolo por tramos si se pide
+            writer = StreamingPDFWriter(output_path, config.get('stream_pages', 0))
+            set_accessibility_metadata(writer.doc, input_path, config['language'])
+            image_layer = config.get('image_layer', 'original')
+            layer_bytes = 0
+            layer_seconds = 0.0
+            # Coste del modo legacy por punto² de página: se mide en la primera página
+            # escaneada y se extrapola al resto por su área
+            legacy_rate = None
+            legacy_bytes = 0
+            legacy_seconds = 0.0
+            layer_pages = 0
+            tagger = begin_tagging(tagger_class, writer.doc, config['language'])
+            plans = plan_document_layout(doc, page_kinds, tagger, config, metrics)
             
             # Procesar cada página
             for page_num in range(len(doc)):
+                new_doc = writer.doc
                 page = doc[page_num]
                 
-                # Aplicar OCR
-                text = apply_ocr_to_page(page, language=config['language'], dpi=config['dpi'])
+                if page_kinds[page_num] != PAGE_SCANNED:
+                    # Página con texto nativo (o en blanco): copiarla y etiquetar su contenido
+                    new_doc.insert_pdf(doc, from_page=page_num, to_page=page_num)
+                    with metrics.span("tagging", page_num):
+                        tag_native_page(tagger, new_doc, new_doc[-1], page_num, config, seen_images,
+                                        plans.pop(page_num, None))
+                    page = None
+                    writer.page_done()
+                    continue
                 
-                # Crear nueva página con la imagen original
-                pix = page.get_pixmap()
-                new_page = new_doc.new_page(width=page.rect.width, height=page.rect.height)
-                new_page.insert_image(page.rect, pixmap=pix)
+                # Aplicar OCR (o reutilizar el resultado calculado por otro worker)
+                if ocr_results is not None:
+                    # Retirar el resultado del diccionario para no retenerlo tras usarlo
+                    ocr = ocr_results.pop(page_num, None) or {'text': "", 'words': PageLayout()}
+                else:
+                    ocr = apply_ocr_to_page(page, language=config['language'], dpi=config['dpi'],
+                                            backend=config.get('ocr_backend', 'auto'),
+                                            cache=get_ocr_cache(config),
+                                            layer_dpi=ocr_layer_dpi(config),
+                                            preprocess=config.get('preprocess', False),
+                                            dpi_bounds=ocr_dpi_bounds(config))
+                text = ocr['text']
+                timings = ocr.pop('timings', None)
+                if timings:
+                    metrics.add_span("render", timings['render'], page_num)
+                    metrics.add_span("ocr", timings['ocr'], page_num)
+                    metrics.count("ocr_cache_hits" if timings['cache_hit'] else "ocr_cache_misses")
+                    if timings['direct']:
+                        metrics.count("ocr_native_images")
+                    if 'preprocess' in timings:
+                        metrics.add_span("preprocess", timings['preprocess'], page_num)
+                        metrics.count("ocr_saved_ms", round(timings['ocr_saved'] * 1000))
+                metrics.count("ocr_chars", len(text))
                 
-                # Añadir capa de texto invisible encima
-                if text:
-                    # Método seguro para añadir texto
-                    try:
-                        text_rect = fitz.Rect(0, 0, page.rect.width, page.rect.height)
-                        new_page.insert_textbox(text_rect, text, fontname="helv", fontsize=12, color=(0,0,0,0))  # Color transparente
-                    except AttributeError:
-                        # Alternativa para versiones antiguas
-                        text_rect = fitz.Rect(0, 0, page.rect.width, page.rect.height)
-                        new_page.insert_text(text_rect.tl, text, fontname="helv", fontsize=12, color=(0,0,0,0))
-                    
-                    # Asegurar que el texto se ha insertado antes de crear la estructura
-                    if hasattr(new_doc, "reload_page"):
-                        new_doc.reload_page(new_page)
+                # Crear la página visible sin volver a renderizar la página de origen
+                layer_start = time.perf_counter()
+                new_page, image_bytes = add_image_layer(new_doc, doc, page_num, image_layer,
+                                                        ocr.pop('layer', None), config.get('layer_dpi', 150))
+                layer_time = time.perf_counter() - layer_start
+                metrics.add_span("image_layer", layer_time, page_num)
+                area = page.rect.width * page.rect.height
+                if image_layer == "legacy":
+                    page_legacy_bytes, page_legacy_time = image_bytes, layer_time
+                else:
+                    if legacy_rate is None:
+                        size, seconds = legacy_layer_cost(page)
+                        legacy_rate = (size / max(area, 1), seconds / max(area, 1))
+                    page_legacy_bytes, page_legacy_time = legacy_rate[0] * area, legacy_rate[1] * area
+                layer_bytes += image_bytes
+                layer_seconds += layer_time
+                legacy_bytes += page_legacy_bytes
+                legacy_seconds += page_legacy_time
+                layer_pages += 1
+                logging.debug(f"Capa de imagen página {page_num+1}: modo={image_layer}, "
+                              f"bytes={image_bytes}, tiempo={layer_time*1000:.1f} ms; frente a legacy "
+                              f"{page_legacy_bytes - image_bytes:.0f} bytes y "
+                              f"{(page_legacy_time - layer_time)*1000:.1f} ms ahorrados")
+                
+                # Añadir capa de texto invisible alineada con las palabras reconocidas
+                if ocr['words']:
+                    blocks = build_ocr_blocks(ocr['words'])
                     
-                    # Intentar crear estructura etiquetada para la accesibilidad
-                    success = create_structure_tree(new_doc, new_page, text)
+                    # Crear la estructura etiquetada a partir de las cajas reales de los bloques;
+                    # el etiquetador asigna los MCID con los que se marca la capa de texto
+                    with metrics.span("tagging", page_num):
+                        success = create_structure_tree(tagger, new_doc, new_page, text, blocks)
                     if success:
                         logging.info(f"Estructura etiquetada creada para la página {page_num+1}")
+                    with metrics.span("text_insert", page_num):
+                        marked = insert_ocr_text_layer(new_page, ocr['words'], blocks)
+                    with metrics.span("tagging", page_num):
+                        commit_structure(tagger, new_doc, new_page, marked)
                     
                     logging.info(f"Texto OCR añadido a la página {page_num+1}")
+                
+                # Liberar la página antes de un posible volcado a disco
+                new_page = page = ocr = None
+                writer.page_done()
+            
+            logging.info(f"Capa de imagen ({image_layer}) de '{input_path}': {layer_bytes} bytes de imagen, "
+                         f"{layer_seconds*1000:.1f} ms en {layer_pages} páginas; frente a legacy (estimado) "
+                         f"{legacy_bytes - layer_bytes:.0f} bytes y {(legacy_seconds - layer_seconds)*1000:.1f} ms "
+                         f"ahorrados")
+            
+            with metrics.span("tagging"):
+                finish_tagging(tagger, writer.doc)
             
             # Optimización del PDF
-            save_params = optimize_pdf(new_doc, config['compress_level'])
+            compress_start = time.perf_counter()
+            with metrics.span("optimize"):
+                save_params = optimize_pdf(writer.doc, config['compress_level'], config.get('finalize', False),
+                                           profile, config.get('image_dpi', 150), compress_stats)
+            compress_seconds = time.perf_counter() - compress_start
+            
+            check_before_save(writer.doc, input_path, config, metrics)
             
             # Guardar el nuevo documento
-            new_doc.save(output_path, **save_params)
-            new_doc.close()
+            compress_start = time.perf_counter()
+            with metrics.span("save"):
+                writer.finish(save_params)
+            compress_seconds += time.perf_counter() - compress_start
         else:
             # Si no es escaneado, añadir etiquetas estructurales al documento original
             logging.info(f"El documento '{input_path}' parece tener texto. Añadiendo etiquetas estructurales.")
             
-            # Intentar inicializar estructura etiquetada de forma segura
-            try:
-                if hasattr(doc, "is_tagged") and not doc.is_tagged and hasattr(doc, "init_doc_structure"):
-                    doc.init_doc_structure()
-            except Exception as e:
-                logging.warning(f"No se pudo inicializar la estructura: {str(e)}")
+            # Inicializar la estructura etiquetada de forma segura
+            tagger = begin_tagging(tagger_class, doc, config['language'])
+            plans = plan_document_layout(doc, page_kinds, tagger, config, metrics)
             
             # Procesar cada página del documento original
             for page_num in range(len(doc)):
-                page = doc[page_num]
-                
-                # Extraer el texto existente
-                text = page.get_text()
-                
-                # Intentar crear estructura etiquetada para la página original
-                if text.strip():
-                    success = create_structure_tree(doc, page, text)
-                    if success:
-                        logging.info(f"Estructura etiquetada creada para la página {page_num+1}")
-                
-                # Etiquetar imágenes con texto alternativo
-                try:
-                    image_list = page.get_images(full=True)
-                    
-                    for img_index, img in enumerate(image_list):
-                        alt_text = f"Imagen {img_index+1}"
-                        # Añadir imagen como figura etiquetada
-                        try:
-                            if hasattr(doc, "add_struct_element") and hasattr(doc, "set_struct_alt"):
-                                # Obtener coordenadas de la imagen
-                                xref = img[0]  # xref del objeto imagen
-                                img_rect = None
-                                
-                                # Buscar la imagen en el contenido de la página
-                                for item in page.get_drawings():
-                                    if item.get("type") == "image" and item.get("xref") == xref:
-                                        img_rect = item.get("rect")
-                                        break
-                                
-                                if img_rect:
-                                    # Añadir como figura etiquetada
-                                    fig_node = doc.add_struct_element("Figure", parent=-1, page=page)
-                                    doc.set_struct_alt(fig_node, alt_text)
-                                    doc.append_struct_element(fig_node, 0, img_rect, "")
-                                    logging.debug(f"Imagen {img_index+1} etiquetada en página {page_num+1}")
-                        except Exception as e:
-                            logging.warning(f"No se pudo etiquetar imagen: {str(e)}")
-                except Exception as e:
-                    logging.warning(f"Error al procesar imágenes: {str(e)}")
+                with metrics.span("tagging", page_num):
+                    tag_native_page(tagger, doc, doc[page_num], page_num, config, seen_images,
+                                    plans.pop(page_num, None))
+            
+            with metrics.span("tagging"):
+                finish_tagging(tagger, doc)
             
             # Optimización del PDF original
-            save_params = optimize_pdf(doc, config['compress_level'])
+            compress_start = time.perf_counter()
+            with metrics.span("optimize"):
+                save_params = optimize_pdf(doc, config['compress_level'], config.get('finalize', False),
+                                           profile, config.get('image_dpi', 150), compress_stats)
+            compress_seconds = time.perf_counter() - compress_start
+            
+            check_before_save(doc, input_path, config, metrics)
             
             # Guardar el documento original con optimización
-            doc.save(output_path, **save_params)
+            compress_start = time.perf_counter()
+            with metrics.span("save"):
+                doc.save(output_path, **save_params)
+            compress_seconds += time.perf_counter() - compress_start
         
         doc.close()
-        logging.info(f"Procesado completado: {input_path} -> {output_path}")
         
-        # Verificación post-procesamiento
-        try:
-            # Abrir el documento generado para verificar etiquetado
-            check_doc = fitz.open(output_path)
-            is_tagged = False
-            
-            if hasattr(check_doc, "is_tagged"):
-                is_tagged = check_doc.is_tagged
-            
-            # Intentar obtener información sobre el árbol de estructura
-            struct_info = "No disponible"
-            try:
-                if hasattr(check_doc, "get_struct_tree_root"):
-                    root_info = check_doc.get_struct_tree_root()
-                    struct_info = "Disponible" if root_info else "No disponible"
-            except:
-                pass
-            
-            logging.info(f"Verificación del documento generado: Etiquetado={is_tagged}, Estructura={struct_info}")
-            check_doc.close()
-        except Exception as e:
-            logging.warning(f"Error en verificación post-procesamiento: {str(e)}")
+        # Linealizar con QPDF solo a petición y si el guardado no lo ha hecho: reescribe
+        # el archivo entero, dentro del mismo worker
+        if config.get('qpdf_linearize') and not save_params.get('linear') and qpdf_available():
+            with metrics.span("linearize"):
+                post_process_pdf(output_path)
+        
+        metrics.count("bytes_in", os.path.getsize(input_path))
+        metrics.count("bytes_out", os.path.getsize(output_path))
+        
+        # Coste y ahorro del perfil de compresión, para elegir perfil según la cola: solo
+        # la optimización y el guardado, y los bytes de imagen que ha ahorrado el perfil
+        if 'image_bytes' in compress_stats:
+            before, after = compress_stats['image_bytes']
+            savings = f"imágenes {before} -> {after} bytes ({before - after} ahorrados)"
+        else:
+            savings = "sin recompresión de imágenes"
+        logging.info(f"Compresión ({profile}) de '{input_path}': {compress_seconds*1000:.1f} ms "
+                     f"optimizando y guardando, {savings}")
+        
+        logging.info(f"Procesado completado: {input_path} -> {output_path}")
         
         return True
     
@@ -433,11 +2750,417 @@ def process_scanned_pdf(input_path, output_path, config):
 
 def process_single_pdf(args):
     """Función para procesar un solo PDF (usada para paralelización)."""
-    input_path, output_path, config = args
-    return process_scanned_pdf(input_path, output_path, config), input_path
+    input_path, output_path, config = args[:3]
+    ocr_results = args[3] if len(args) > 3 else None
+    page_kinds = args[4] if len(args) > 4 else None
+    metrics = DocumentMetrics(os.path.basename(input_path))
+    result = process_scanned_pdf(input_path, output_path, config, ocr_results, page_kinds, metrics)
+    return result, input_path, metrics.to_dict()
+
+def plan_document(input_path, output_path, config):
+    """Divide un documento en tareas (documento, rango de páginas) para el planificador."""
+    job = {
+        'input_path': input_path,
+        'output_path': output_path,
+        'pages': 0,
+        'chunks': [],
+        'page_kinds': None,
+        'ocr_results': {},
+        'pending': 0,
+        'classify_seconds': None
+    }
+    try:
+        start = time.perf_counter()
+        doc = fitz.open(input_path)
+        try:
+            job['pages'] = len(doc)
+            job['page_kinds'] = classify_document(doc)
+        finally:
+            doc.close()
+        job['classify_seconds'] = time.perf_counter() - start
+    except Exception as e:
+        # El documento se procesará entero y el error quedará registrado allí
+        logging.warning(f"No se pudo planificar {input_path}: {str(e)}")
+        return job
+    
+    # Solo las páginas escaneadas generan tareas de OCR
+    scanned_pages = [n for n, kind in enumerate(job['page_kinds']) if kind == PAGE_SCANNED]
+    pages_per_task = max(1, config.get('pages_per_task', 8))
+    for first in range(0, len(scanned_pages), pages_per_task):
+        job['chunks'].append(scanned_pages[first:first + pages_per_task])
+    job['pending'] = len(job['chunks'])
+    
+    return job
+
+def warm_up_ocr_worker(config):
+    """Carga el modelo de idioma en el proceso actual para no pagarlo en cada página."""
+    backend = resolve_ocr_backend(config.get('ocr_backend', 'auto'))
+    if backend == "tesserocr":
+        get_tesserocr_api(config['language'])
+
+def _ocr_worker_main(conn, config):
+    """Bucle de un worker OCR persistente: atiende trabajos hasta recibir None."""
+    try:
+        warm_up_ocr_worker(config)
+    except Exception as e:
+        logging.warning(f"No se pudo precargar el modelo OCR: {str(e)}")
+    
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        if message == "ping":
+            conn.send(("pong", True, None))
+            continue
+        
+        job_id, func, args = message
+        try:
+            conn.send((job_id, True, func(*args)))
+        except Exception as e:
+            conn.send((job_id, False, RuntimeError(f"{type(e).__name__}: {str(e)}")))
+
+def process_rss(pid):
+    """Memoria residente de un proceso en bytes (0 si no se puede medir)."""
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.Error:
+            return 0
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+class _OCRWorker:
+    """Estado de un worker del pool visto desde el proceso principal."""
+    
+    def __init__(self, context, config):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_ocr_worker_main, args=(child_conn, config), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.job = None            # (job_id, future, pages)
+        self.deadline = None       # Límite de tiempo del trabajo en curso
+        self.ping_deadline = None  # Límite para responder al chequeo de salud
+        self.pages = 0             # Páginas procesadas desde el último arranque
+    
+    def stop(self, timeout=5):
+        """Detiene el worker, de forma ordenada si es posible."""
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+    
+    def kill(self):
+        """Mata el worker sin esperar (trabajo colgado o worker que no responde)."""
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+class OCRWorkerPool(Executor):
+    """Pool de workers OCR de larga duración con el modelo de idioma ya cargado.
+    
+    Cada worker carga el modelo una vez y toma trabajos de una cola común. El pool
+    comprueba periódicamente que los workers respondan, los reinicia tras procesar
+    max_pages páginas para acotar el crecimiento de memoria y aplica un tiempo
+    máximo por página: un trabajo que lo supera falla con TimeoutError y su worker
+    se reemplaza, de modo que una página problemática no bloquea el lote.
+    """
+    
+    def __init__(self, config, max_workers=None, max_pages=200, page_timeout=120, health_interval=30):
+        self._config = config
+        # Sin fork: _restart crea workers desde el hilo de reparto, y un fork con otros hilos
+        # en marcha copiaría cerrojos tomados (logging, SQLite, el del propio pool)
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        self._context = multiprocessing.get_context(start_method)
+        self._max_workers = max_workers or multiprocessing.cpu_count()
+        self._max_pages = max_pages
+        self._page_timeout = page_timeout
+        self._health_interval = health_interval
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._shutdown = False
+        self._job_counter = 0
+        self._recycle_requested = False
+        self._wakeup_reader, self._wakeup_writer = self._context.Pipe(duplex=False)
+        self._workers = [_OCRWorker(self._context, config) for _ in range(self._max_workers)]
+        self._thread = threading.Thread(target=self._dispatch_loop, daemon=True)
+        self._thread.start()
+    
+    def submit(self, fn, /, *args, **kwargs):
+        """Encola fn(*args) como un trabajo de una página."""
+        if kwargs:
+            raise TypeError("OCRWorkerPool no admite argumentos con nombre")
+        return self.submit_pages(1, fn, *args)
+    
+    def submit_pages(self, pages, fn, *args):
+        """Encola fn(*args) como un trabajo de 'pages' páginas (0 = sin tiempo máximo)."""
+        future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("No se pueden encolar trabajos tras cerrar el pool")
+            self._job_counter += 1
+            self._pending.append((self._job_counter, future, fn, args, pages))
+        self._wakeup()
+        return future
+    
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        """Cierra el pool cuando terminan los trabajos encolados."""
+        with self._lock:
+            self._shutdown = True
+            if cancel_futures:
+                while self._pending:
+                    self._pending.popleft()[1].cancel()
+        self._wakeup()
+        if wait:
+            self._thread.join()
+    
+    def worker_pids(self):
+        """Devuelve los PID de los workers activos."""
+        return [worker.process.pid for worker in self._workers]
+    
+    def memory_usage(self):
+        """Memoria residente total de los workers en bytes."""
+        return sum(process_rss(pid) for pid in self.worker_pids())
+    
+    def recycle_idle(self):
+        """Pide reiniciar los workers libres para devolver la memoria que retienen."""
+        self._recycle_requested = True
+        self._wakeup()
+    
+    def _wakeup(self):
+        try:
+            self._wakeup_writer.send(None)
+        except (OSError, ValueError):
+            pass
+    
+    def _restart(self, index, graceful=False):
+        worker = self._workers[index]
+        if graceful:
+            worker.stop()
+        else:
+            worker.kill()
+        self._workers[index] = _OCRWorker(self._context, self._config)
+    
+    def _dispatch_loop(self):
+        last_health_check = time.monotonic()
+        
+        while True:
+            with self._lock:
+                busy = any(worker.job for worker in self._workers)
+                if self._shutdown and not self._pending and not busy:
+                    break
+                # Repartir trabajos pendientes entre los workers libres
+                for worker in self._workers:
+                    if not self._pending:
+                        break
+                    if worker.job is None and worker.ping_deadline is None:
+                        job_id, future, fn, args, pages = self._pending.popleft()
+                        if not future.set_running_or_notify_cancel():
+                            continue
+                        try:
+                            worker.conn.send((job_id, fn, args))
+                        except Exception as e:
+                            future.set_exception(e)
+                            continue
+                        worker.job = (job_id, future, pages)
+                        worker.deadline = (time.monotonic() + self._page_timeout * pages
+                                           if self._page_timeout and pages else None)
+            
+            connections = [self._wakeup_reader] + [worker.conn for worker in self._workers]
+            for conn in wait_connections(connections, timeout=0.5):
+                if conn is self._wakeup_reader:
+                    while self._wakeup_reader.poll():
+                        self._wakeup_reader.recv()
+                    continue
+                
+                index = next(i for i, worker in enumerate(self._workers) if worker.conn is conn)
+                worker = self._workers[index]
+                try:
+                    job_id, ok, payload = conn.recv()
+                except (EOFError, OSError):
+                    # El worker ha muerto (por ejemplo, un fallo de memoria en una página)
+                    if worker.job:
+                        worker.job[1].set_exception(RuntimeError("El worker OCR terminó inesperadamente"))
+                    logging.warning(f"Worker OCR {worker.process.pid} caído. Reiniciando.")
+                    self._restart(index)
+                    continue
+                
+                if job_id == "pong":
+                    worker.ping_deadline = None
+                    continue
+                
+                _, future, pages = worker.job
+                worker.job = None
+                worker.deadline = None
+                worker.pages += pages
+                if ok:
+                    future.set_result(payload)
+                else:
+                    future.set_exception(payload)
+                
+                if self._max_pages and worker.pages >= self._max_pages:
+                    logging.debug(f"Reciclando worker OCR {worker.process.pid} tras {worker.pages} páginas")
+                    self._restart(index, graceful=True)
+            
+            if self._recycle_requested:
+                self._recycle_requested = False
+                for index, worker in enumerate(self._workers):
+                    if worker.job is None and worker.ping_deadline is None and worker.pages:
+                        self._restart(index, graceful=True)
+            
+            now = time.monotonic()
+            for index, worker in enumerate(self._workers):
+                if worker.job and worker.deadline and now > worker.deadline:
+                    _, future, pages = worker.job
+                    logging.warning(f"Trabajo OCR de {pages} páginas superó el tiempo máximo. "
+                                    f"Reiniciando worker {worker.process.pid}.")
+                    future.set_exception(TimeoutError(f"OCR sin respuesta tras {self._page_timeout * pages} s"))
+                    self._restart(index)
+                elif worker.ping_deadline and now > worker.ping_deadline:
+                    logging.warning(f"Worker OCR {worker.process.pid} no responde. Reiniciando.")
+                    self._restart(index)
+            
+            # Chequeo de salud periódico de los workers libres
+            if now - last_health_check > self._health_interval:
+                last_health_check = now
+                for index, worker in enumerate(self._workers):
+                    if worker.job is None and worker.ping_deadline is None:
+                        try:
+                            worker.conn.send("ping")
+                            worker.ping_deadline = now + 10
+                        except (OSError, ValueError):
+                            self._restart(index)
+        
+        for worker in self._workers:
+            worker.stop()
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+
+# Nombre del manifiesto incremental dentro del directorio de salida
+MANIFEST_NAME = '.manifiesto_accesibilidad.jsonl'
+
+# Claves de configuración que cambian el PDF generado
+OUTPUT_CONFIG_KEYS = ('language', 'dpi', 'compress_level', 'image_layer', 'layer_dpi', 'tagging_backend',
+                      'finalize', 'profile', 'image_dpi', 'layout_analysis', 'ocr_backend', 'preprocess',
+                      'adaptive_dpi', 'min_dpi', 'max_dpi', 'qpdf_linearize')
+
+def file_sha256(path):
+    """Calcula el hash SHA-256 de un archivo leyéndolo por bloques."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def output_config(config):
+    """Extrae la parte de la configuración que afecta al resultado."""
+    return {key: config.get(key) for key in OUTPUT_CONFIG_KEYS}
+
+def load_manifest(output_dir):
+    """Carga el manifiesto del lote ({archivo: entrada}); las líneas posteriores prevalecen."""
+    manifest = {}
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return manifest
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                manifest[entry['file']] = entry
+            except (ValueError, KeyError):
+                # Línea incompleta de una ejecución interrumpida
+                continue
+    return manifest
+
+def append_manifest_entry(output_dir, entry):
+    """Añade una entrada al manifiesto; al ser solo anexado, un lote interrumpido puede reanudarse."""
+    with open(os.path.join(output_dir, MANIFEST_NAME), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+def compact_manifest(output_dir, manifest):
+    """Reescribe el manifiesto con una sola entrada por archivo."""
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        for entry in manifest.values():
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    os.replace(temp_path, path)
+
+def manifest_status(entry, input_path, output_path, config):
+    """Comprueba si la salida registrada sigue al día.
+    
+    Devuelve (motivo, hash_entrada), con motivo None si el documento puede omitirse.
+    El hash de la entrada solo se recalcula si cambian su tamaño o fecha.
+    """
+    stat = os.stat(input_path)
+    if entry and entry.get('input_size') == stat.st_size and entry.get('input_mtime') == stat.st_mtime_ns:
+        input_hash = entry['input_hash']
+    else:
+        input_hash = file_sha256(input_path)
+    
+    if not entry or entry.get('status') != 'ok':
+        return "nuevo o fallido", input_hash
+    if entry.get('input_hash') != input_hash:
+        return "entrada modificada", input_hash
+    if entry.get('tool_version') != TOOL_VERSION:
+        return f"versión de la herramienta {entry.get('tool_version')} -> {TOOL_VERSION}", input_hash
+    changed = [key for key, value in output_config(config).items() if entry.get('config', {}).get(key) != value]
+    if changed:
+        return f"configuración modificada: {', '.join(changed)}", input_hash
+    if not os.path.exists(output_path):
+        return "salida ausente", input_hash
+    stat = os.stat(output_path)
+    if entry.get('output_size') != stat.st_size:
+        return "salida modificada", input_hash
+    if entry.get('output_mtime') != stat.st_mtime_ns and file_sha256(output_path) != entry.get('output_hash'):
+        return "salida modificada", input_hash
+    return None, input_hash
+
+def manifest_entry(pdf_file, job, config, success, seconds):
+    """Construye la entrada del manifiesto de un documento recién procesado."""
+    input_stat = os.stat(job['input_path'])
+    entry = {
+        'file': pdf_file,
+        'status': 'ok' if success else 'error',
+        'input_hash': job['input_hash'],
+        'input_size': input_stat.st_size,
+        'input_mtime': input_stat.st_mtime_ns,
+        'config': output_config(config),
+        'tool_version': TOOL_VERSION,
+        'pages': job['pages'],
+        'timings': {'seconds': round(seconds, 3)}
+    }
+    if success and os.path.exists(job['output_path']):
+        output_stat = os.stat(job['output_path'])
+        entry.update({
+            'output_hash': file_sha256(job['output_path']),
+            'output_size': output_stat.st_size,
+            'output_mtime': output_stat.st_mtime_ns
+        })
+    return entry
 
 def process_directory(input_dir, output_dir, temp_dir, config):
-    """Procesa todos los PDFs en un directorio usando paralelización."""
+    """Procesa todos los PDFs en un directorio usando paralelización por páginas.
+
+    Los documentos escaneados se dividen en tareas de rangos de páginas que cualquier
+    worker puede tomar de una cola común; cuando todos los rangos de un documento han
+    terminado, se encola su reensamblado en orden de páginas. Así un documento largo
+    no deja al resto de núcleos ociosos al final del lote.
+    
+    Un manifiesto en el directorio de salida registra, para cada documento, el hash de
+    la entrada, la configuración y la versión de la herramienta. Los documentos cuya
+    salida sigue al día se omiten, y un lote interrumpido se reanuda donde se quedó.
+    """
     pdf_files = [f for f in os.listdir(input_dir) if f.lower().endswith('.pdf')]
     
     if not pdf_files:
@@ -445,65 +3168,204 @@ def process_directory(input_dir, output_dir, temp_dir, config):
         return 0
     
     success_count = 0
-    total_files = len(pdf_files)
+    manifest = load_manifest(output_dir)
+    
+    # Índice de imágenes compartido por todos los documentos del lote
+    if 'image_index' not in config:
+        config = dict(config, image_index=os.path.join(temp_dir, IMAGE_INDEX_NAME))
     
-    # Preparar argumentos para procesamiento en paralelo
-    process_args = []
+    # Planificar las tareas de cada documento que necesite procesarse
+    jobs = {}
+    skipped = 0
     for pdf_file in pdf_files:
         input_path = os.path.join(input_dir, pdf_file)
         output_path = os.path.join(output_dir, pdf_file)
-        process_args.append((input_path, output_path, config))
+        reason, input_hash = manifest_status(manifest.get(pdf_file), input_path, output_path, config)
+        if reason is None and not config.get('force'):
+            skipped += 1
+            continue
+        logging.info(f"Procesando {pdf_file}: {reason or 'reprocesado forzado'}")
+        job = plan_document(input_path, output_path, config)
+        job.update({'file': pdf_file, 'input_hash': input_hash, 'started': None})
+        jobs[input_path] = job
+    
+    if skipped:
+        logging.info(f"Documentos sin cambios omitidos: {skipped}")
+        print(f"Documentos sin cambios omitidos: {skipped}")
+    
+    total_files = len(jobs)
+    if not jobs:
+        return 0
+    
+    # Los documentos más largos primero, para que no sean los últimos en terminar
+    ordered_jobs = sorted(jobs.values(), key=lambda job: job['pages'], reverse=True)
+    
+    # Cola de tareas: rangos de OCR y documentos listos para ensamblar
+    queue = deque()
+    for job in ordered_jobs:
+        if job['chunks']:
+            for page_numbers in job['chunks']:
+                queue.append(('ocr', job, (job['input_path'], page_numbers, config)))
+        else:
+            queue.append(('document', job, (
+                (job['input_path'], job['output_path'], config, None, job['page_kinds']),)))
     
     # Determinar el número óptimo de workers (dejando algunos núcleos libres)
     max_workers = max(1, multiprocessing.cpu_count() - 1)
+    # Limitar las tareas en vuelo para acotar la memoria de resultados pendientes
+    max_in_flight = max_workers * 2
     
-    # Procesar archivos en paralelo con una barra de progreso
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(process_single_pdf, arg) for arg in process_args]
+    # Procesar tareas en un pool de workers OCR persistentes con una barra de progreso
+    executor = OCRWorkerPool(config, max_workers=max_workers,
+                             max_pages=config.get('worker_max_pages', 200),
+                             page_timeout=config.get('page_timeout', 120))
+    memory_limit = config.get('max_memory', 0) * 1024 * 1024
+    allowed = max_in_flight
+    throttled = False
+    report = RunReport()
+    try:
+        in_flight = {}
         
         with tqdm(total=total_files, desc="Procesando PDFs") as progress_bar:
-            for future in as_completed(futures):
-                try:
-                    result, input_path = future.result()
-                    if result:
-                        success_count += 1
+            while queue or in_flight:
+                # Con techo de memoria, bajar una tarea en vuelo en cada comprobación mientras
+                # se supere (sin bajar de una) y reiniciar cada vez los workers libres
+                if memory_limit and in_flight:
+                    usage = executor.memory_usage() + process_rss(os.getpid())
+                    if usage > memory_limit:
+                        allowed = max(1, min(allowed, len(in_flight)) - 1)
+                        if not throttled:
+                            logging.warning(f"Memoria en uso {usage // (1024*1024)} MB por encima del "
+                                            f"límite de {config['max_memory']} MB. Reduciendo concurrencia.")
+                        logging.debug(f"Memoria en uso {usage // (1024*1024)} MB: hasta {allowed} tareas en vuelo")
+                        executor.recycle_idle()
+                        throttled = True
+                    elif throttled:
+                        logging.info("Memoria por debajo del límite. Restableciendo concurrencia.")
+                        allowed = max_in_flight
+                        throttled = False
+                
+                while queue and len(in_flight) < allowed:
+                    kind, job, task_args = queue.popleft()
+                    if job['started'] is None:
+                        job['started'] = time.time()
+                    if kind == 'ocr':
+                        future = executor.submit_pages(len(task_args[1]), ocr_pages, *task_args)
                     else:
-                        logging.warning(f"Procesamiento fallido para: {input_path}")
-                except Exception as e:
-                    logging.error(f"Error en proceso paralelo: {str(e)}")
-                progress_bar.update(1)
+                        future = executor.submit_pages(0, process_single_pdf, *task_args)
+                    in_flight[future] = (kind, job, task_args)
+                
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, job, task_args = in_flight.pop(future)
+                    
+                    if kind == 'ocr':
+                        # Rango de OCR terminado: acumular y ensamblar cuando esté completo
+                        try:
+                            job['ocr_results'].update(future.result())
+                        except Exception as e:
+                            input_path, page_numbers, _ = task_args
+                            if len(page_numbers) > 1:
+                                # Reintentar página a página para aislar la página problemática
+                                logging.warning(f"Reintentando OCR de {input_path} páginas "
+                                                f"{page_numbers[0]+1}-{page_numbers[-1]+1} una a una: {str(e)}")
+                                for page_num in reversed(page_numbers):
+                                    queue.appendleft(('ocr', job, (input_path, [page_num], config)))
+                                job['pending'] += len(page_numbers)
+                            else:
+                                logging.error(f"OCR fallido en {input_path} página {page_numbers[0]+1}: {str(e)}")
+                        job['pending'] -= 1
+                        if job['pending'] == 0:
+                            # El ensamblado va al frente de la cola para liberar memoria cuanto antes
+                            queue.appendleft(('document', job, (
+                                (job['input_path'], job['output_path'], config,
+                                 job['ocr_results'], job['page_kinds']),)))
+                            job['ocr_results'] = {}
+                        continue
+                    
+                    result = False
+                    try:
+                        result, input_path, metrics = future.result()
+                        # La clasificación se hizo al planificar, fuera del worker
+                        if job['classify_seconds'] is not None:
+                            metrics['spans'].insert(0, {'stage': 'classify', 'page': None,
+                                                        'seconds': round(job['classify_seconds'], 6)})
+                        report.add(metrics)
+                        if result:
+                            success_count += 1
+                        else:
+                            logging.warning(f"Procesamiento fallido para: {input_path}")
+                    except Exception as e:
+                        logging.error(f"Error en proceso paralelo: {str(e)}")
+                    
+                    # Registrar el documento en el manifiesto en cuanto termina
+                    try:
+                        entry = manifest_entry(job['file'], job, config, result, time.time() - job['started'])
+                        append_manifest_entry(output_dir, entry)
+                        manifest[job['file']] = entry
+                    except Exception as e:
+                        logging.warning(f"No se pudo actualizar el manifiesto para {job['file']}: {str(e)}")
+                    progress_bar.update(1)
+    finally:
+        executor.shutdown(cancel_futures=True)
+        try:
+            compact_manifest(output_dir, manifest)
+        except Exception as e:
+            logging.warning(f"No se pudo compactar el manifiesto: {str(e)}")
+        write_run_report(report, config)
     
     return success_count
 
-def post_process_pdf(input_path, output_path=None):
-    """Intenta corregir problemas comunes de accesibilidad usando QPDF si está disponible."""
-    if output_path is None:
-        output_path = input_path
-    
+def write_run_report(report, config):
+    """Escribe el informe del lote en JSON y CSV, y en formato Prometheus si se pide."""
+    try:
+        if config.get('report'):
+            report.write_json(config['report'] + '.json')
+            report.write_csv(config['report'] + '.csv')
+            logging.info(f"Informe de rendimiento escrito en {config['report']}.json/.csv")
+        if config.get('prometheus'):
+            report.write_prometheus(config['prometheus'])
+            logging.info(f"Métricas Prometheus escritas en {config['prometheus']}")
+    except Exception as e:
+        logging.warning(f"No se pudo escribir el informe de rendimiento: {str(e)}")
+
+@functools.lru_cache(maxsize=None)
+def qpdf_available():
+    """Comprueba una sola vez por proceso si QPDF está instalado."""
     try:
-        # Verificar si QPDF está instalado
         subprocess.run(["qpdf", "--version"], 
                      stdout=subprocess.PIPE, 
                      stderr=subprocess.PIPE, 
                      check=True)
+        return True
+    except (FileNotFoundError, subprocess.CalledProcessError):
+        logging.info("QPDF no está instalado. Omitiendo linealización.")
+        return False
+
+def post_process_pdf(input_path, output_path=None):
+    """Lineariza un PDF ya guardado con QPDF.
+    
+    Es la alternativa para versiones de MuPDF que no linealizan al guardar; la
+    compresión y los flujos de objetos ya los aplica el guardado (ver optimize_pdf).
+    """
+    if output_path is None:
+        output_path = input_path
+    
+    try:
+        # Crear el archivo temporal junto al destino para que el reemplazo sea un renombrado
+        temp_output = output_path + '.qpdf'
         
-        # Crear un archivo temporal para la salida
-        temp_output = tempfile.mktemp(suffix='.pdf')
-        
-        # Ejecutar qpdf para linearizar y reparar el PDF
+        # Ejecutar qpdf para linearizar el PDF
         subprocess.run([
             "qpdf", 
             "--linearize",
-            "--object-streams=generate",
-            "--compress-streams=y",
-            "--recompress-flate",
-            "--replace-input",
+            "--object-streams=preserve",
             input_path,
             temp_output
-        ], check=True)
+        ], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         
         # Reemplazar el archivo original con el procesado
-        shutil.move(temp_output, output_path)
+        os.replace(temp_output, output_path)
         logging.info(f"Post-procesamiento con QPDF completado: {output_path}")
         return True
     except FileNotFoundError:
@@ -517,28 +3379,13 @@ def post_process_pdf(input_path, output_path=None):
         return False
 
 def check_pymupdf_version():
-    """Verifica la versión de PyMuPDF y sus capacidades."""
+    """Verifica la versión de PyMuPDF y sus capacidades (resueltas una sola vez por proceso)."""
     try:
         version = fitz.version
         logging.info(f"Versión de PyMuPDF: {version}")
         
-        # Verificar capacidades de etiquetado
-        capabilities = []
-        
         # Verificar métodos importantes para etiquetado
-        sample_doc = fitz.open()
-        sample_doc.new_page()
-        
-        if hasattr(sample_doc, "init_doc_structure"):
-            capabilities.append("init_doc_structure")
-        if hasattr(sample_doc, "set_xml_metadata"):
-            capabilities.append("set_xml_metadata")
-        if hasattr(sample_doc, "add_struct_element"):
-            capabilities.append("add_struct_element")
-        if hasattr(sample_doc, "is_tagged"):
-            capabilities.append("is_tagged")
-        
-        sample_doc.close()
+        capabilities = sorted(probe_capabilities()['methods'])
         
         if capabilities:
             logging.info(f"Capacidades de etiquetado disponibles: {', '.join(capabilities)}")
@@ -564,10 +3411,64 @@ def main():
     parser.add_argument('--temp', default='temp_ocr', help='Directorio temporal para archivos de OCR')
     parser.add_argument('--language', default='spa', help='Idioma para OCR (códigos ISO 639-2)')
     parser.add_argument('--dpi', type=int, default=300, help='Resolución DPI para OCR')
+    parser.add_argument('--adaptive-dpi', action='store_true',
+                        help='Elegir la resolución del OCR por página según la imagen escaneada '
+                             '(entre --min-dpi y --max-dpi)')
+    parser.add_argument('--min-dpi', type=int, default=150, help='Resolución mínima del OCR adaptativo')
+    parser.add_argument('--max-dpi', type=int, default=400, help='Resolución máxima del OCR adaptativo')
+    parser.add_argument('--ocr-backend', choices=OCR_BACKENDS, default='auto',
+                        help='Motor OCR: tesserocr en proceso, Tesseract por stdin o el clásico con archivos temporales')
+    parser.add_argument('--page-timeout', type=int, default=120,
+                        help='Tiempo máximo de OCR por página en segundos')
+    parser.add_argument('--worker-max-pages', type=int, default=200,
+                        help='Páginas tras las que se reinicia cada worker OCR (0 = nunca)')
+    parser.add_argument('--ocr-cache', default='ocr_cache',
+                        help='Directorio de la caché de resultados OCR')
+    parser.add_argument('--ocr-cache-size', type=int, default=1024,
+                        help='Tamaño máximo de la caché OCR en MB')
+    parser.add_argument('--no-ocr-cache', action='store_true',
+                        help='Desactivar la caché de resultados OCR')
+    parser.add_argument('--image-layer', choices=IMAGE_LAYER_MODES, default='original',
+                        help='Capa visible de las páginas escaneadas: imagen original sin recodificar, '
+                             'ráster del OCR reutilizado o render clásico a 72 DPI')
+    parser.add_argument('--layer-dpi', type=int, default=150,
+                        help='Resolución de la capa visible en el modo raster')
+    parser.add_argument('--tagging-backend', choices=['auto'] + list(TAGGING_BACKENDS), default='auto',
+                        help='Etiquetado estructural: API de PyMuPDF, escritor de objetos PDF o solo metadatos')
+    parser.add_argument('--preprocess', action='store_true',
+                        help='Binarizar, enderezar y recortar el ráster antes del OCR')
+    parser.add_argument('--no-layout-analysis', action='store_true',
+                        help='No analizar la maquetación de las páginas nativas (etiquetarlas enteras como Div)')
+    parser.add_argument('--stream-pages', type=int, default=0,
+                        help='Volcar a disco cada N páginas al generar PDFs escaneados (0 = al final)')
+    parser.add_argument('--max-memory', type=int, default=0,
+                        help='Memoria máxima de los workers en MB antes de reducir la concurrencia (0 = sin límite)')
     parser.add_argument('--compress', type=int, choices=[0, 1, 2, 3], default=1, 
                         help='Nivel de compresión (0=ninguna, 3=máxima)')
+    parser.add_argument('--pages-per-task', type=int, default=8,
+                        help='Páginas por tarea de OCR al repartir documentos entre workers')
+    parser.add_argument('--profile', choices=list(COMPRESSION_PROFILES), default='balanced',
+                        help='Perfil de compresión: fast (máximo rendimiento), balanced o archival '
+                             '(recomprime imágenes: CCITT para bitonales, JPEG para grises y color)')
+    parser.add_argument('--image-dpi', type=int, default=150,
+                        help='Resolución objetivo de las imágenes recomprimidas en el perfil archival')
+    parser.add_argument('--report', default=None,
+                        help='Ruta base del informe de rendimiento por etapas (se escriben .json y .csv)')
+    parser.add_argument('--prometheus', default=None,
+                        help='Archivo donde volcar las métricas del lote en formato de texto de Prometheus')
+    parser.add_argument('--validate', action='store_true',
+                        help='Validar la estructura de cada PDF antes de guardarlo (MarkInfo, Lang, '
+                             'StructTreeRoot, ParentTree y texto alternativo); el resultado va al informe')
+    parser.add_argument('--check-pdfua', action='store_true',
+                        help='Verificar los PDFs generados con las comprobaciones PDF/UA de verificador_pdfua.py')
     parser.add_argument('--post-process', action='store_true', 
-                        help='Aplicar post-procesamiento con QPDF si está disponible')
+                        help='Finalizar cada PDF al guardarlo (flujos de objetos y compresión de imágenes '
+                             'y fuentes)')
+    parser.add_argument('--qpdf-linearize', action='store_true',
+                        help='Linealizar con QPDF los PDFs que MuPDF no linealiza al guardar (una segunda '
+                             'escritura por documento)')
+    parser.add_argument('--force', action='store_true',
+                        help='Reprocesar todos los PDFs aunque su salida esté al día')
     parser.add_argument('--debug', action='store_true', 
                         help='Habilitar mensajes de depuración detallados')
     
@@ -578,8 +3479,8 @@ def main():
         logging.getLogger().setLevel(logging.DEBUG)
         logging.info("Modo de depuración activado")
     
-    # Verificar que Tesseract esté instalado
-    if not check_tesseract_installed():
+    # Verificar que Tesseract esté instalado (el motor simulado no lo necesita)
+    if args.ocr_backend != "fake" and not check_tesseract_installed():
         print("ERROR: Tesseract OCR no está instalado o no se encuentra en el PATH.")
         print("Por favor, instálalo antes de continuar:")
         print("- Windows: https://github.com/UB-Mannheim/tesseract/wiki")
@@ -596,7 +3497,31 @@ def main():
     config = {
         'language': args.language,
         'dpi': args.dpi,
-        'compress_level': args.compress
+        'adaptive_dpi': args.adaptive_dpi,
+        'min_dpi': args.min_dpi,
+        'max_dpi': args.max_dpi,
+        'ocr_backend': resolve_ocr_backend(args.ocr_backend),
+        'ocr_cache': None if args.no_ocr_cache else args.ocr_cache,
+        'ocr_cache_size': args.ocr_cache_size,
+        'compress_level': args.compress,
+        'image_layer': args.image_layer,
+        'layer_dpi': args.layer_dpi,
+        'tagging_backend': resolve_tagging_backend(args.tagging_backend).name,
+        'layout_analysis': not args.no_layout_analysis,
+        'preprocess': args.preprocess,
+        'pages_per_task': args.pages_per_task,
+        'page_timeout': args.page_timeout,
+        'worker_max_pages': args.worker_max_pages,
+        'stream_pages': args.stream_pages,
+        'max_memory': args.max_memory,
+        'profile': args.profile,
+        'image_dpi': args.image_dpi,
+        'finalize': args.post_process,
+        'qpdf_linearize': args.qpdf_linearize,
+        'report': args.report,
+        'prometheus': args.prometheus,
+        'validate': args.validate,
+        'force': args.force
     }
     
     setup_directories(input_dir, output_dir, temp_dir)
@@ -605,15 +3530,25 @@ def main():
     print(f"Directorio de salida: {output_dir}")
     print(f"Directorio temporal: {temp_dir}")
     print(f"Idioma OCR: {config['language']}")
-    print(f"Resolución OCR: {config['dpi']} DPI")
+    if config['adaptive_dpi']:
+        print(f"Resolución OCR: adaptativa entre {config['min_dpi']} y {config['max_dpi']} DPI "
+              f"({config['dpi']} DPI sin imagen dominante)")
+    else:
+        print(f"Resolución OCR: {config['dpi']} DPI")
+    print(f"Motor OCR: {config['ocr_backend']}")
+    print(f"Caché OCR: {config['ocr_cache'] or 'Desactivada'}")
+    print(f"Capa de imagen: {config['image_layer']}")
+    print(f"Etiquetado estructural: {config['tagging_backend']}")
     print(f"Nivel de compresión: {config['compress_level']}")
+    print(f"Perfil de compresión: {config['profile']}")
     print(f"Post-procesamiento: {'Activado' if args.post_process else 'Desactivado'}")
     print(f"Versión de PyMuPDF: {pymupdf_version}")
     
     # Advertencia si las capacidades de etiquetado no están disponibles
-    if not any(cap in capabilities for cap in ["add_struct_element", "init_doc_structure"]):
-        print("\n⚠️ ADVERTENCIA: Tu versión de PyMuPDF puede no soportar etiquetado estructural completo.")
-        print("Para mejor accesibilidad, considera actualizar PyMuPDF a la versión 1.18.0 o superior.")
+    if config['tagging_backend'] == "metadata":
+        print("\n⚠️ ADVERTENCIA: Sin etiquetado estructural; solo se añadirán metadatos de accesibilidad.")
+    elif config['tagging_backend'] == "xref":
+        print("\nTu versión de PyMuPDF no tiene API de estructura: el árbol se escribirá directamente como objetos PDF.")
     
     print("\nEste script procesa PDFs escaneados, añade OCR y características de accesibilidad básicas.")
     print("Presiona Enter para comenzar el procesamiento...")
@@ -624,26 +3559,27 @@ def main():
     # Procesar los PDFs
     processed_count = process_directory(input_dir, output_dir, temp_dir, config)
     
-    # Aplicar post-procesamiento si se solicita
-    if args.post_process and processed_count > 0:
-        print("\nAplicando post-procesamiento para mejorar la accesibilidad...")
-        post_processed = 0
-        
-        for pdf_file in os.listdir(output_dir):
-            if pdf_file.lower().endswith('.pdf'):
-                pdf_path = os.path.join(output_dir, pdf_file)
-                if post_process_pdf(pdf_path):
-                    post_processed += 1
-        
-        print(f"Post-procesamiento completado: {post_processed} de {processed_count} archivos")
-    
     # Mostrar resultados
     elapsed_time = time.time() - start_time
     print(f"\nProcesamiento completado en {elapsed_time:.2f} segundos.")
     print(f"PDFs procesados con éxito: {processed_count}")
     print(f"Los PDFs accesibles se han guardado en: {output_dir}")
+    
+    # Verificación PDF/UA de todo el directorio de salida (los ya verificados salen de la caché)
+    if args.check_pdfua:
+        import verificador_pdfua
+        print("\nVerificación PDF/UA de los documentos generados:")
+        try:
+            verificador_pdfua.print_results(verificador_pdfua.check_directory(output_dir))
+        except Exception as e:
+            logging.error(f"Error en la verificación PDF/UA: {str(e)}")
+            print(f"Error en la verificación PDF/UA: {str(e)}")
+    
     print("\nRecomendaciones para mejor accesibilidad:")
-    print("1. Verifica los PDFs con herramientas como PAC (PDF Accessibility Checker)")
+    if args.check_pdfua:
+        print("1. Revisa los fallos de la verificación PDF/UA; PAC sigue siendo la referencia para una auditoría completa")
+    else:
+        print("1. Verifica los PDFs con --check-pdfua (o python verificador_pdfua.py <directorio>)")
     print("2. Para un etiquetado estructural completo, considera usar Adobe Acrobat Pro")
     print("3. Revisa manualmente que el texto OCR sea correcto")
     print("\nRevisa el archivo 'pdf_scanned_accessibility.log' para más detalles.")
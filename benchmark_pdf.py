@@ -0,0 +1,751 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import statistics
+import tracemalloc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import fitz  # PyMuPDF
+
+import acces_pdf
+
+# BeautifulSoup solo hace falta para medir el parser hOCR anterior
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+
+def print_table(headers, rows):
+    """Imprime una tabla de resultados alineada en columnas."""
+    widths = [max(len(str(value)) for value in column) for column in zip(headers, *rows)]
+    print("  ".join(str(h).ljust(w) for h, w in zip(headers, widths)))
+    print("  ".join("-" * w for w in widths))
+    for row in rows:
+        print("  ".join(str(value).ljust(w) for value, w in zip(row, widths)))
+
+def collect_pdfs(paths):
+    """Expande una lista de PDFs y directorios a la lista de PDFs que contienen."""
+    pdf_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            pdf_paths.extend(sorted(os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith('.pdf')))
+        else:
+            pdf_paths.append(path)
+    return pdf_paths
+
+def benchmark_ocr(pdf_path, backends, language="spa", dpi=300, max_pages=5, repeat=1):
+    """Compara los motores OCR (render + OCR por página) sobre las primeras páginas de un PDF."""
+    doc = fitz.open(pdf_path)
+    page_numbers = range(min(len(doc), max_pages))
+    rows = []
+
+    for backend in backends:
+        if acces_pdf.resolve_ocr_backend(backend) != backend:
+            rows.append([backend, "no disponible", "", "", ""])
+            continue
+
+        render_times = []
+        ocr_times = []
+        characters = 0
+        try:
+            for _ in range(repeat):
+                for page_num in page_numbers:
+                    start = time.perf_counter()
+                    pix = acces_pdf.render_page_for_ocr(doc[page_num], dpi, backend)
+                    render_times.append(time.perf_counter() - start)
+
+                    start = time.perf_counter()
+                    text = acces_pdf.run_ocr(pix, language, backend, dpi=dpi)
+                    ocr_times.append(time.perf_counter() - start)
+                    characters += len(text)
+                    pix = None
+        except Exception as e:
+            rows.append([backend, f"error: {e}", "", "", ""])
+            continue
+
+        total = sum(render_times) + sum(ocr_times)
+        rows.append([
+            backend,
+            f"{statistics.mean(render_times) * 1000:.1f}",
+            f"{statistics.mean(ocr_times) * 1000:.1f}",
+            f"{len(ocr_times) / total:.2f}",
+            characters // repeat
+        ])
+
+    doc.close()
+    print(f"\nOCR sobre {len(page_numbers)} páginas de {pdf_path} a {dpi} DPI ({repeat} repeticiones)")
+    print_table(["motor", "render ms/pág", "OCR ms/pág", "págs/s", "caracteres"], rows)
+    return rows
+
+def benchmark_image_layer(pdf_path, dpi=300, layer_dpi=150, max_pages=5):
+    """Compara los modos de capa de imagen: render para OCR + creación de la capa visible."""
+    doc = fitz.open(pdf_path)
+    page_numbers = range(min(len(doc), max_pages))
+    measurements = {}
+
+    for mode in acces_pdf.IMAGE_LAYER_MODES:
+        new_doc = fitz.open()
+        seconds = 0.0
+        image_bytes = 0
+        for page_num in page_numbers:
+            page = doc[page_num]
+            start = time.perf_counter()
+            # El render para OCR se paga en todos los modos; en 'raster' también produce la capa
+            if mode == "raster":
+                pix = page.get_pixmap(matrix=fitz.Matrix(dpi/72, dpi/72), alpha=False)
+                layer = acces_pdf.encode_image_layer(pix, dpi, layer_dpi)
+                pix = fitz.Pixmap(fitz.csGRAY, pix)
+            else:
+                pix = acces_pdf.render_page_for_ocr(page, dpi, "stdin")
+                layer = None
+            pix = None
+            _, page_bytes = acces_pdf.add_image_layer(new_doc, doc, page_num, mode, layer, layer_dpi)
+            seconds += time.perf_counter() - start
+            image_bytes += page_bytes
+        new_doc.close()
+        measurements[mode] = (seconds / len(page_numbers), image_bytes / len(page_numbers))
+
+    doc.close()
+    legacy_seconds, legacy_bytes = measurements["legacy"]
+    rows = []
+    for mode, (seconds, image_bytes) in measurements.items():
+        rows.append([
+            mode,
+            f"{seconds * 1000:.1f}",
+            f"{(legacy_seconds - seconds) * 1000:.1f}",
+            f"{image_bytes:.0f}",
+            f"{legacy_bytes - image_bytes:.0f}"
+        ])
+    print(f"\nCapa de imagen sobre {len(page_numbers)} páginas de {pdf_path} (OCR a {dpi} DPI)")
+    print_table(["modo", "ms/pág", "ms ahorrados/pág", "bytes/pág", "bytes ahorrados/pág"], rows)
+    return rows
+
+def legacy_is_scanned(doc):
+    """Detección anterior: extrae el texto completo de cada página hasta encontrar más de 50 caracteres."""
+    for page in doc:
+        if len(page.get_text().strip()) > 50:
+            return False
+    return True
+
+def benchmark_classify(pdf_paths):
+    """Compara el clasificador por página con la detección anterior sobre un corpus de PDFs."""
+    rows = []
+    legacy_total = 0.0
+    classifier_total = 0.0
+    total_pages = 0
+
+    for pdf_path in pdf_paths:
+        doc = fitz.open(pdf_path)
+        start = time.perf_counter()
+        scanned = legacy_is_scanned(doc)
+        legacy_seconds = time.perf_counter() - start
+        doc.close()
+
+        # Reabrir para no beneficiarse de las páginas ya cargadas
+        doc = fitz.open(pdf_path)
+        start = time.perf_counter()
+        kinds = acces_pdf.classify_document(doc)
+        classifier_seconds = time.perf_counter() - start
+        doc.close()
+
+        ocr_count = kinds.count(acces_pdf.PAGE_SCANNED)
+        legacy_ocr = len(kinds) if scanned else 0
+        rows.append([
+            os.path.basename(pdf_path),
+            len(kinds),
+            f"{legacy_seconds * 1000:.1f}",
+            f"{classifier_seconds * 1000:.1f}",
+            legacy_ocr,
+            ocr_count,
+            kinds.count(acces_pdf.PAGE_DIGITAL),
+            kinds.count(acces_pdf.PAGE_BLANK)
+        ])
+        legacy_total += legacy_seconds
+        classifier_total += classifier_seconds
+        total_pages += len(kinds)
+
+    print(f"\nClasificación de {len(pdf_paths)} documentos ({total_pages} páginas)")
+    print_table(["documento", "págs", "anterior ms", "clasificador ms", "OCR antes", "OCR ahora",
+                 "digitales", "en blanco"], rows)
+    if total_pages:
+        print(f"\nPáginas/s: anterior {total_pages / max(legacy_total, 1e-9):.0f}, "
+              f"clasificador {total_pages / max(classifier_total, 1e-9):.0f}")
+    return rows
+
+def benchmark_compress(pdf_paths, compress_level=1, image_dpi=150):
+    """Mide tiempo y tamaño de cada perfil de compresión sobre un corpus de PDFs."""
+    totals = {profile: [0.0, 0] for profile in acces_pdf.COMPRESSION_PROFILES}
+    input_total = 0
+    rows = []
+
+    for pdf_path in pdf_paths:
+        input_size = os.path.getsize(pdf_path)
+        input_total += input_size
+        for profile in acces_pdf.COMPRESSION_PROFILES:
+            # Cada perfil parte del documento original recién abierto
+            doc = fitz.open(pdf_path)
+            start = time.perf_counter()
+            params = acces_pdf.optimize_pdf(doc, compress_level, profile=profile, image_dpi=image_dpi)
+            size = len(doc.tobytes(**params))
+            seconds = time.perf_counter() - start
+            doc.close()
+            totals[profile][0] += seconds
+            totals[profile][1] += size
+            rows.append([
+                os.path.basename(pdf_path),
+                profile,
+                f"{seconds * 1000:.1f}",
+                size,
+                f"{(input_size - size) / max(input_size, 1) * 100:.1f}"
+            ])
+
+    print(f"\nPerfiles de compresión sobre {len(pdf_paths)} documentos ({input_total} bytes)")
+    print_table(["documento", "perfil", "ms", "bytes", "% ahorrado"], rows)
+    print()
+    print_table(["perfil", "ms total", "bytes total", "% ahorrado"],
+                [[profile, f"{seconds * 1000:.1f}", size, f"{(input_total - size) / max(input_total, 1) * 100:.1f}"]
+                 for profile, (seconds, size) in totals.items()])
+    return rows
+
+def legacy_parse_tsv(tsv, scale=1.0):
+    """Parser TSV anterior: una lista de Python por palabra."""
+    words = []
+    for row in tsv.splitlines()[1:]:
+        cols = row.split('\t', 11)
+        if len(cols) < 12 or cols[0] != '5' or not cols[11].strip():
+            continue
+        left, top, width, height = (int(value) for value in cols[6:10])
+        words.append([
+            round(left / scale, 2), round(top / scale, 2),
+            round((left + width) / scale, 2), round((top + height) / scale, 2),
+            cols[11].strip(), float(cols[10]), int(cols[2]), int(cols[3]), int(cols[4])
+        ])
+    return words
+
+def legacy_parse_hocr_bs4(hocr):
+    """Parser hOCR de pdf_accesible.py.bak: BeautifulSoup y diccionarios anidados por palabra."""
+    soup = BeautifulSoup(hocr, 'html.parser')
+    blocks = []
+    for p_idx, ocr_p in enumerate(soup.find_all('p', class_='ocr_par')):
+        p_bbox_match = re.search(r'bbox (\d+) (\d+) (\d+) (\d+)', ocr_p.get('title', ''))
+        if not p_bbox_match:
+            continue
+        p_block = {'type': 'paragraph', 'id': f'p_{p_idx}', 'bbox': tuple(map(int, p_bbox_match.groups())),
+                   'lines': []}
+        for l_idx, ocr_line in enumerate(ocr_p.find_all('span', class_='ocr_line')):
+            l_bbox_match = re.search(r'bbox (\d+) (\d+) (\d+) (\d+)', ocr_line.get('title', ''))
+            if not l_bbox_match:
+                continue
+            line_text = ' '.join([w.get_text() for w in ocr_line.find_all('span', class_='ocrx_word')])
+            words = []
+            for word in ocr_line.find_all('span', class_='ocrx_word'):
+                w_bbox_match = re.search(r'bbox (\d+) (\d+) (\d+) (\d+)', word.get('title', ''))
+                if w_bbox_match:
+                    words.append({'text': word.get_text(), 'bbox': tuple(map(int, w_bbox_match.groups()))})
+            p_block['lines'].append({'id': f'l_{p_idx}_{l_idx}', 'bbox': tuple(map(int, l_bbox_match.groups())),
+                                     'text': line_text, 'words': words})
+        blocks.append(p_block)
+    return blocks
+
+def measure_parser(parser, outputs):
+    """Devuelve (ms por página, pico de memoria KB, memoria retenida KB) de un parser."""
+    start = time.perf_counter()
+    for output in outputs:
+        parser(output)
+    seconds = time.perf_counter() - start
+
+    # La memoria se mide en otra pasada: tracemalloc ralentiza la asignación
+    results = []
+    tracemalloc.start()
+    for output in outputs:
+        results.append(parser(output))
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds * 1000 / len(outputs), peak / 1024, retained / 1024
+
+def benchmark_parse(pdf_path=None, backend="fake", language="spa", dpi=300, max_pages=5, repeat=3):
+    """Compara los parsers de la salida de Tesseract (TSV y hOCR) sobre páginas a 300 DPI.
+
+    Sin PDF se usan páginas en blanco de tamaño carta; con el motor simulado el OCR
+    devuelve una página densa de texto de cuerpo 10.
+    """
+    doc = fitz.open(pdf_path) if pdf_path else fitz.open()
+    if not pdf_path:
+        for _ in range(max_pages):
+            doc.new_page()
+    tsv_outputs = []
+    hocr_outputs = []
+    for page_num in range(min(len(doc), max_pages)):
+        pix = acces_pdf.render_page_for_ocr(doc[page_num], dpi, backend)
+        tsv_outputs.append(acces_pdf.run_ocr(pix, language, backend, output_format="tsv", dpi=dpi))
+        hocr_outputs.append(acces_pdf.run_ocr(pix, language, backend, output_format="hocr", dpi=dpi))
+        pix = None
+    doc.close()
+
+    scale = dpi / 72
+    parsers = [
+        ("hOCR BeautifulSoup", hocr_outputs, legacy_parse_hocr_bs4 if BeautifulSoup is not None else None),
+        ("hOCR PageLayout", hocr_outputs, lambda output: acces_pdf.PageLayout.from_hocr(output, scale)),
+        ("TSV listas", tsv_outputs, lambda output: legacy_parse_tsv(output, scale)),
+        ("TSV PageLayout", tsv_outputs, lambda output: acces_pdf.PageLayout.from_tsv(output, scale)),
+    ]
+    words = len(acces_pdf.PageLayout.from_tsv(tsv_outputs[0], scale)) if tsv_outputs else 0
+    rows = []
+    for name, outputs, parser in parsers:
+        if parser is None:
+            rows.append([name, "bs4 no instalado", "", ""])
+            continue
+        best = min(measure_parser(parser, outputs) for _ in range(repeat))
+        rows.append([name, f"{best[0]:.2f}", f"{best[1]:.0f}", f"{best[2]:.0f}"])
+
+    print(f"\nParsers de OCR sobre {len(tsv_outputs)} páginas a {dpi} DPI (motor {backend}, "
+          f"{words} palabras en la primera página)")
+    print_table(["parser", "ms/pág", "pico KB", "retenido KB"], rows)
+    return rows
+
+def benchmark_preprocess(pdf_path, backend="stdin", language="spa", dpi=300, max_pages=5):
+    """Compara por página el OCR del ráster completo con el del ráster preprocesado.
+
+    El preprocesado (binarización, enderezado y recorte de márgenes) se mide aparte;
+    el ahorro neto es el OCR ahorrado menos el coste del preprocesado.
+    """
+    doc = fitz.open(pdf_path)
+    rows = []
+    totals = [0.0, 0.0, 0.0]
+    for page_num in range(min(len(doc), max_pages)):
+        pix = acces_pdf.render_page_for_ocr(doc[page_num], dpi, backend)
+        start = time.perf_counter()
+        text = acces_pdf.run_ocr(pix, language, backend, dpi=dpi)
+        plain_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        prepared, _, info = acces_pdf.preprocess_for_ocr(pix, dpi)
+        preprocess_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        prepared_text = acces_pdf.run_ocr(prepared, language, backend, dpi=dpi)
+        prepared_seconds = time.perf_counter() - start
+        pix = prepared = None
+
+        totals[0] += plain_seconds
+        totals[1] += preprocess_seconds
+        totals[2] += prepared_seconds
+        rows.append([
+            page_num + 1,
+            f"{info['skew']:.2f}",
+            f"{info['kept'] * 100:.0f}",
+            f"{preprocess_seconds * 1000:.1f}",
+            f"{plain_seconds * 1000:.1f}",
+            f"{prepared_seconds * 1000:.1f}",
+            f"{(plain_seconds - prepared_seconds - preprocess_seconds) * 1000:.1f}",
+            len(text),
+            len(prepared_text)
+        ])
+    doc.close()
+
+    print(f"\nPreprocesado antes del OCR sobre {len(rows)} páginas de {pdf_path} a {dpi} DPI (motor {backend})")
+    print_table(["pág", "inclinación °", "% píxeles", "preproceso ms", "OCR ms", "OCR preprocesado ms",
+                 "ahorro neto ms", "caracteres", "caracteres preprocesado"], rows)
+    if rows:
+        print(f"Total: OCR {totals[0]:.2f} s, preprocesado {totals[1]:.2f} s + OCR {totals[2]:.2f} s")
+    return rows
+
+def benchmark_adaptive_dpi(pdf_path, backend="stdin", language="spa", dpi=300, dpi_bounds=(150, 400), max_pages=5):
+    """Compara por página el OCR a resolución fija con la resolución adaptativa.
+
+    La adaptativa toma la resolución nativa de la imagen escaneada dentro de dpi_bounds
+    y, si la página es solo esa imagen, la extrae sin renderizar la página.
+    """
+    doc = fitz.open(pdf_path)
+    rows = []
+    totals = [0.0, 0.0]
+    for page_num in range(min(len(doc), max_pages)):
+        page = doc[page_num]
+        placement = acces_pdf.scan_image_placement(page)
+        fixed = acces_pdf.apply_ocr_to_page(page, language, dpi, backend)
+        adaptive = acces_pdf.apply_ocr_to_page(page, language, dpi, backend, dpi_bounds=dpi_bounds)
+        fixed_seconds = fixed['timings']['render'] + fixed['timings']['ocr']
+        adaptive_seconds = adaptive['timings']['render'] + adaptive['timings']['ocr']
+        totals[0] += fixed_seconds
+        totals[1] += adaptive_seconds
+        rows.append([
+            page_num + 1,
+            f"{placement['dpi']:.0f}" if placement else "-",
+            adaptive['timings']['dpi'],
+            "sí" if adaptive['timings']['direct'] else "no",
+            f"{fixed['timings']['render'] * 1000:.1f}",
+            f"{adaptive['timings']['render'] * 1000:.1f}",
+            f"{fixed['timings']['ocr'] * 1000:.1f}",
+            f"{adaptive['timings']['ocr'] * 1000:.1f}",
+            len(fixed['text']),
+            len(adaptive['text'])
+        ])
+    doc.close()
+
+    print(f"\nOCR a {dpi} DPI fijos frente a resolución adaptativa ({dpi_bounds[0]}-{dpi_bounds[1]} DPI) "
+          f"sobre {len(rows)} páginas de {pdf_path} (motor {backend})")
+    print_table(["pág", "DPI imagen", "DPI elegidos", "extraída", "render ms", "render adapt. ms",
+                 "OCR ms", "OCR adapt. ms", "caracteres", "caracteres adapt."], rows)
+    if rows:
+        print(f"Total: fija {totals[0]:.2f} s, adaptativa {totals[1]:.2f} s")
+    return rows
+
+def legacy_extract_and_make_accessible(input_pdf_path, output_pdf_path):
+    """Versión anterior de pdf_accesible.extract_and_make_accessible: cada imagen pasa
+    por un archivo temporal y su posición se busca imagen a imagen."""
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.units import inch
+
+    doc = fitz.open(input_pdf_path)
+    c = canvas.Canvas(output_pdf_path, pagesize=letter)
+    width, height = letter
+    for page_num in range(len(doc)):
+        page = doc.load_page(page_num)
+        for x0, y0, x1, y1, text, block_no, block_type in page.get_text("blocks"):
+            if block_type == 0:
+                c.drawString(x0 * inch, height - y0 * inch, text.strip())
+        for img_index, img in enumerate(page.get_images(full=True)):
+            xref = img[0]
+            base_image = doc.extract_image(xref)
+            temp_image_path = f"temp_image_{img_index}.{base_image['ext']}"
+            with open(temp_image_path, "wb") as img_file:
+                img_file.write(base_image["image"])
+            x0, y0, x1, y1 = page.get_image_rects(xref)[0]
+            c.drawImage(temp_image_path, x0 * inch, height - y1 * inch,
+                        width=(x1 - x0) * inch, height=(y1 - y0) * inch)
+            os.remove(temp_image_path)
+        c.showPage()
+    c.save()
+    doc.close()
+
+def benchmark_reportlab(pdf_paths, repeat=1):
+    """Compara la transferencia de imágenes a ReportLab con archivos temporales y en memoria."""
+    import pdf_accesible
+
+    rows = []
+    totals = {"temporales": 0.0, "memoria": 0.0}
+    total_pages = 0
+    with tempfile.TemporaryDirectory() as work_dir:
+        # Los archivos temporales de la versión anterior se crean en el directorio actual
+        previous_dir = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            for pdf_path in pdf_paths:
+                pdf_path = os.path.join(previous_dir, pdf_path)
+                with fitz.open(pdf_path) as doc:
+                    pages = len(doc)
+                    images = sum(len(page.get_images()) for page in doc)
+                row = [os.path.basename(pdf_path), pages, images]
+                for name, function in (("temporales", legacy_extract_and_make_accessible),
+                                       ("memoria", pdf_accesible.extract_and_make_accessible)):
+                    output_path = os.path.join(work_dir, f"{name}.pdf")
+                    timings = []
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        try:
+                            function(pdf_path, output_path)
+                        except Exception as e:
+                            print(f"{name} falló en {pdf_path}: {e}")
+                        timings.append(time.perf_counter() - start)
+                    seconds = min(timings)
+                    totals[name] += seconds
+                    size = os.path.getsize(output_path) if os.path.exists(output_path) else 0
+                    row += [f"{seconds * 1000:.1f}", size]
+                    if os.path.exists(output_path):
+                        os.remove(output_path)
+                total_pages += pages
+                rows.append(row)
+        finally:
+            os.chdir(previous_dir)
+
+    print(f"\nReportLab sobre {len(pdf_paths)} documentos ({total_pages} páginas, {repeat} repeticiones)")
+    print_table(["documento", "págs", "imágenes", "temporales ms", "bytes", "memoria ms", "bytes"], rows)
+    if total_pages:
+        print(f"\nPáginas/s: temporales {total_pages / max(totals['temporales'], 1e-9):.1f}, "
+              f"memoria {total_pages / max(totals['memoria'], 1e-9):.1f}")
+    return rows
+
+# Corpus sintético de la suite: nombre -> (tipo, páginas, parámetros)
+SUITE_CORPUS = {
+    "escaneado_150.pdf": ("scanned", 6, {"dpi": 150}),
+    "escaneado_300.pdf": ("scanned", 4, {"dpi": 300}),
+    "digital.pdf": ("digital", 12, {}),
+    "mixto.pdf": ("mixed", 6, {"dpi": 200}),
+    "imagenes.pdf": ("images", 4, {"images": 30}),
+}
+
+# Escenarios: (nombre, función medida, documentos del corpus; None = el directorio completo)
+SUITE_SCENARIOS = [
+    ("escaneado_150", "process_scanned_pdf", ["escaneado_150.pdf"]),
+    ("escaneado_300", "process_scanned_pdf", ["escaneado_300.pdf"]),
+    ("mixto", "process_scanned_pdf", ["mixto.pdf"]),
+    ("imagenes", "process_scanned_pdf", ["imagenes.pdf"]),
+    ("reportlab_digital", "extract_and_make_accessible", ["digital.pdf"]),
+    ("reportlab_imagenes", "extract_and_make_accessible", ["imagenes.pdf"]),
+    ("lote", "process_directory", None),
+]
+
+SUITE_WORDS = ("el", "documento", "accesible", "de", "la", "página", "texto", "con", "una",
+               "lectura", "estructura", "para", "los", "contenido", "imagen", "en", "sección")
+
+def write_text_page(page, rng, lines=40):
+    """Escribe en la página líneas de palabras pseudoaleatorias reproducibles."""
+    y = 72
+    for _ in range(lines):
+        words = [rng.choice(SUITE_WORDS) for _ in range(rng.randint(6, 12))]
+        page.insert_text((72, y), " ".join(words), fontsize=11)
+        y += 16
+        if y > page.rect.height - 72:
+            break
+
+def insert_scanned_page(doc, rng, dpi):
+    """Añade una página que solo contiene el escaneo (en gris) de una página de texto."""
+    source = fitz.open()
+    write_text_page(source.new_page(), rng)
+    pix = source[0].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+    page = doc.new_page()
+    page.insert_image(page.rect, stream=pix.tobytes("png"))
+    source.close()
+
+def insert_images_page(doc, rng, count):
+    """Añade una página con texto y muchas imágenes pequeñas, algunas repetidas."""
+    page = doc.new_page()
+    write_text_page(page, rng, lines=6)
+    columns = 5
+    for index in range(count):
+        width, height = rng.choice([(48, 48), (96, 64), (160, 90), (16, 16), (400, 12)])
+        # Una de cada tres imágenes repite una de las anteriores
+        seed = index // 3 if index % 3 == 2 else 1000 + index
+        pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, width, height), False)
+        pix.set_rect(pix.irect, tuple(random.Random(seed).randrange(256) for _ in range(3)))
+        x = 60 + (index % columns) * 100
+        y = 200 + (index // columns) * 90
+        page.insert_image(fitz.Rect(x, y, x + 90, y + 80), stream=pix.tobytes("png"), keep_proportion=True)
+
+def generate_corpus(directory, seed=0):
+    """Genera el corpus sintético de la suite; el resultado es idéntico para una misma semilla."""
+    os.makedirs(directory, exist_ok=True)
+    for name, (kind, pages, params) in SUITE_CORPUS.items():
+        rng = random.Random(f"{seed}:{name}")
+        doc = fitz.open()
+        for page_num in range(pages):
+            if kind == "scanned" or (kind == "mixed" and page_num % 2):
+                insert_scanned_page(doc, rng, params["dpi"])
+            elif kind == "images":
+                insert_images_page(doc, rng, params["images"])
+            else:
+                write_text_page(doc.new_page(), rng)
+        doc.set_metadata({"creationDate": "D:20240101000000", "modDate": "D:20240101000000"})
+        doc.save(os.path.join(directory, name), garbage=3, deflate=True, no_new_id=True)
+        doc.close()
+    return sorted(SUITE_CORPUS)
+
+def peak_rss_mb():
+    """Pico de memoria residente de este proceso y de sus hijos ya terminados, en MB."""
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux informa en KB y macOS en bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def run_suite_scenario(function, input_paths, output_dir, temp_dir, config):
+    """Ejecuta un escenario en un proceso limpio y devuelve (segundos, páginas, MB, bytes)."""
+    os.makedirs(output_dir, exist_ok=True)
+    pages = 0
+    for input_path in input_paths:
+        with fitz.open(input_path) as doc:
+            pages += len(doc)
+
+    start = time.perf_counter()
+    if function == "process_directory":
+        acces_pdf.process_directory(os.path.dirname(input_paths[0]), output_dir, temp_dir, config)
+    else:
+        for input_path in input_paths:
+            output_path = os.path.join(output_dir, os.path.basename(input_path))
+            if function == "process_scanned_pdf":
+                acces_pdf.process_scanned_pdf(input_path, output_path, config)
+            else:
+                import pdf_accesible
+                pdf_accesible.extract_and_make_accessible(input_path, output_path)
+    seconds = time.perf_counter() - start
+
+    output_bytes = sum(os.path.getsize(os.path.join(output_dir, f))
+                       for f in os.listdir(output_dir) if f.lower().endswith('.pdf'))
+    return seconds, pages, peak_rss_mb(), output_bytes
+
+def benchmark_suite(work_dir=None, repeat=1, config=None):
+    """Genera el corpus sintético y mide cada escenario con el motor OCR simulado.
+
+    Cada ejecución corre en un proceso nuevo para que el pico de memoria sea el del
+    escenario. Devuelve {escenario: {'pages_per_s', 'peak_rss_mb', 'output_bytes'}}.
+    """
+    work_dir = work_dir or tempfile.mkdtemp(prefix="suite_pdf_")
+    corpus_dir = os.path.join(work_dir, "corpus")
+    generate_corpus(corpus_dir)
+    config = dict({'language': 'spa', 'dpi': 300, 'ocr_backend': 'fake', 'ocr_cache': None,
+                   'compress_level': 1, 'image_layer': 'original', 'force': True}, **(config or {}))
+
+    results = {}
+    rows = []
+    context = multiprocessing.get_context("spawn")
+    for name, function, documents in SUITE_SCENARIOS:
+        documents = documents or sorted(SUITE_CORPUS)
+        input_paths = [os.path.join(corpus_dir, document) for document in documents]
+        runs = []
+        for run in range(repeat):
+            output_dir = os.path.join(work_dir, "salida", f"{name}_{run}")
+            temp_dir = os.path.join(work_dir, "temp", f"{name}_{run}")
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                runs.append(executor.submit(run_suite_scenario, function, input_paths,
+                                            output_dir, temp_dir, config).result())
+        # La ejecución más rápida es la menos afectada por el ruido del sistema
+        seconds, pages, rss, output_bytes = min(runs)
+        results[name] = {
+            'pages_per_s': round(pages / max(seconds, 1e-9), 3),
+            'peak_rss_mb': round(max(run[2] for run in runs), 1),
+            'output_bytes': output_bytes
+        }
+        rows.append([name, function, pages, f"{seconds:.2f}", f"{results[name]['pages_per_s']:.2f}",
+                     f"{results[name]['peak_rss_mb']:.1f}", output_bytes])
+
+    print(f"\nSuite sintética en {work_dir} (motor OCR: {config['ocr_backend']}, {repeat} repeticiones)")
+    print_table(["escenario", "función", "págs", "s", "págs/s", "pico MB", "bytes salida"], rows)
+    return results
+
+def check_regressions(results, baseline, tolerance=0.25, size_tolerance=0.05):
+    """Compara los resultados con una línea base y devuelve la lista de regresiones."""
+    regressions = []
+    for name, base in baseline.items():
+        current = results.get(name)
+        if current is None:
+            regressions.append(f"{name}: escenario ausente")
+            continue
+        if current['pages_per_s'] < base['pages_per_s'] * (1 - tolerance):
+            regressions.append(f"{name}: {current['pages_per_s']:.2f} págs/s frente a {base['pages_per_s']:.2f}")
+        if current['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f"{name}: pico de {current['peak_rss_mb']:.1f} MB frente a {base['peak_rss_mb']:.1f}")
+        if current['output_bytes'] > base['output_bytes'] * (1 + size_tolerance):
+            regressions.append(f"{name}: {current['output_bytes']} bytes frente a {base['output_bytes']}")
+    return regressions
+
+def main():
+    """Función principal."""
+    parser = argparse.ArgumentParser(description='Mediciones de rendimiento del procesamiento de PDFs.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ocr_parser = subparsers.add_parser('ocr', help='Compara los motores OCR')
+    ocr_parser.add_argument('pdf', help='PDF de prueba')
+    ocr_parser.add_argument('--backends', nargs='+', default=['subprocess', 'stdin', 'tesserocr'],
+                            choices=[b for b in acces_pdf.OCR_BACKENDS if b != 'auto'])
+    ocr_parser.add_argument('--language', default='spa', help='Idioma para OCR (códigos ISO 639-2)')
+    ocr_parser.add_argument('--dpi', type=int, default=300, help='Resolución DPI para OCR')
+    ocr_parser.add_argument('--pages', type=int, default=5, help='Número máximo de páginas a medir')
+    ocr_parser.add_argument('--repeat', type=int, default=1, help='Repeticiones de la medición')
+
+    layer_parser = subparsers.add_parser('image-layer', help='Compara los modos de capa de imagen')
+    layer_parser.add_argument('pdf', help='PDF escaneado de prueba')
+    layer_parser.add_argument('--dpi', type=int, default=300, help='Resolución DPI para OCR')
+    layer_parser.add_argument('--layer-dpi', type=int, default=150, help='Resolución de la capa en modo raster')
+    layer_parser.add_argument('--pages', type=int, default=5, help='Número máximo de páginas a medir')
+
+    classify_parser = subparsers.add_parser('classify', help='Compara el clasificador de páginas')
+    classify_parser.add_argument('paths', nargs='+', help='PDFs o directorios con PDFs')
+
+    compress_parser = subparsers.add_parser('compress', help='Compara los perfiles de compresión')
+    compress_parser.add_argument('paths', nargs='+', help='PDFs o directorios con PDFs')
+    compress_parser.add_argument('--compress', type=int, choices=[0, 1, 2, 3], default=1,
+                                 help='Nivel de compresión')
+    compress_parser.add_argument('--image-dpi', type=int, default=150,
+                                 help='Resolución objetivo de las imágenes en el perfil archival')
+
+    reportlab_parser = subparsers.add_parser('reportlab', help='Compara la transferencia de imágenes a ReportLab')
+    reportlab_parser.add_argument('paths', nargs='+', help='PDFs o directorios con PDFs')
+    reportlab_parser.add_argument('--repeat', type=int, default=1, help='Repeticiones de la medición')
+
+    parse_parser = subparsers.add_parser('parse', help='Compara los parsers de la salida TSV y hOCR de Tesseract')
+    parse_parser.add_argument('pdf', nargs='?', default=None, help='PDF de prueba (por defecto, páginas sintéticas)')
+    parse_parser.add_argument('--backend', default='fake', choices=[b for b in acces_pdf.OCR_BACKENDS if b != 'auto'],
+                              help='Motor OCR que produce la salida a analizar')
+    parse_parser.add_argument('--language', default='spa', help='Idioma para OCR (códigos ISO 639-2)')
+    parse_parser.add_argument('--dpi', type=int, default=300, help='Resolución DPI para OCR')
+    parse_parser.add_argument('--pages', type=int, default=5, help='Número máximo de páginas a medir')
+    parse_parser.add_argument('--repeat', type=int, default=3, help='Repeticiones de la medición')
+
+    preprocess_parser = subparsers.add_parser('preprocess', help='Mide el OCR con y sin preprocesado del ráster')
+    preprocess_parser.add_argument('pdf', help='PDF escaneado de prueba')
+    preprocess_parser.add_argument('--backend', default='stdin', choices=[b for b in acces_pdf.OCR_BACKENDS if b != 'auto'],
+                                   help='Motor OCR')
+    preprocess_parser.add_argument('--language', default='spa', help='Idioma para OCR (códigos ISO 639-2)')
+    preprocess_parser.add_argument('--dpi', type=int, default=300, help='Resolución DPI para OCR')
+    preprocess_parser.add_argument('--pages', type=int, default=5, help='Número máximo de páginas a medir')
+
+    dpi_parser = subparsers.add_parser('dpi', help='Compara la resolución fija del OCR con la adaptativa por página')
+    dpi_parser.add_argument('pdf', help='PDF escaneado de prueba')
+    dpi_parser.add_argument('--backend', default='stdin', choices=[b for b in acces_pdf.OCR_BACKENDS if b != 'auto'],
+                            help='Motor OCR')
+    dpi_parser.add_argument('--language', default='spa', help='Idioma para OCR (códigos ISO 639-2)')
+    dpi_parser.add_argument('--dpi', type=int, default=300, help='Resolución DPI fija')
+    dpi_parser.add_argument('--min-dpi', type=int, default=150, help='Resolución mínima adaptativa')
+    dpi_parser.add_argument('--max-dpi', type=int, default=400, help='Resolución máxima adaptativa')
+    dpi_parser.add_argument('--pages', type=int, default=5, help='Número máximo de páginas a medir')
+
+    suite_parser = subparsers.add_parser('suite', help='Suite sintética con OCR simulado y control de regresiones')
+    suite_parser.add_argument('--work-dir', help='Directorio para el corpus y las salidas (temporal por defecto)')
+    suite_parser.add_argument('--repeat', type=int, default=1, help='Repeticiones de cada escenario')
+    suite_parser.add_argument('--ocr-backend', default='fake', choices=acces_pdf.OCR_BACKENDS,
+                              help='Motor OCR (el simulado no necesita Tesseract)')
+    suite_parser.add_argument('--baseline', help='Línea base JSON con la que comparar')
+    suite_parser.add_argument('--save-baseline', help='Guardar los resultados como línea base JSON')
+    suite_parser.add_argument('--tolerance', type=float, default=0.25,
+                              help='Pérdida tolerada de páginas/s y aumento tolerado de memoria')
+    suite_parser.add_argument('--size-tolerance', type=float, default=0.05,
+                              help='Aumento tolerado del tamaño de salida')
+
+    args = parser.parse_args()
+
+    if args.command == 'ocr':
+        benchmark_ocr(args.pdf, args.backends, args.language, args.dpi, args.pages, args.repeat)
+    elif args.command == 'image-layer':
+        benchmark_image_layer(args.pdf, args.dpi, args.layer_dpi, args.pages)
+    elif args.command == 'classify':
+        benchmark_classify(collect_pdfs(args.paths))
+    elif args.command == 'compress':
+        benchmark_compress(collect_pdfs(args.paths), args.compress, args.image_dpi)
+    elif args.command == 'reportlab':
+        benchmark_reportlab(collect_pdfs(args.paths), args.repeat)
+    elif args.command == 'parse':
+        benchmark_parse(args.pdf, args.backend, args.language, args.dpi, args.pages, args.repeat)
+    elif args.command == 'preprocess':
+        benchmark_preprocess(args.pdf, args.backend, args.language, args.dpi, args.pages)
+    elif args.command == 'dpi':
+        benchmark_adaptive_dpi(args.pdf, args.backend, args.language, args.dpi, (args.min_dpi, args.max_dpi),
+                               args.pages)
+    elif args.command == 'suite':
+        work_dir = args.work_dir or tempfile.mkdtemp(prefix="suite_pdf_")
+        results = benchmark_suite(work_dir, args.repeat, {'ocr_backend': args.ocr_backend})
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        if args.save_baseline:
+            with open(args.save_baseline, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2, ensure_ascii=False)
+            print(f"Línea base guardada en {args.save_baseline}")
+        if args.baseline:
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+            regressions = check_regressions(results, baseline, args.tolerance, args.size_tolerance)
+            if regressions:
+                print("\nRegresiones respecto a la línea base:")
+                for regression in regressions:
+                    print(f"  - {regression}")
+                sys.exit(1)
+            print("\nSin regresiones respecto a la línea base.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,518 @@
+import os
+import json
+import time
+import uuid
+import heapq
+import asyncio
+import logging
+import argparse
+import itertools
+import multiprocessing
+from urllib.parse import urlsplit, parse_qs
+
+import acces_pdf
+
+# Prioridades de las colas: los trabajos interactivos adelantan a las cargas masivas
+PRIORITIES = {'interactiva': 0, 'masiva': 1}
+
+# Estados de un trabajo
+STATUS_QUEUED = "en_cola"
+STATUS_RUNNING = "procesando"
+STATUS_DONE = "completado"
+STATUS_FAILED = "error"
+
+HTTP_REASONS = {
+    200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found",
+    405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large",
+    503: "Service Unavailable"
+}
+
+class Job:
+    """Un documento enviado al servicio, con su progreso por páginas."""
+
+    def __init__(self, job_id, input_path, output_path, priority, uploaded=False):
+        self.id = job_id
+        self.input_path = input_path
+        self.output_path = output_path
+        self.priority = priority
+        self.uploaded = uploaded  # La entrada es una subida del servicio (se borra con el trabajo)
+        self.status = STATUS_QUEUED
+        self.pages = 0
+        self.pages_done = 0
+        self.page_kinds = None
+        self.ocr_results = {}
+        self.pending = 0
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.events = []
+        self.changed = asyncio.Event()
+
+    def emit(self, event, **data):
+        """Registra un evento de progreso y despierta a quien esté siguiéndolo."""
+        self.events.append(dict(data, evento=event, trabajo=self.id, tiempo=round(time.time(), 3)))
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def summary(self):
+        """Estado del trabajo para las respuestas JSON."""
+        return {
+            'id': self.id,
+            'estado': self.status,
+            'prioridad': self.priority,
+            'paginas': self.pages,
+            'paginas_hechas': self.pages_done,
+            'error': self.error,
+            'segundos': round((self.finished or time.time()) - self.created, 3)
+        }
+
+class AccessibilityService:
+    """Servicio asíncrono que reparte los documentos recibidos en el pool de workers OCR.
+
+    El pool (ver acces_pdf.OCRWorkerPool) se crea una vez al arrancar y se mantiene
+    caliente entre peticiones. Cada documento se planifica como en process_directory:
+    rangos de OCR de sus páginas escaneadas y después su ensamblado. Las tareas esperan
+    en un montículo ordenado por prioridad del trabajo y solo se envían al pool mientras
+    haya hueco, de modo que un trabajo interactivo pasa por delante de las tareas de
+    una carga masiva que aún no han empezado. Con la cola llena, el servicio rechaza
+    nuevos trabajos (503) en lugar de acumularlos. Los trabajos terminados se olvidan,
+    borrando su subida y su resultado, pasados job_ttl segundos o cuando hay más de
+    max_finished.
+    """
+
+    def __init__(self, config, workdir, max_workers=None, max_jobs=100, job_ttl=3600, max_finished=1000):
+        self.config = config
+        self.input_dir = os.path.join(workdir, 'entrada')
+        self.output_dir = os.path.join(workdir, 'salida')
+        os.makedirs(self.input_dir, exist_ok=True)
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.max_workers = max_workers or max(1, multiprocessing.cpu_count() - 1)
+        # Sin tareas esperando dentro del pool: la prioridad decide en cuanto queda un worker libre
+        self.max_in_flight = self.max_workers
+        self.max_jobs = max_jobs
+        self.job_ttl = job_ttl
+        self.max_finished = max_finished
+        self.jobs = {}
+        self.active = 0
+        self.tasks = []
+        self.counter = itertools.count()
+        self.in_flight = 0
+        self.wakeup = asyncio.Event()
+        self.pool = acces_pdf.OCRWorkerPool(config, max_workers=self.max_workers,
+                                            max_pages=config.get('worker_max_pages', 200),
+                                            page_timeout=config.get('page_timeout', 120))
+        self.dispatcher = None
+
+    def start(self):
+        """Arranca el reparto de tareas al pool."""
+        self.dispatcher = asyncio.get_running_loop().create_task(self._dispatch_loop())
+
+    def close(self):
+        """Detiene el reparto y cierra el pool."""
+        if self.dispatcher is not None:
+            self.dispatcher.cancel()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, input_path, priority='masiva', job_id=None, uploaded=False):
+        """Admite un documento y planifica sus tareas; devuelve el trabajo o None si no hay hueco."""
+        self.evict_finished()
+        if self.active >= self.max_jobs:
+            return None
+        job_id = job_id or uuid.uuid4().hex
+        output_path = os.path.join(self.output_dir, f"{job_id}.pdf")
+        job = Job(job_id, input_path, output_path, priority, uploaded)
+        self.jobs[job_id] = job
+        self.active += 1
+        job.emit("recibido", prioridad=priority)
+        asyncio.get_running_loop().create_task(self._plan(job))
+        return job
+
+    def evict_finished(self):
+        """Olvida los trabajos terminados caducados o que exceden max_finished y borra sus archivos."""
+        now = time.time()
+        finished = sorted((job for job in self.jobs.values() if job.finished is not None),
+                          key=lambda job: job.finished)
+        excess = len(finished) - self.max_finished
+        for index, job in enumerate(finished):
+            if index >= excess and now - job.finished <= self.job_ttl:
+                # El resto terminó después: tampoco ha caducado
+                break
+            del self.jobs[job.id]
+            paths = [job.output_path, job.input_path] if job.uploaded else [job.output_path]
+            for path in paths:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logging.warning(f"No se pudo borrar {path} del trabajo {job.id}: {str(e)}")
+
+    async def _plan(self, job):
+        """Clasifica las páginas fuera del bucle de eventos y encola las tareas del trabajo."""
+        plan = await asyncio.to_thread(acces_pdf.plan_document, job.input_path, job.output_path, self.config)
+        job.pages = plan['pages']
+        job.page_kinds = plan['page_kinds']
+        job.pending = len(plan['chunks'])
+        job.pages_done = job.pages - sum(len(chunk) for chunk in plan['chunks'])
+        job.emit("planificado", paginas=job.pages, paginas_ocr=job.pages - job.pages_done)
+        if plan['chunks']:
+            for page_numbers in plan['chunks']:
+                self._push(job, 'ocr', page_numbers)
+        else:
+            self._push(job, 'document')
+
+    def _push(self, job, kind, page_numbers=None, first=False):
+        """Añade una tarea al montículo; el ensamblado va antes que el OCR de su prioridad."""
+        order = 0 if first or kind == 'document' else 1
+        heapq.heappush(self.tasks, (PRIORITIES[job.priority], order, next(self.counter), job, kind, page_numbers))
+        self.wakeup.set()
+
+    async def _dispatch_loop(self):
+        """Envía tareas al pool por orden de prioridad mientras haya hueco."""
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.tasks and self.in_flight < self.max_in_flight:
+                _, _, _, job, kind, page_numbers = heapq.heappop(self.tasks)
+                if job.status == STATUS_QUEUED:
+                    job.status = STATUS_RUNNING
+                    job.emit("iniciado")
+                if kind == 'ocr':
+                    future = self.pool.submit_pages(len(page_numbers), acces_pdf.ocr_pages,
+                                                    job.input_path, page_numbers, self.config)
+                else:
+                    future = self.pool.submit_pages(0, acces_pdf.process_single_pdf, (
+                        job.input_path, job.output_path, self.config, job.ocr_results, job.page_kinds))
+                    job.ocr_results = {}
+                self.in_flight += 1
+                asyncio.get_running_loop().create_task(self._complete(job, kind, page_numbers, future))
+
+    async def _complete(self, job, kind, page_numbers, future):
+        """Recoge el resultado de una tarea y encadena la siguiente del trabajo."""
+        try:
+            result = await asyncio.wrap_future(future)
+            error = None
+        except Exception as e:
+            result = None
+            error = e
+        finally:
+            self.in_flight -= 1
+            self.wakeup.set()
+
+        if kind == 'ocr':
+            if error is None:
+                job.ocr_results.update(result)
+                job.pages_done += len(page_numbers)
+                job.emit("paginas", paginas=[n + 1 for n in page_numbers],
+                         hechas=job.pages_done, total=job.pages)
+            elif len(page_numbers) > 1:
+                # Reintentar página a página para aislar la página problemática
+                logging.warning(f"Reintentando OCR de {job.input_path} página a página: {str(error)}")
+                for page_num in page_numbers:
+                    self._push(job, 'ocr', [page_num], first=True)
+                job.pending += len(page_numbers)
+            else:
+                job.pages_done += 1
+                job.emit("pagina_fallida", pagina=page_numbers[0] + 1, error=str(error))
+            job.pending -= 1
+            if job.pending == 0:
+                self._push(job, 'document')
+            return
+
+        self.active -= 1
+        job.finished = time.time()
+        self.evict_finished()
+        if error is None and result and result[0]:
+            job.status = STATUS_DONE
+            job.pages_done = job.pages
+            job.emit("completado", segundos=round(job.finished - job.created, 3))
+        else:
+            job.status = STATUS_FAILED
+            job.error = str(error) if error is not None else "El procesamiento del documento falló"
+            job.emit("error", error=job.error)
+
+    def status(self):
+        """Estado global del servicio."""
+        self.evict_finished()
+        queued = {name: 0 for name in PRIORITIES}
+        for job in self.jobs.values():
+            if job.status in (STATUS_QUEUED, STATUS_RUNNING):
+                queued[job.priority] += 1
+        return {
+            'workers': self.max_workers,
+            'tareas_en_cola': len(self.tasks),
+            'tareas_en_curso': self.in_flight,
+            'trabajos_activos': queued,
+            'capacidad': self.max_jobs,
+            'memoria_workers_mb': self.pool.memory_usage() // (1024 * 1024)
+        }
+
+class HTTPError(Exception):
+    """Error que se devuelve al cliente con su código HTTP."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def read_file(path):
+    """Lee un archivo entero (se ejecuta fuera del bucle de eventos)."""
+    with open(path, 'rb') as f:
+        return f.read()
+
+def write_file(path, data):
+    """Escribe un archivo entero (se ejecuta fuera del bucle de eventos)."""
+    with open(path, 'wb') as f:
+        f.write(data)
+
+async def read_request(reader, max_body):
+    """Lee una petición HTTP/1.1 y devuelve (método, ruta, consulta, cabeceras, cuerpo)."""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, target, _ = request_line.decode('latin-1').split(' ', 2)
+    except ValueError:
+        raise HTTPError(400, "Línea de petición no válida")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get('content-length', 0) or 0)
+    if length > max_body:
+        raise HTTPError(413, f"El cuerpo supera el máximo de {max_body} bytes")
+    body = await reader.readexactly(length) if length else b''
+    url = urlsplit(target)
+    return method.upper(), url.path.rstrip('/') or '/', parse_qs(url.query), headers, body
+
+async def send_response(writer, status, body=b'', content_type='application/json', extra_headers=None):
+    """Escribe una respuesta HTTP completa."""
+    if isinstance(body, (dict, list)):
+        body = json.dumps(body, ensure_ascii=False).encode('utf-8')
+    headers = [f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}",
+               f"Content-Type: {content_type}",
+               f"Content-Length: {len(body)}"]
+    for name, value in (extra_headers or {}).items():
+        headers.append(f"{name}: {value}")
+    writer.write(("\r\n".join(headers) + "\r\n\r\n").encode('latin-1') + body)
+    await writer.drain()
+
+async def stream_progress(writer, job):
+    """Envía los eventos del trabajo como NDJSON por chunks hasta que termina."""
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+                 b"Transfer-Encoding: chunked\r\nCache-Control: no-cache\r\n\r\n")
+    sent = 0
+    while True:
+        changed = job.changed
+        for event in job.events[sent:]:
+            line = json.dumps(event, ensure_ascii=False).encode('utf-8') + b"\n"
+            writer.write(f"{len(line):x}\r\n".encode('latin-1') + line + b"\r\n")
+        sent = len(job.events)
+        await writer.drain()
+        if job.status in (STATUS_DONE, STATUS_FAILED):
+            break
+        await changed.wait()
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+class AccessibilityHTTPServer:
+    """API HTTP local del servicio.
+
+    POST /trabajos                 sube un PDF (application/pdf) o indica {"ruta": ...} en JSON;
+                                   prioridad con ?prioridad=interactiva|masiva
+    GET  /trabajos/<id>            estado del trabajo
+    GET  /trabajos/<id>/progreso   eventos de progreso por página (NDJSON en streaming)
+    GET  /trabajos/<id>/resultado  PDF accesible generado
+    GET  /estado                   colas, tareas en curso y memoria de los workers
+    """
+
+    def __init__(self, service, max_upload=200 * 1024 * 1024):
+        self.service = service
+        self.max_upload = max_upload
+
+    async def handle(self, reader, writer):
+        """Atiende las peticiones de una conexión."""
+        try:
+            while True:
+                try:
+                    request = await read_request(reader, self.max_upload)
+                    if request is None:
+                        break
+                    keep_alive = await self.route(writer, *request)
+                except HTTPError as e:
+                    await send_response(writer, e.status, {'error': str(e)})
+                    keep_alive = False
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logging.error(f"Error atendiendo petición: {str(e)}")
+        finally:
+            writer.close()
+
+    async def route(self, writer, method, path, query, headers, body):
+        """Despacha una petición; devuelve si la conexión puede reutilizarse."""
+        parts = path.strip('/').split('/')
+        if path == '/estado' and method == 'GET':
+            await send_response(writer, 200, self.service.status())
+            return True
+
+        if parts[0] != 'trabajos':
+            raise HTTPError(404, "Ruta no encontrada")
+
+        if len(parts) == 1:
+            if method != 'POST':
+                raise HTTPError(405, "Usa POST para enviar trabajos")
+            job = await self.create_job(query, headers, body)
+            await send_response(writer, 202, job.summary(),
+                                extra_headers={'Location': f"/trabajos/{job.id}"})
+            return True
+
+        job = self.service.jobs.get(parts[1])
+        if job is None:
+            raise HTTPError(404, "Trabajo no encontrado")
+        if method != 'GET':
+            raise HTTPError(405, "Método no permitido")
+
+        if len(parts) == 2:
+            await send_response(writer, 200, job.summary())
+            return True
+        if parts[2] == 'progreso':
+            await stream_progress(writer, job)
+            return False
+        if parts[2] == 'resultado':
+            if job.status != STATUS_DONE:
+                raise HTTPError(409, f"El trabajo está en estado '{job.status}'")
+            # Los PDF grandes se leen en un hilo para no bloquear al resto de conexiones
+            try:
+                data = await asyncio.to_thread(read_file, job.output_path)
+            except FileNotFoundError:
+                raise HTTPError(404, "El resultado ya no está disponible")
+            await send_response(writer, 200, data, 'application/pdf')
+            return True
+        raise HTTPError(404, "Ruta no encontrada")
+
+    async def create_job(self, query, headers, body):
+        """Guarda la subida o valida la ruta indicada y admite el trabajo."""
+        content_type = headers.get('content-type', '').split(';')[0].strip()
+        priority = query.get('prioridad', ['masiva'])[0]
+        job_id = uuid.uuid4().hex
+
+        if content_type == 'application/json':
+            try:
+                request = json.loads(body or b'{}')
+            except ValueError:
+                raise HTTPError(400, "JSON no válido")
+            priority = request.get('prioridad', priority)
+            input_path = request.get('ruta')
+            if not input_path or not os.path.isfile(input_path):
+                raise HTTPError(400, "Indica en 'ruta' un PDF existente")
+        elif content_type == 'application/pdf':
+            if not body.startswith(b'%PDF'):
+                raise HTTPError(400, "El cuerpo no es un PDF")
+            input_path = os.path.join(self.service.input_dir, f"{job_id}.pdf")
+        else:
+            raise HTTPError(400, "Envía application/pdf o application/json")
+
+        if priority not in PRIORITIES:
+            raise HTTPError(400, f"Prioridad desconocida: {priority}")
+        self.service.evict_finished()
+        if self.service.active >= self.service.max_jobs:
+            # Contrapresión antes de escribir nada: el cliente debe reintentar más tarde
+            raise HTTPError(503, "Cola llena; reintenta más tarde")
+
+        uploaded = content_type == 'application/pdf'
+        if uploaded:
+            # La subida se escribe en un hilo para no bloquear al resto de conexiones
+            await asyncio.to_thread(write_file, input_path, body)
+        # Mientras se escribía pudo llenarse la cola: submit vuelve a comprobarlo
+        job = self.service.submit(input_path, priority, job_id, uploaded)
+        if job is None:
+            if uploaded:
+                await asyncio.to_thread(os.unlink, input_path)
+            raise HTTPError(503, "Cola llena; reintenta más tarde")
+        logging.info(f"Trabajo {job.id} admitido ({priority}): {input_path}")
+        return job
+
+async def serve(config, args):
+    """Arranca el pool, el reparto de tareas y el servidor HTTP."""
+    service = AccessibilityService(config, args.workdir, args.workers, args.max_jobs,
+                                   args.job_ttl * 60, args.max_finished)
+    service.start()
+    http = AccessibilityHTTPServer(service, args.max_upload * 1024 * 1024)
+    server = await asyncio.start_server(http.handle, args.host, args.port)
+    print(f"Servicio de accesibilidad escuchando en http://{args.host}:{args.port} "
+          f"({service.max_workers} workers)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+def main():
+    """Función principal."""
+    parser = argparse.ArgumentParser(description='Servicio HTTP local para hacer accesibles PDFs.')
+    parser.add_argument('--host', default='127.0.0.1', help='Dirección en la que escuchar')
+    parser.add_argument('--port', type=int, default=8080, help='Puerto en el que escuchar')
+    parser.add_argument('--workdir', default='servicio_pdf', help='Directorio de subidas y resultados')
+    parser.add_argument('--workers', type=int, default=None, help='Número de workers OCR')
+    parser.add_argument('--max-jobs', type=int, default=100,
+                        help='Trabajos admitidos a la vez antes de responder 503')
+    parser.add_argument('--max-upload', type=int, default=200, help='Tamaño máximo de subida en MB')
+    parser.add_argument('--job-ttl', type=int, default=60,
+                        help='Minutos que se conservan un trabajo terminado y sus archivos')
+    parser.add_argument('--max-finished', type=int, default=1000,
+                        help='Trabajos terminados que se conservan como máximo')
+    parser.add_argument('--language', default='spa', help='Idioma para OCR (códigos ISO 639-2)')
+    parser.add_argument('--dpi', type=int, default=300, help='Resolución DPI para OCR')
+    parser.add_argument('--adaptive-dpi', action='store_true',
+                        help='Elegir la resolución del OCR por página según la imagen escaneada')
+    parser.add_argument('--min-dpi', type=int, default=150, help='Resolución mínima del OCR adaptativo')
+    parser.add_argument('--max-dpi', type=int, default=400, help='Resolución máxima del OCR adaptativo')
+    parser.add_argument('--ocr-backend', choices=acces_pdf.OCR_BACKENDS, default='auto', help='Motor OCR')
+    parser.add_argument('--ocr-cache', default='ocr_cache', help='Directorio de la caché OCR')
+    parser.add_argument('--profile', choices=list(acces_pdf.COMPRESSION_PROFILES), default='balanced',
+                        help='Perfil de compresión')
+    parser.add_argument('--preprocess', action='store_true',
+                        help='Binarizar, enderezar y recortar el ráster antes del OCR')
+    parser.add_argument('--pages-per-task', type=int, default=4,
+                        help='Páginas escaneadas por tarea de OCR (menos = progreso más fino)')
+    args = parser.parse_args()
+
+    # El motor simulado no lanza Tesseract
+    if args.ocr_backend != 'fake' and not acces_pdf.check_tesseract_installed():
+        print("Tesseract OCR no está instalado.")
+        return
+
+    config = {
+        'language': args.language,
+        'dpi': args.dpi,
+        'adaptive_dpi': args.adaptive_dpi,
+        'min_dpi': args.min_dpi,
+        'max_dpi': args.max_dpi,
+        'ocr_backend': acces_pdf.resolve_ocr_backend(args.ocr_backend),
+        'ocr_cache': args.ocr_cache,
+        'ocr_cache_size': 1024,
+        'compress_level': 1,
+        'image_layer': 'original',
+        'layer_dpi': 150,
+        'profile': args.profile,
+        'tagging_backend': acces_pdf.resolve_tagging_backend('auto').name,
+        'pages_per_task': args.pages_per_task,
+        'preprocess': args.preprocess,
+        'image_index': os.path.join(args.workdir, acces_pdf.IMAGE_INDEX_NAME)
+    }
+    os.makedirs(args.workdir, exist_ok=True)
+
+    try:
+        asyncio.run(serve(config, args))
+    except KeyboardInterrupt:
+        print("\nServicio detenido.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import fitz  # PyMuPDF
+
+import acces_pdf
+import verificador_pdfua
+
+# Salida TSV de Tesseract con dos párrafos (coordenadas a 300 DPI)
+TSV = "\n".join([
+    "level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext",
+    "5\t1\t1\t1\t1\t1\t300\t300\t400\t60\t95.0\tHola",
+    "5\t1\t1\t1\t1\t2\t750\t300\t500\t60\t93.0\tmundo",
+    "5\t1\t2\t1\t1\t1\t300\t900\t600\t60\t91.0\tsegundo",
+    "5\t1\t2\t1\t1\t2\t950\t900\t500\t60\t90.0\tpárrafo",
+])
+
+def tag_scanned_page():
+    """Documento de una página escaneada con su capa de texto OCR y la estructura del etiquetador xref."""
+    doc = fitz.open()
+    page = doc.new_page()
+    pix = fitz.Pixmap(fitz.csGRAY, fitz.IRect(0, 0, 200, 260), False)
+    pix.set_rect(pix.irect, (255,))
+    page.insert_image(page.rect, pixmap=pix)
+
+    tagger = acces_pdf.XrefStructureTagger()
+    tagger.begin(doc, "spa")
+    text, layout = acces_pdf.parse_tesseract_tsv(TSV, scale=300 / 72)
+    blocks = acces_pdf.build_ocr_blocks(layout)
+    assert acces_pdf.create_structure_tree(tagger, doc, page, text, blocks)
+    marked = acces_pdf.insert_ocr_text_layer(page, layout, blocks)
+    acces_pdf.commit_structure(tagger, doc, page, marked)
+    acces_pdf.finish_tagging(tagger, doc)
+    return doc, marked
+
+def test_text_layer_marked_per_block():
+    doc, marked = tag_scanned_page()
+    assert marked
+    failures = verificador_pdfua.check_document(doc)
+    assert not failures['parent_tree']
+    assert not failures['untagged_content']
+    mcids, _ = verificador_pdfua.scan_content(doc[0].read_contents())
+    assert mcids == {0, 1}
+
+def test_text_layer_marking_failure_tags_whole_page(monkeypatch):
+    monkeypatch.setattr(acces_pdf, "mark_text_layer", lambda content, marks: None)
+    doc, marked = tag_scanned_page()
+    assert not marked
+    failures = verificador_pdfua.check_document(doc)
+    # Sin elementos para MCID que no están en el contenido: la página entera va en un Div
+    assert not failures['parent_tree']
+    assert not failures['untagged_content']
+    mcids, _ = verificador_pdfua.scan_content(doc[0].read_contents())
+    assert mcids == {0}
+    root = int(doc.xref_get_key(doc.pdf_catalog(), "StructTreeRoot")[1].split()[0])
+    parent_tree = int(doc.xref_get_key(root, "ParentTree")[1].split()[0])
+    entries = acces_pdf.parent_tree_entries(doc, parent_tree)
+    assert len(entries) == 1 and len(entries[0]) == 1
+    assert "Hola" in doc[0].get_text()
+
+def test_figure_marked_without_layout_plan():
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 72), "Texto de la página")
+    pix = fitz.Pixmap(fitz.csGRAY, fitz.IRect(0, 0, 100, 80), False)
+    pix.set_rect(pix.irect, (128,))
+    page.insert_image(fitz.Rect(72, 100, 272, 260), pixmap=pix)
+
+    tagger = acces_pdf.XrefStructureTagger()
+    tagger.begin(doc, "spa")
+    acces_pdf.tag_native_page(tagger, doc, page, 0, {}, {})
+    acces_pdf.finish_tagging(tagger, doc)
+    failures = verificador_pdfua.check_document(doc)
+    assert not failures['parent_tree']
+    assert not failures['untagged_content']
+    assert not failures['figure_alt']
+    # La figura es el contenido marcado de la imagen, no un elemento vacío
+    figures = [xref for xref in range(1, doc.xref_length())
+               if doc.xref_get_key(xref, "S") == ("name", "/Figure")]
+    assert len(figures) == 1
+    assert doc.xref_get_key(figures[0], "K")[0] == "int"
+    assert doc.xref_get_key(figures[0], "Alt")[1] == "Imagen 1"
@@ -0,0 +1,247 @@
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import contextlib
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import fitz  # PyMuPDF
+
+import acces_pdf
+
+# Versión de las reglas: al cambiarla se invalidan los resultados guardados en la caché
+CHECKER_VERSION = 2
+
+# Nombre de la caché de resultados dentro del directorio verificado
+CACHE_NAME = '.verificacion_pdfua.sqlite'
+
+# Comprobaciones, con los puntos de control de Matterhorn (PDF/UA-1) a los que corresponden
+CHECKS = {
+    'tagged': "Documento marcado como etiquetado (/MarkInfo /Marked true y StructTreeRoot)",
+    'language': "Idioma del documento en /Lang (11-006)",
+    'title': "Título en los metadatos y mostrado por el visor (06-003, 07-001, 07-002)",
+    'figure_alt': "Figuras con texto alternativo (13-004)",
+    'untagged_content': "Contenido ni etiquetado ni marcado como artefacto (01-005)",
+    'parent_tree': "ParentTree coherente con los MCID del contenido",
+}
+
+# Tokenizador de contenido compartido con el marcado de acces_pdf
+CONTENT_TOKEN = acces_pdf.CONTENT_TOKEN
+INLINE_IMAGE_END = acces_pdf.INLINE_IMAGE_END
+NUMBER = acces_pdf.NUMBER
+PAINT_OPERATORS = acces_pdf.PAINT_OPERATORS
+
+def scan_content(content):
+    """Recorre un stream de contenido una sola vez.
+
+    Devuelve (MCID usados, operadores de pintado fuera de contenido marcado). Se
+    considera marcado lo que está dentro de una secuencia con MCID, de un artefacto
+    o de una lista de propiedades con nombre (no se resuelve el recurso).
+    """
+    mcids = set()
+    untagged = 0
+    stack = []
+    operands = []
+    pos = 0
+    length = len(content)
+    while pos < length:
+        match = CONTENT_TOKEN.search(content, pos)
+        if match is None:
+            break
+        token = match.group()
+        pos = match.end()
+        first = token[:1]
+        if first in b"(<[]/%" or NUMBER.match(token) or token in (b"true", b"false", b"null", b">>"):
+            operands.append(token)
+            continue
+
+        # Operador
+        if token == b"BDC":
+            tag = operands[0] if operands else b""
+            properties = b" ".join(operands[1:])
+            mcid = re.search(rb"/MCID\s+(\d+)", properties)
+            if mcid:
+                mcids.add(int(mcid.group(1)))
+            covered = (bool(mcid) or tag == b"/Artifact"
+                       or (len(operands) == 2 and operands[1].startswith(b"/")))
+            stack.append(covered or (bool(stack) and stack[-1]))
+        elif token == b"BMC":
+            tag = operands[0] if operands else b""
+            stack.append(tag == b"/Artifact" or (bool(stack) and stack[-1]))
+        elif token == b"EMC":
+            if stack:
+                stack.pop()
+        elif token in PAINT_OPERATORS:
+            if not (stack and stack[-1]):
+                untagged += 1
+        if token == b"ID":
+            # Datos binarios de una imagen en línea: saltar hasta EI
+            end = INLINE_IMAGE_END.search(content, pos)
+            pos = end.end() if end else length
+        operands = []
+    return mcids, untagged
+
+def check_document(doc):
+    """Evalúa las comprobaciones de CHECKS sobre un documento abierto.
+
+    Las estructurales (etiquetado, idioma, ParentTree y figuras) son las de
+    acces_pdf.structure_checks, con los MCID del mismo recorrido del contenido que
+    cuenta lo que queda sin etiquetar. Devuelve {comprobación: lista de fallos}; una
+    lista vacía indica que se cumple.
+    """
+    scans = [scan_content(page.read_contents()) for page in doc]
+    failures = {check: [] for check in CHECKS}
+    failures.update(acces_pdf.structure_checks(doc, [mcids for mcids, _ in scans]))
+    failures['figure_alt'] = failures['figure_alt'][:20]
+
+    catalog = doc.pdf_catalog()
+    if not (doc.metadata or {}).get('title', '').strip():
+        failures['title'].append("Sin título en los metadatos")
+    if doc.xref_get_key(catalog, "ViewerPreferences/DisplayDocTitle")[1] != "true":
+        failures['title'].append("/ViewerPreferences sin /DisplayDocTitle true")
+
+    for number, (_, untagged) in enumerate(scans):
+        if untagged:
+            failures['untagged_content'].append(f"Página {number+1}: {untagged} operaciones sin etiquetar")
+    return failures
+
+def file_hash(path):
+    """Hash SHA-256 del contenido de un archivo."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def check_file(path):
+    """Verifica un PDF y devuelve su resultado (usada en los workers)."""
+    start = time.perf_counter()
+    result = {'file': path, 'passed': False, 'failures': {}, 'error': None}
+    try:
+        doc = fitz.open(path)
+        try:
+            failures = check_document(doc)
+        finally:
+            doc.close()
+        result['failures'] = {check: problems for check, problems in failures.items() if problems}
+        result['passed'] = not result['failures']
+    except Exception as e:
+        result['error'] = str(e)
+    result['seconds'] = round(time.perf_counter() - start, 4)
+    return result
+
+class ResultCache:
+    """Resultados de verificación direccionados por el hash del archivo y la versión de las reglas."""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT)")
+
+    @staticmethod
+    def make_key(content_hash):
+        return f"{CHECKER_VERSION}:{content_hash}"
+
+    def get(self, content_hash):
+        """Devuelve el resultado guardado para un contenido, o None."""
+        row = self.conn.execute("SELECT value FROM results WHERE key = ?",
+                                (self.make_key(content_hash),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, content_hash, result):
+        """Guarda el resultado de un contenido."""
+        self.conn.execute("INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)",
+                          (self.make_key(content_hash), json.dumps(result, ensure_ascii=False)))
+
+    def close(self):
+        self.conn.close()
+
+def check_files(paths, cache_path=None, max_workers=None):
+    """Verifica una lista de PDFs en paralelo, reutilizando los resultados en caché.
+
+    Un archivo cuyo contenido ya se verificó con la misma versión de las reglas no se
+    vuelve a abrir. Devuelve la lista de resultados en el orden de paths.
+    """
+    cache = ResultCache(cache_path) if cache_path else None
+    results = {}
+    pending = {}
+    try:
+        for path in paths:
+            content_hash = file_hash(path)
+            cached = cache.get(content_hash) if cache else None
+            if cached is not None:
+                results[path] = dict(cached, file=path, cached=True)
+            else:
+                pending[path] = content_hash
+
+        if pending:
+            max_workers = max_workers or max(1, min(len(pending), multiprocessing.cpu_count() - 1))
+            with contextlib.ExitStack() as stack:
+                if max_workers == 1:
+                    checked = map(check_file, pending)
+                else:
+                    # El with cierra los workers aunque falle un resultado o la caché
+                    executor = stack.enter_context(ProcessPoolExecutor(max_workers=max_workers))
+                    checked = executor.map(check_file, pending, chunksize=4)
+                for result in checked:
+                    result['cached'] = False
+                    results[result['file']] = result
+                    if cache and result['error'] is None:
+                        cache.put(pending[result['file']], result)
+    finally:
+        if cache:
+            cache.close()
+    return [results[path] for path in paths]
+
+def check_directory(directory, max_workers=None, use_cache=True):
+    """Verifica todos los PDFs de un directorio, con la caché guardada en el propio directorio."""
+    paths = sorted(os.path.join(directory, f) for f in os.listdir(directory) if f.lower().endswith('.pdf'))
+    cache_path = os.path.join(directory, CACHE_NAME) if use_cache else None
+    return check_files(paths, cache_path, max_workers)
+
+def print_results(results):
+    """Imprime un resumen por documento y las comprobaciones que fallan."""
+    for result in results:
+        status = "OK" if result['passed'] else "FALLA"
+        cached = " (caché)" if result.get('cached') else ""
+        print(f"{status:6} {os.path.basename(result['file'])}{cached}")
+        if result['error']:
+            print(f"       Error: {result['error']}")
+        for check, problems in result['failures'].items():
+            print(f"       {CHECKS[check]}:")
+            for problem in problems[:5]:
+                print(f"         - {problem}")
+            if len(problems) > 5:
+                print(f"         ... y {len(problems) - 5} más")
+    passed = sum(1 for result in results if result['passed'])
+    print(f"\nDocumentos que superan la verificación PDF/UA: {passed} de {len(results)}")
+
+def main():
+    """Función principal."""
+    parser = argparse.ArgumentParser(
+        description='Verificación PDF/UA (puntos de control de Matterhorn) de PDFs accesibles.')
+    parser.add_argument('paths', nargs='+', help='PDFs o directorios con PDFs')
+    parser.add_argument('--workers', type=int, default=None, help='Número de procesos (por defecto, núcleos - 1)')
+    parser.add_argument('--no-cache', action='store_true', help='No usar la caché de resultados')
+    parser.add_argument('--json', default=None, help='Guardar los resultados en un archivo JSON')
+    args = parser.parse_args()
+
+    results = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            results.extend(check_directory(path, args.workers, not args.no_cache))
+        else:
+            results.extend(check_files([path], None, 1))
+
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=1)
+    sys.exit(0 if all(result['passed'] for result in results) else 1)
+
+if __name__ == "__main__":
+    main()